@@ -0,0 +1,231 @@
+"""
+Аналитика расходов: суммы по периодам и категориям, скользящие суммы
+и изменения по месяцам
+
+Расходы загружаются из репозитория столбцами (сумма, категория, день)
+без создания объектов Expense, после чего все показатели вычисляются над
+целыми столбцами. Если установлен NumPy, используются векторные операции
+(bincount, cumsum, searchsorted) и результаты возвращаются массивами NumPy,
+иначе - те же вычисления на чистом Python с результатами в array.array.
+
+Пример:
+
+    columns = load_columns(expense_repo)
+    daily = period_totals(columns, 'day', start=date(2023, 1, 1))
+    last_week = rolling_totals(daily, 7)
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from itertools import islice
+from typing import Any, Iterator, NamedTuple
+
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository.abstract_repository import AbstractRepository
+from bookkeeper.repository.query import Period
+from bookkeeper.repository.sqlite_repository import SQliteRepository
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:  # без NumPy показатели вычисляются на чистом Python
+    HAS_NUMPY = False
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class ExpenseColumns(NamedTuple):
+    """
+    Расходы в виде столбцов, упорядоченных по дате расхода:
+    amount - суммы, category - id категорий, day - порядковые номера дней
+    (date.toordinal). Столбцы - массивы NumPy или array.array.
+    """
+    amount: Any
+    category: Any
+    day: Any
+
+
+class PeriodTotals(NamedTuple):
+    """
+    Суммы по периодам подряд, без пропусков:
+    starts - даты начала периодов, totals - массив сумм той же длины
+    """
+    starts: list[date]
+    totals: Any
+
+
+class MonthOverMonth(NamedTuple):
+    """
+    Суммы по месяцам и их изменения: deltas[i] = totals[i] - totals[i - 1],
+    для первого месяца изменение равно сумме за месяц
+    """
+    starts: list[date]
+    totals: Any
+    deltas: Any
+
+
+def load_columns(repo: AbstractRepository[Expense],
+                 where: dict[str, Any] | None = None,
+                 batch_size: int = 10000) -> ExpenseColumns:
+    """
+    Загрузить расходы, удовлетворяющие условию where, из репозитория
+    в столбцы, не создавая объекты там, где репозиторий это позволяет.
+    Столбцы пополняются пачками по batch_size строк; из SQliteRepository
+    номера дней выбираются запросом, без преобразования каждой даты.
+    """
+    amount, category, day = array("d"), array("q"), array("q")
+    for values, cats, days in _column_batches(repo, where, batch_size):
+        amount.extend(values)
+        category.extend(cats)
+        day.extend(days)
+    if HAS_NUMPY:
+        return ExpenseColumns(np.frombuffer(amount, dtype=np.float64),
+                              np.frombuffer(category, dtype=np.int64),
+                              np.frombuffer(day, dtype=np.int64))
+    return ExpenseColumns(amount, category, day)
+
+
+def _column_batches(repo: AbstractRepository[Expense],
+                    where: dict[str, Any] | None,
+                    batch_size: int) -> Iterator[tuple[Any, ...]]:
+    """ Пачки расходов в виде кортежей столбцов (суммы, категории, дни) """
+    fields = ("amount", "category", "expense_date")
+    if isinstance(repo, SQliteRepository):
+        for rows in repo.iter_batches(fields, where, batch_size,
+                                      order_by="expense_date",
+                                      day_fields=("expense_date",)):
+            yield tuple(zip(*rows))
+        return
+    values = repo.iter_values(fields, where, batch_size, order_by="expense_date")
+    while rows := list(islice(values, batch_size)):
+        amounts, cats, moments = zip(*rows)
+        yield amounts, cats, [moment.toordinal() for moment in moments]
+
+
+def _period_number(ordinal: int, period: Period) -> int:
+    """ Номер периода, содержащего день; номера соседних периодов идут подряд """
+    if period == "day":
+        return ordinal
+    if period == "week":
+        return (ordinal - 1) // 7
+    day = date.fromordinal(ordinal)
+    return day.year * 12 + day.month - 1
+
+
+def _period_start(number: int, period: Period) -> date:
+    if period == "day":
+        return date.fromordinal(number)
+    if period == "week":
+        return date.fromordinal(number * 7 + 1)
+    return date(number // 12, number % 12 + 1, 1)
+
+
+def _period_numbers(days: Any, period: Period) -> Any:
+    if not HAS_NUMPY:
+        cache: dict[int, int] = {}
+        numbers = []
+        for day in days:
+            number = cache.get(day)
+            if number is None:
+                number = cache[day] = _period_number(day, period)
+            numbers.append(number)
+        return numbers
+    if period == "day":
+        return days
+    if period == "week":
+        return (days - 1) // 7
+    months = (days - _EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]")
+    return months.astype(np.int64) + 1970 * 12
+
+
+def period_totals(columns: ExpenseColumns,
+                  period: Period = "day",
+                  start: date | None = None,
+                  end: date | None = None) -> PeriodTotals:
+    """
+    Суммы расходов по дням, неделям (с понедельника) или месяцам.
+    start, end - первый и последний учитываемые дни (по умолчанию - дни
+    первого и последнего расхода). Периоды без расходов входят в результат
+    с нулевой суммой.
+    """
+    days = columns.day
+    lo = 0 if start is None else _search(days, start.toordinal(), left=True)
+    hi = len(days) if end is None else _search(days, end.toordinal(), left=False)
+    if (start is None or end is None) and lo >= hi:
+        return PeriodTotals([], _zeros(0))
+    first_day = start.toordinal() if start is not None else days[lo]
+    last_day = end.toordinal() if end is not None else days[hi - 1]
+    first = _period_number(first_day, period)
+    count = max(_period_number(last_day, period) - first + 1, 0)
+    numbers = _period_numbers(days[lo:hi], period)
+    amounts = columns.amount[lo:hi]
+    if HAS_NUMPY:
+        totals = np.bincount(numbers - first, weights=amounts, minlength=count)
+    else:
+        totals = _zeros(count)
+        for number, amount in zip(numbers, amounts):
+            totals[number - first] += amount
+    return PeriodTotals([_period_start(first + i, period) for i in range(count)],
+                        totals)
+
+
+def category_totals(columns: ExpenseColumns) -> Any:
+    """
+    Суммы расходов по категориям: элемент с индексом i - сумма
+    по категории с id i
+    """
+    if HAS_NUMPY:
+        return np.bincount(columns.category, weights=columns.amount)
+    totals = _zeros(max(columns.category, default=-1) + 1)
+    for cat, amount in zip(columns.category, columns.amount):
+        totals[cat] += amount
+    return totals
+
+
+def rolling_totals(totals: PeriodTotals, window: int) -> PeriodTotals:
+    """
+    Скользящие суммы: для каждого периода - сумма за него и window - 1
+    предыдущих. Для 7- и 30-дневных окон передайте суммы по дням.
+    """
+    if window < 1:
+        raise ValueError("window must be positive")
+    values = totals.totals
+    if HAS_NUMPY:
+        cumulative = np.cumsum(values)
+        rolling = cumulative.copy()
+        rolling[window:] -= cumulative[:-window]
+        return PeriodTotals(totals.starts, rolling)
+    rolling = _zeros(len(values))
+    running = 0.0
+    for i, value in enumerate(values):
+        running += value
+        if i >= window:
+            running -= values[i - window]
+        rolling[i] = running
+    return PeriodTotals(totals.starts, rolling)
+
+
+def month_over_month(columns: ExpenseColumns) -> MonthOverMonth:
+    """ Суммы расходов по месяцам и их изменения относительно предыдущего """
+    monthly = period_totals(columns, "month")
+    values = monthly.totals
+    if HAS_NUMPY:
+        deltas = np.diff(values, prepend=0.0)
+    else:
+        deltas = array("d", (value - (values[i - 1] if i else 0.0)
+                             for i, value in enumerate(values)))
+    return MonthOverMonth(monthly.starts, values, deltas)
+
+
+def _search(days: Any, ordinal: int, left: bool) -> int:
+    """ Позиция дня в упорядоченном столбце дней """
+    if HAS_NUMPY:
+        return int(np.searchsorted(days, ordinal, side="left" if left else "right"))
+    return bisect_left(days, ordinal) if left else bisect_right(days, ordinal)
+
+
+def _zeros(size: int) -> Any:
+    if HAS_NUMPY:
+        return np.zeros(size)
+    return array("d", bytes(8 * size))
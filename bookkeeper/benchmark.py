@@ -0,0 +1,355 @@
+"""
+Замеры скорости репозиториев на синтетических данных
+
+Для каждого хранилища (backend) и объема данных создаются категории,
+бюджеты и расходы со случайными, но воспроизводимыми (seed) значениями,
+после чего замеряется время операций репозитория расходов (add, get,
+get_all с условием и без, update, delete), методов Category
+get_subcategories и get_all_parents и пересчета сумм в Bookkeeper.set_summ.
+Для каждой операции записываются число вызовов и время вызова: минимум,
+медиана, среднее, 95-й процентиль и максимум, в секундах.
+
+Результаты сохраняются в JSON вместе с описанием окружения, так что
+запуски можно сравнивать между собой: с параметром --baseline печатается
+отношение медиан к предыдущему запуску.
+
+Запуск из командной строки:
+
+    python -m bookkeeper.benchmark --backend memory --backend sqlite \\
+        --size 1k --size 100k --output benchmark.json
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Iterable, NamedTuple, Sequence
+
+from bookkeeper.models.budget import Budget
+from bookkeeper.models.category import Category
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository.abstract_repository import AbstractRepository
+from bookkeeper.repository.columnar_repository import ExpenseColumnRepository
+from bookkeeper.repository.log_repository import ExpenseLogRepository
+from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.query import Between
+from bookkeeper.repository.sqlite_repository import (
+    DatetimeStorage, SQliteDatabase, SQliteRepository
+)
+
+_SIZES = {"k": 1000, "M": 1000000}
+
+
+class Repositories(NamedTuple):
+    """ Репозитории категорий, бюджетов и расходов одного хранилища """
+    category: AbstractRepository[Category]
+    budget: AbstractRepository[Budget]
+    expense: AbstractRepository[Expense]
+
+
+class Dataset(NamedTuple):
+    """ Синтетические данные: categories - пары (название, родитель) """
+    categories: list[tuple[str, str | None]]
+    budgets: list[Budget]
+    expenses: list[Expense]
+
+
+class Timing(NamedTuple):
+    """ Результат замера операции; времена вызова - в секундах """
+    backend: str
+    size: int
+    operation: str
+    calls: int
+    total: float
+    min: float
+    median: float
+    mean: float
+    p95: float
+    max: float
+
+
+def _memory(stack: ExitStack, directory: str) -> Repositories:
+    del stack, directory
+    return Repositories(
+        MemoryRepository[Category](indexes=["name", "parent"]),
+        MemoryRepository[Budget](),
+        MemoryRepository[Expense](indexes=["category"], sorted_indexes=["expense_date"]))
+
+
+def _sqlite(stack: ExitStack, directory: str,
+            storage: DatetimeStorage = "text") -> Repositories:
+    db = stack.enter_context(SQliteDatabase(os.path.join(directory, "bench.db")))
+    return Repositories(
+        SQliteRepository[Category](db, Category),
+        SQliteRepository[Budget](db, Budget),
+        SQliteRepository[Expense](db, Expense, datetime_storage=storage))
+
+
+def _sqlite_epoch(stack: ExitStack, directory: str) -> Repositories:
+    return _sqlite(stack, directory, "epoch")
+
+
+def _columnar(stack: ExitStack, directory: str) -> Repositories:
+    repos = _memory(stack, directory)
+    return repos._replace(expense=ExpenseColumnRepository())
+
+
+def _log(stack: ExitStack, directory: str) -> Repositories:
+    repos = _memory(stack, directory)
+    expense_repo = ExpenseLogRepository(os.path.join(directory, "expenses.log"))
+    stack.callback(expense_repo.close)
+    return repos._replace(expense=expense_repo)
+
+
+BACKENDS: dict[str, Callable[[ExitStack, str], Repositories]] = {
+    "memory": _memory,
+    "sqlite": _sqlite,
+    "sqlite-epoch": _sqlite_epoch,
+    "columnar": _columnar,
+    "log": _log,
+}
+
+
+def parse_size(text: str) -> int:
+    """ Объем данных: целое число, можно с суффиксом k или M (1k, 100k, 1M) """
+    multiplier = _SIZES.get(text[-1:], 1)
+    number = text[:-1] if text[-1:] in _SIZES else text
+    try:
+        size = int(number) * multiplier
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size {text!r}") from None
+    if size < 1:
+        raise argparse.ArgumentTypeError("size must be positive")
+    return size
+
+
+def generate(size: int, seed: int = 0, today: date | None = None) -> Dataset:
+    """
+    Создать size расходов за три года до today, категории (одну на тысячу
+    расходов, не меньше десяти) в иерархии глубиной до пяти уровней
+    и бюджеты на день, неделю и месяц
+    """
+    rnd = random.Random(seed)
+    today = today or date.today()
+    categories: list[tuple[str, str | None]] = []
+    depths: list[int] = []
+    for number in range(max(10, size // 1000)):
+        parent = rnd.randrange(number) if number and rnd.random() < 0.7 else None
+        if parent is not None and depths[parent] >= 4:
+            parent = None
+        depths.append(0 if parent is None else depths[parent] + 1)
+        categories.append((f"category {number}",
+                           None if parent is None else categories[parent][0]))
+    budgets = [Budget(1000, 1), Budget(7000, 7), Budget(30000, 31)]
+    start = datetime.combine(today, datetime.min.time()) - timedelta(days=3 * 365)
+    span = int(timedelta(days=3 * 365 + 1).total_seconds())
+    comments = ["", "кофе", "обед", "такси", "продукты на неделю", "подарок"]
+    expenses = [
+        Expense(rnd.randrange(1, 5000), rnd.randrange(1, len(categories) + 1),
+                start + timedelta(seconds=rnd.randrange(span)), start,
+                comment=rnd.choice(comments))
+        for _ in range(size)
+    ]
+    expenses.sort(key=lambda exp: exp.expense_date)
+    return Dataset(categories, budgets, expenses)
+
+
+def _timing(backend: str, size: int, operation: str, times: list[float]) -> Timing:
+    ordered = sorted(times)
+    return Timing(backend, size, operation, len(times), sum(times), ordered[0],
+                  statistics.median(ordered), statistics.fmean(ordered),
+                  ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], ordered[-1])
+
+
+def _measure(func: Callable[[Any], Any], args: Iterable[Any]) -> list[float]:
+    """ Время каждого вызова func(arg) """
+    clock = time.perf_counter
+    times = []
+    for arg in args:
+        start = clock()
+        func(arg)
+        times.append(clock() - start)
+    return times
+
+
+def _expense_operations(repo: AbstractRepository[Expense], data: Dataset,
+                        calls: int, repeat: int,
+                        rnd: random.Random) -> dict[str, list[float]]:
+    """ Времена операций репозитория расходов, заполненного данными data """
+    expenses = data.expenses
+    size = len(expenses)
+    sample = rnd.sample(range(1, size + 1), min(size, 2 * calls))
+    read, changed = sample[:calls], sample[calls:]
+    first = expenses[size // 2].expense_date
+    month = Between(first, first + timedelta(days=31))
+    categories = [rnd.randrange(1, len(data.categories) + 1) for _ in range(repeat)]
+    found = [obj for obj in map(repo.get, read) if obj is not None]
+    updated = [Expense(obj.amount + 1, obj.category, obj.expense_date, obj.added_date,
+                       obj.comment, obj.pk) for obj in found]
+    return {
+        "get": _measure(repo.get, read),
+        "get_all": _measure(lambda _: repo.get_all(), range(repeat)),
+        "get_all_where_category": _measure(
+            lambda pk: repo.get_all({"category": pk}), categories),
+        "get_all_where_month": _measure(
+            lambda _: repo.get_all({"expense_date": month}), range(repeat)),
+        "update": _measure(repo.update, updated),
+        "add": _measure(repo.add, (Expense(100, 1, first, first, comment="new")
+                                   for _ in range(calls))),
+        "delete": _measure(repo.delete, changed),
+    }
+
+
+def _category_operations(repo: AbstractRepository[Category], calls: int,
+                         rnd: random.Random) -> dict[str, list[float]]:
+    cats = repo.get_all()
+    deepest = max(cats, key=lambda cat: len(list(cat.get_all_parents(repo))))
+    roots = [cat for cat in cats if cat.parent is None]
+    return {
+        "category.get_subcategories": _measure(
+            lambda cat: list(cat.get_subcategories(repo)),
+            (rnd.choice(roots) for _ in range(max(1, calls // 100)))),
+        "category.get_all_parents": _measure(
+            lambda cat: list(cat.get_all_parents(repo)), [deepest] * calls),
+    }
+
+
+class _SilentView:  # pylint: disable=too-few-public-methods
+    """ Представление без интерфейса: Bookkeeper работает без окна """
+
+    def __getattr__(self, name: str) -> Callable[..., None]:
+        return lambda *args, **kwargs: None
+
+
+def _presenter_operations(repos: Repositories, repeat: int) -> dict[str, list[float]]:
+    """ Время Bookkeeper.set_summ; без PySide6 презентер не импортируется """
+    try:
+        # pylint: disable-next=import-outside-toplevel
+        from bookkeeper.presenter import Bookkeeper
+    except ImportError:
+        return {}
+    bookkeeper = Bookkeeper(_SilentView(), repos.category, repos.budget, repos.expense)
+    return {"presenter.set_summ": _measure(lambda _: bookkeeper.set_summ(),
+                                           range(repeat))}
+
+
+def run_backend(backend: str, data: Dataset, *,  # pylint: disable=too-many-arguments
+                calls: int = 1000, repeat: int = 3,
+                directory: str | None = None, seed: int = 0) -> list[Timing]:
+    """
+    Замерить операции хранилища backend на данных data. Файлы хранилища
+    создаются во временном каталоге внутри directory и удаляются после замера.
+    """
+    size = len(data.expenses)
+    rnd = random.Random(seed)
+    with ExitStack() as stack:
+        workdir = stack.enter_context(tempfile.TemporaryDirectory(dir=directory))
+        repos = BACKENDS[backend](stack, workdir)
+        start = time.perf_counter()
+        Category.create_from_tree(data.categories, repos.category)
+        repos.budget.add_many(Budget(b.summa, b.term, b.category) for b in data.budgets)
+        with repos.expense.transaction():
+            repos.expense.add_many(Expense(e.amount, e.category, e.expense_date,
+                                           e.added_date, e.comment)
+                                   for e in data.expenses)
+        times = {"load": [time.perf_counter() - start]}
+        times.update(_expense_operations(repos.expense, data, calls, repeat, rnd))
+        times.update(_category_operations(repos.category, calls, rnd))
+        # Bookkeeper подписывается на изменения расходов: после его создания
+        # update и delete читали бы прежние объекты и пересчитывали суммы
+        times.update(_presenter_operations(repos, repeat))
+    return [_timing(backend, size, operation, op_times)
+            for operation, op_times in times.items()]
+
+
+def environment() -> dict[str, Any]:
+    """ Описание окружения для файла результатов """
+    versions: dict[str, str | None] = {}
+    for module in ("numpy", "PySide6"):
+        try:
+            versions[module] = importlib.import_module(module).__version__
+        except ImportError:
+            # без PySide6 замер Bookkeeper.set_summ пропускается
+            versions[module] = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "sqlite": sqlite3.sqlite_version,
+        "numpy": versions["numpy"],
+        "pyside6": versions["PySide6"],
+    }
+
+
+def compare(results: Sequence[Timing],
+            baseline: Sequence[dict[str, Any]]) -> dict[tuple[str, int, str], float]:
+    """
+    Отношения медиан results к медианам baseline (список results из JSON
+    предыдущего запуска) для операций, замеренных в обоих запусках
+    """
+    old = {(r["backend"], r["size"], r["operation"]): r["median"] for r in baseline}
+    ratios = {}
+    for timing in results:
+        key = (timing.backend, timing.size, timing.operation)
+        if old.get(key):
+            ratios[key] = timing.median / old[key]
+    return ratios
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """ Запуск замеров, см. описание модуля """
+    parser = argparse.ArgumentParser(description="Benchmark bookkeeper repositories")
+    parser.add_argument("--backend", choices=list(BACKENDS), action="append",
+                        help="storage to benchmark, may be repeated (default: all)")
+    parser.add_argument("--size", type=parse_size, action="append",
+                        help="number of expenses: 1k, 100k, 1M... (default: 1k)")
+    parser.add_argument("--calls", type=int, default=1000,
+                        help="calls of per-record operations (get, update...)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="calls of whole-table operations (get_all...)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--dir", help="directory for database files")
+    parser.add_argument("--output", default="-", help="JSON file, '-' for stdout")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.size or [1000]:
+        data = generate(size, args.seed)
+        for backend in args.backend or list(BACKENDS):
+            print(f"{backend}, {size} expenses...", file=sys.stderr)
+            results.extend(run_backend(backend, data, calls=args.calls,
+                                       repeat=args.repeat, directory=args.dir,
+                                       seed=args.seed))
+
+    report = {"environment": environment(),
+              "results": [timing._asdict() for timing in results]}
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            ratios = compare(results, json.load(file)["results"])
+        for (backend, size, operation), ratio in ratios.items():
+            print(f"{backend:>12} {size:>8} {operation:<28} {ratio:6.2f}x",
+                  file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Выгрузка расходов в CSV или JSON Lines
+
+Расходы читаются из репозитория курсором пачками (iter_values, без
+создания объектов Expense) и записываются в файл построчно, поэтому
+расход памяти не зависит от числа расходов. Вместо id категории
+записывается ее название и, по желанию, полный путь от категории
+верхнего уровня; категории читаются один раз в начале выгрузки.
+
+Запуск из командной строки:
+
+    python -m bookkeeper.exporter bookkeper.db expenses.csv --start 2023-01-01
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime, time
+from typing import Any, Iterable, Iterator, Literal, Sequence, TextIO
+
+from bookkeeper.models.category import Category
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository.abstract_repository import AbstractRepository
+from bookkeeper.repository.query import Between, Ge, In, Le
+from bookkeeper.repository.sqlite_repository import (
+    DatetimeStorage, SQliteDatabase, SQliteRepository
+)
+
+ExportFormat = Literal["csv", "jsonl"]
+
+_FIELDS = ("pk", "expense_date", "amount", "category", "comment", "added_date")
+
+
+class ExpenseExporter:
+    """
+    Выгрузка расходов из expense_repo с названиями категорий из category_repo.
+    Если category_path, в выгрузку добавляется столбец category_path - путь
+    к категории от верхнего уровня через separator.
+    Расходы без категории (или с удаленной категорией) получают пустое
+    название.
+    """
+
+    def __init__(self,
+                 expense_repo: AbstractRepository[Expense],
+                 category_repo: AbstractRepository[Category],
+                 category_path: bool = False,
+                 separator: str = " / ") -> None:
+        self.expense_repo = expense_repo
+        self.category_repo = category_repo
+        self.category_path = category_path
+        self.separator = separator
+
+    @property
+    def columns(self) -> list[str]:
+        """ Названия столбцов выгрузки """
+        columns = list(_FIELDS)
+        if self.category_path:
+            columns.insert(columns.index("category") + 1, "category_path")
+        return columns
+
+    def where(self,
+              start: date | None = None,
+              end: date | None = None,
+              categories: Iterable[int] | None = None,
+              subcategories: bool = True) -> dict[str, Any]:
+        """
+        Условие выборки для run: расходы с start по end включительно
+        (по дням) из категорий с id categories и, если subcategories,
+        всех их подкатегорий
+        """
+        where: dict[str, Any] = {}
+        low = None if start is None else datetime.combine(start, time())
+        high = None if end is None else datetime.combine(end, time.max)
+        if low is not None and high is not None:
+            if low > high:
+                raise ValueError("start must not be after end")
+            where["expense_date"] = Between(low, high)
+        elif low is not None:
+            where["expense_date"] = Ge(low)
+        elif high is not None:
+            where["expense_date"] = Le(high)
+        if categories is not None:
+            selected = set(categories)
+            if subcategories:
+                selected = self._with_subcategories(selected)
+            where["category"] = In(sorted(selected))
+        return where
+
+    def _with_subcategories(self, pks: set[int]) -> set[int]:
+        children: defaultdict[int | None, list[int]] = defaultdict(list)
+        for cat in self.category_repo.iter_all():
+            children[cat.parent].append(cat.pk)
+        selected, stack = set(pks), list(pks)
+        while stack:
+            for child in children[stack.pop()]:
+                if child not in selected:
+                    selected.add(child)
+                    stack.append(child)
+        return selected
+
+    def _category_columns(self) -> dict[int, tuple[str, ...]]:
+        """ Значения столбцов категории для каждого id категории """
+        cats = {cat.pk: cat for cat in self.category_repo.iter_all()}
+        paths: dict[int, str] = {}
+
+        def path(pk: int) -> str:
+            if pk not in paths:
+                cat = cats[pk]
+                parent = cat.parent
+                paths[pk] = cat.name if parent is None or parent not in cats else (
+                    path(parent) + self.separator + cat.name)
+            return paths[pk]
+
+        if self.category_path:
+            return {pk: (cat.name, path(pk)) for pk, cat in cats.items()}
+        return {pk: (cat.name,) for pk, cat in cats.items()}
+
+    def rows(self, where: dict[str, Any] | None = None,
+             batch_size: int = 10000) -> Iterator[tuple[Any, ...]]:
+        """ Перебрать строки выгрузки в порядке столбцов columns """
+        categories = self._category_columns()
+        missing = ("", "") if self.category_path else ("",)
+        for pk, expense_date, amount, category, comment, added_date in (
+                self.expense_repo.iter_values(_FIELDS, where, batch_size)):
+            yield (pk, expense_date, amount, *categories.get(category, missing),
+                   comment, added_date)
+
+    def run(self, target: str | os.PathLike[str] | TextIO,
+            fmt: ExportFormat = "csv",
+            where: dict[str, Any] | None = None,
+            batch_size: int = 10000) -> int:
+        """
+        Записать расходы, удовлетворяющие условию where (см. метод where),
+        в файл target (путь или текстовый файл, для CSV - открытый
+        с newline='') в формате fmt. Даты записываются в ISO 8601.
+        Вернуть число записанных расходов.
+        """
+        if fmt not in ("csv", "jsonl"):
+            raise ValueError(f"unknown export format {fmt!r}")
+        if isinstance(target, (str, os.PathLike)):
+            with open(target, "w", newline="", encoding="utf-8") as file:
+                return self.run(file, fmt, where, batch_size)
+        rows = self.rows(where, batch_size)
+        if fmt == "csv":
+            return _write_csv(target, self.columns, rows)
+        return _write_jsonl(target, self.columns, rows)
+
+
+def _iso(value: Any) -> Any:
+    return value.isoformat(" ") if isinstance(value, datetime) else value
+
+
+def _write_csv(file: TextIO, columns: Sequence[str],
+               rows: Iterable[tuple[Any, ...]]) -> int:
+    writer = csv.writer(file)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow([_iso(value) for value in row])
+        count += 1
+    return count
+
+
+def _write_jsonl(file: TextIO, columns: Sequence[str],
+                 rows: Iterable[tuple[Any, ...]]) -> int:
+    encoder = json.JSONEncoder(ensure_ascii=False, default=_iso)
+    count = 0
+    for row in rows:
+        file.write(encoder.encode(dict(zip(columns, row))))
+        file.write("\n")
+        count += 1
+    return count
+
+
+def _datetime_storage(db: SQliteDatabase) -> DatetimeStorage:
+    """ Способ хранения дат расходов по типу столбца expense_date """
+    columns = {row[1]: row[2] for row in db.connection.execute(
+        f"PRAGMA table_info({Expense.__name__})")}
+    return "epoch" if columns.get("expense_date") == "INTEGER" else "text"
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """ Выгрузка из базы данных приложения, см. описание модуля """
+    parser = argparse.ArgumentParser(description="Export expenses to CSV or JSON Lines")
+    parser.add_argument("database", help="SQLite database file")
+    parser.add_argument("output", help="output file, '-' for stdout")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None,
+                        help="output format (default: by file extension, else csv)")
+    parser.add_argument("--start", type=date.fromisoformat, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", type=date.fromisoformat, help="last day, YYYY-MM-DD")
+    parser.add_argument("--category", type=int, action="append",
+                        help="category id (with subcategories), may be repeated")
+    parser.add_argument("--category-path", action="store_true",
+                        help="add the full category path column")
+    parser.add_argument("--datetime-storage", choices=["text", "epoch"], default=None,
+                        help="how the database stores dates"
+                        + " (default: detected from the expense table)")
+    args = parser.parse_args(argv)
+    fmt: ExportFormat = args.format or (
+        "jsonl" if args.output.endswith((".jsonl", ".json")) else "csv")
+
+    # выгрузка только читает базу: схема не мигрирует и данные не меняются
+    with SQliteDatabase(args.database, read_only=True) as db:
+        exporter = ExpenseExporter(
+            SQliteRepository[Expense](
+                db, Expense,
+                datetime_storage=args.datetime_storage or _datetime_storage(db)),
+            SQliteRepository[Category](db, Category),
+            category_path=args.category_path)
+        where = exporter.where(args.start, args.end, args.category)
+        if args.output == "-":
+            count = exporter.run(sys.stdout, fmt, where)
+        else:
+            count = exporter.run(args.output, fmt, where)
+    print(f"{count} expenses exported", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Импорт расходов из CSV-выписок банка
+
+Файл читается построчно модулем csv, строки переводятся в объекты Expense
+и добавляются в репозиторий пачками фиксированного размера: каждая пачка -
+один вызов add_many в отдельной транзакции. В памяти одновременно
+находится не больше одной пачки, поэтому расход памяти не зависит
+от размера файла. Названия категорий переводятся в pk с кешированием,
+так что репозиторий категорий опрашивается один раз на каждое название.
+
+Пример:
+
+    importer = ExpenseImporter(expense_repo, category_repo,
+                               CsvFormat(amount="Сумма", category="Категория",
+                                         expense_date="Дата", delimiter=";",
+                                         date_format="%d.%m.%Y"))
+    result = importer.run("statement.csv", progress=print)
+"""
+
+import csv
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Callable, Iterator, NamedTuple, TextIO
+
+from bookkeeper.models.category import Category
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository.abstract_repository import AbstractRepository
+
+
+@dataclass(frozen=True)
+class CsvFormat:  # pylint: disable=too-many-instance-attributes
+    """
+    Формат выписки: названия столбцов с суммой, категорией (названием),
+    датой расхода и комментарием (None - столбца нет), формат даты
+    для datetime.strptime (None - ISO 8601), разделитель и кодировка файла.
+    Если debit_negative, расходы записаны в выписке отрицательными суммами:
+    знак суммы меняется, а строки с положительной суммой (поступления)
+    считаются ошибочными.
+    """
+    amount: str = "amount"
+    category: str = "category"
+    expense_date: str = "expense_date"
+    comment: str | None = "comment"
+    date_format: str | None = None
+    delimiter: str = ","
+    encoding: str = "utf-8-sig"
+    debit_negative: bool = False
+
+
+class ImportProgress(NamedTuple):
+    """
+    Ход импорта: rows - прочитано строк, imported - добавлено расходов,
+    skipped - пропущено ошибочных строк, elapsed - прошло секунд
+    """
+    rows: int
+    imported: int
+    skipped: int
+    elapsed: float
+
+    @property
+    def rate(self) -> float:
+        """ Скорость импорта, строк в секунду """
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.rows} rows, {self.imported} imported, {self.skipped} skipped,"
+                f" {self.elapsed:.1f} s ({self.rate:.0f} rows/s)")
+
+
+def parse_amount(text: str) -> int:
+    """
+    Перевести сумму из выписки в целое число: допускаются пробелы между
+    разрядами и запятая в качестве десятичного разделителя, дробная часть
+    округляется до целого
+    """
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    cleaned = "".join(text.split()).replace(",", ".")
+    try:
+        value = Decimal(cleaned)
+    except InvalidOperation:
+        raise ValueError(f"invalid amount {text!r}") from None
+    if not value.is_finite():
+        raise ValueError(f"invalid amount {text!r}")
+    return int(value.to_integral_value(ROUND_HALF_UP))
+
+
+class ExpenseImporter:
+    """
+    Импорт расходов из CSV в expense_repo. Категории ищутся по названию
+    в category_repo; если категории нет, она создается (create_categories)
+    или строка считается ошибочной.
+    """
+
+    def __init__(self,
+                 expense_repo: AbstractRepository[Expense],
+                 category_repo: AbstractRepository[Category],
+                 csv_format: CsvFormat = CsvFormat(),
+                 create_categories: bool = False) -> None:
+        self.expense_repo = expense_repo
+        self.category_repo = category_repo
+        self.csv_format = csv_format
+        self.create_categories = create_categories
+        self._categories: dict[str, int | None] = {}
+        # в выписках много строк с одной датой: каждая строка разбирается один раз
+        self._parse_date = lru_cache(maxsize=4096)(self._date_parser)
+
+    def _date_parser(self, text: str) -> datetime:
+        if self.csv_format.date_format is None:
+            return datetime.fromisoformat(text.strip())
+        return datetime.strptime(text.strip(), self.csv_format.date_format)
+
+    def category_pk(self, name: str) -> int:
+        """ pk категории с названием name, см. описание класса """
+        name = name.strip()
+        if name not in self._categories:
+            found = self.category_repo.get_all({"name": name})
+            if len(found) > 1:
+                raise ValueError(f"ambiguous category {name!r}")
+            if found:
+                self._categories[name] = found[0].pk
+            elif self.create_categories and name:
+                self._categories[name] = self.category_repo.add(Category(name))
+            else:
+                self._categories[name] = None
+        pk = self._categories[name]
+        if pk is None:
+            raise ValueError(f"unknown category {name!r}")
+        return pk
+
+    def _parse(self, row: list[str], positions: list[int]) -> Expense:
+        """ Перевести строку CSV в Expense; positions - номера нужных столбцов """
+        amount_text, category, expense_date, *comment = (row[i] for i in positions)
+        amount = parse_amount(amount_text)
+        if self.csv_format.debit_negative:
+            amount = -amount
+        if amount < 0:
+            raise ValueError(f"not an expense: {amount_text!r}")
+        return Expense(amount, self.category_pk(category), self._parse_date(expense_date),
+                       comment=comment[0] if comment else "")
+
+    def _batches(self, file: TextIO, batch_size: int,
+                 skip_invalid: bool) -> Iterator[tuple[int, int, list[Expense]]]:
+        """ Пачки расходов вместе с числом прочитанных и пропущенных строк """
+        fmt = self.csv_format
+        reader = csv.reader(file, delimiter=fmt.delimiter)
+        header = next(reader, [])
+        columns = [name for name in (fmt.amount, fmt.category, fmt.expense_date,
+                                     fmt.comment) if name is not None]
+        missing = [name for name in columns if name not in header]
+        if missing:
+            raise ValueError(f"columns not found: {', '.join(missing)}")
+        positions = [header.index(name) for name in columns]
+        rows = skipped = 0
+        batch: list[Expense] = []
+        for row in reader:
+            if not row:
+                continue
+            rows += 1
+            try:
+                batch.append(self._parse(row, positions))
+            except (ValueError, TypeError, IndexError) as exc:
+                if not skip_invalid:
+                    raise ValueError(f"line {reader.line_num}: {exc}") from exc
+                skipped += 1
+            if len(batch) >= batch_size:
+                yield rows, skipped, batch
+                batch = []
+        yield rows, skipped, batch
+
+    def run(self, source: str | os.PathLike[str] | TextIO,
+            batch_size: int = 1000,
+            skip_invalid: bool = False,
+            progress: Callable[[ImportProgress], None] | None = None) -> ImportProgress:
+        """
+        Импортировать расходы из файла source (путь или текстовый файл,
+        открытый с newline=''). После каждой пачки вызывается progress.
+        Ошибочные строки пропускаются (skip_invalid) или прерывают импорт
+        исключением ValueError с номером строки; пачки, добавленные до этого,
+        остаются в репозитории.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, newline="", encoding=self.csv_format.encoding) as file:
+                return self.run(file, batch_size, skip_invalid, progress)
+        start = time.perf_counter()
+        result = ImportProgress(0, 0, 0, 0.0)
+        for rows, skipped, batch in self._batches(source, batch_size, skip_invalid):
+            if batch:
+                with self.expense_repo.transaction():
+                    self.expense_repo.add_many(batch)
+            result = ImportProgress(rows, result.imported + len(batch), skipped,
+                                    time.perf_counter() - start)
+            if progress is not None:
+                progress(result)
+        return result
@@ -3,9 +3,9 @@
 """
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Iterator
+from typing import ClassVar, Iterator
 
-from ..repository.abstract_repository import AbstractRepository
+from ..repository.abstract_repository import AbstractRepository, Index
 
 
 @dataclass
@@ -19,6 +19,8 @@ class Category:
     parent: int | None = None
     pk: int = 0
 
+    indexes: ClassVar[tuple[Index, ...]] = (Index("name"), Index("parent"))
+
     def get_parent(self,
                    repo: AbstractRepository['Category']) -> 'Category | None':
         """
@@ -100,6 +102,10 @@ class Category:
         со стороны СУБД, результат, возможно, будет корректным, если исходные
         данные корректны за исключением сортировки. Если нет, то нет.
         "Мусор на входе, мусор на выходе".
+        Родитель определяется по названию, поэтому названия в дереве
+        не должны повторяться; иначе вызывается ValueError и ничего
+        не добавляется.
+        Категории одного уровня иерархии добавляются одним вызовом add_many.
 
         Parameters
         ----------
@@ -111,8 +117,16 @@ class Category:
         Список созданных объектов Category
         """
         created: dict[str, Category] = {}
+        levels: dict[str, int] = {}
+        by_level: defaultdict[int, list[tuple[str, str | None]]] = defaultdict(list)
         for child, parent in tree:
-            cat = cls(child, created[parent].pk if parent is not None else None)
-            repo.add(cat)
-            created[child] = cat
-        return list(created.values())
+            if child in levels:
+                raise ValueError(f"Category name {child!r} is repeated in the tree")
+            levels[child] = levels[parent] + 1 if parent is not None else 0
+            by_level[levels[child]].append((child, parent))
+        for level in sorted(by_level):
+            cats = [cls(child, created[parent].pk if parent is not None else None)
+                    for child, parent in by_level[level]]
+            repo.add_many(cats)
+            created.update((cat.name, cat) for cat in cats)
+        return [created[child] for child, _ in tree]
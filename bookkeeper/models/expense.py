@@ -4,6 +4,9 @@
 
 from dataclasses import dataclass, field
 from datetime import datetime
+from typing import ClassVar
+
+from ..repository.abstract_repository import Index
 
 
 @dataclass(slots=True)
@@ -23,3 +26,5 @@ class Expense:
     added_date: datetime = field(default_factory=datetime.now)
     comment: str = ''
     pk: int = 0
+
+    indexes: ClassVar[tuple[Index, ...]] = (Index('expense_date'), Index('category'))
@@ -1,13 +1,19 @@
+import os
 import sys
 
-from typing import Protocol, Callable
-from datetime import datetime, timedelta, date
+from typing import Protocol, Callable, Iterable
+from datetime import datetime, time, timedelta, date
 from bookkeeper.models.category import Category
 from bookkeeper.models.expense import Expense
 from bookkeeper.models.budget import Budget
 from bookkeeper.view.app_window import MainWindow
-from bookkeeper.repository.sqlite_repository import SQliteRepository
-from bookkeeper.repository.abstract_repository import AbstractRepository
+from bookkeeper.repository.sqlite_repository import SQliteDatabase, SQliteRepository
+from bookkeeper.repository.abstract_repository import AbstractRepository, ChangeEvent
+from bookkeeper.repository.cached_repository import CachedRepository
+from bookkeeper.repository.instrumentation import (
+    InstrumentedRepository, StatementLog, dump_stats
+)
+from bookkeeper.repository.query import Ge, TimeBucket
 
 
 class AbstractView(Protocol):
@@ -60,7 +66,7 @@ class AbstractView(Protocol):
 
     def set_expense_list(
         self,
-        expenses: list[Expense],
+        expenses: Iterable[Expense],
         categories: dict[int, str],
     ) -> None:
         pass
@@ -111,6 +117,7 @@ class Bookkeeper:
         self.set_categories()
         self.set_expense_list()
         self.set_summ()
+        self.expense_repository.subscribe(self.update_summ)
         self.view.do_show()
 
     def set_budget(self) -> None:
@@ -120,8 +127,7 @@ class Bookkeeper:
             budg_for_week = Budget(self.week_budg, 7)
             budg_for_month = Budget(self.month_budg, 31)
             self.budgets = [budg_for_day, budg_for_week, budg_for_month]
-            for budgs in self.budgets:
-                self.budget_repository.add(budgs)
+            self.budget_repository.add_many(self.budgets)
         self.view.set_budget(self.budgets)
 
     def set_categories(self) -> None:
@@ -131,13 +137,12 @@ class Bookkeeper:
             home_cat = Category("Дом")
             products_cat = Category("Продукты")
             categories = [transport_cat, home_cat, products_cat]
-            for cat in categories:
-                self.category_repository.add(cat)
+            self.category_repository.add_many(categories)
         self.view.set_categories(categories)
 
     def set_expense_list(self) -> None:
         self.view.clear_expense_table()
-        expenses = self.expense_repository.get_all()
+        expenses = self.expense_repository.iter_all()
         cat_list = self.category_repository.get_all()
         categories = {}
         for item in cat_list:
@@ -148,19 +153,45 @@ class Bookkeeper:
         self.day_summ = 0
         self.week_summ = 0
         self.month_summ = 0
-        expenses = self.expense_repository.get_all()
-        if len(expenses) != 0:
-            today = date.today()
-            week = today - timedelta(7)
-            month = today - timedelta(31)
-            for exp in expenses:
-                exp_date = exp.expense_date.date()
-                if exp_date >= month:
-                    self.month_summ += exp.amount
-                if exp_date >= week:
-                    self.week_summ += exp.amount
-                if exp_date >= today:
-                    self.day_summ += exp.amount
+        today = date.today()
+        week = today - timedelta(7)
+        month = today - timedelta(31)
+        daily = self.expense_repository.aggregate(
+            "sum", "amount",
+            where={"expense_date": Ge(datetime.combine(month, time()))},
+            group_by=TimeBucket("expense_date", "day"),
+        )
+        for exp_date, amount in daily.items():
+            if exp_date >= month:
+                self.month_summ += amount
+            if exp_date >= week:
+                self.week_summ += amount
+            if exp_date >= today:
+                self.day_summ += amount
+        self.show_summ()
+
+    def update_summ(self, events: list[ChangeEvent[Expense]]) -> None:
+        """
+        Пересчитать суммы расходов по изменениям, не перечитывая расходы
+        """
+        for event in events:
+            if event.old is not None:
+                self._add_to_summ(event.old, -1)
+            if event.new is not None:
+                self._add_to_summ(event.new, 1)
+        self.show_summ()
+
+    def _add_to_summ(self, exp: Expense, sign: int) -> None:
+        today = date.today()
+        exp_date = exp.expense_date.date()
+        if exp_date >= today - timedelta(31):
+            self.month_summ += sign * exp.amount
+        if exp_date >= today - timedelta(7):
+            self.week_summ += sign * exp.amount
+        if exp_date >= today:
+            self.day_summ += sign * exp.amount
+
+    def show_summ(self) -> None:
         summs = list(map(float, [self.day_summ, self.week_summ, self.month_summ]))
         self.view.set_summ(summs)
 
@@ -180,7 +211,6 @@ class Bookkeeper:
             prim_key = cat_list[0].pk
         exp = Expense(amount, prim_key, date, comment=com, pk=pk)
         self.expense_repository.update(exp)
-        self.set_summ()
 
     def add_expense(self, amount: int, cat: str, date: datetime) -> None:
         cat_list = self.category_repository.get_all({"name": cat})
@@ -188,21 +218,20 @@ class Bookkeeper:
         prim_key = cat_list[0].pk
         exp = Expense(amount, prim_key, date)
         self.expense_repository.add(exp)
-        self.set_summ()
 
     def delete_category(self, name: str) -> None:
         cat_list = self.category_repository.get_all({"name": name})
         assert len(cat_list) == 1
         prim_key = cat_list[0].pk
-        self.category_repository.delete(prim_key)
+        with self.category_repository.transaction(), \
+                self.expense_repository.transaction():
+            self.category_repository.delete(prim_key)
+            expenses = self.expense_repository.get_all({"category": prim_key})
+            self.expense_repository.update_many(
+                Expense(exp.amount, 0, exp.expense_date, comment=exp.comment, pk=exp.pk)
+                for exp in expenses
+            )
         self.set_expense_list()
-        expenses = self.expense_repository.get_all()
-        for exp in expenses:
-            if exp.category == prim_key:
-                upd_exp = Expense(
-                    exp.amount, 0, exp.expense_date, comment=exp.comment, pk=exp.pk
-                )
-                self.expense_repository.update(upd_exp)
 
     def add_category(self, cat: Category) -> None:
         self.category_repository.add(cat)
@@ -212,12 +241,31 @@ class Bookkeeper:
 
 
 def main() -> int:
+    """
+    Запуск приложения. Если задана переменная окружения BOOKKEEPER_PROFILE,
+    вызовы репозиториев и SQL-запросы инструментируются, а статистика
+    записывается после закрытия окна в JSON-файл, указанный в переменной
+    """
     main_window = MainWindow()
-    cat_repo = SQliteRepository[Category]("bookkeper.db", Category)
-    budget_repo = SQliteRepository[Budget]("bookkeper.db", Budget)
-    expense_repo = SQliteRepository[Expense]("bookkeper.db", Expense)
-
-    Bookkeeper(main_window, cat_repo, budget_repo, expense_repo)
+    profile = os.environ.get("BOOKKEEPER_PROFILE")
+    statement_log = None if profile is None else StatementLog()
+    with SQliteDatabase("bookkeper.db", statement_log) as db:
+        cat_repo: AbstractRepository[Category] = CachedRepository(
+            SQliteRepository[Category](db, Category))
+        budget_repo: AbstractRepository[Budget] = SQliteRepository[Budget](db, Budget)
+        expense_repo: AbstractRepository[Expense] = SQliteRepository[Expense](
+            db, Expense, datetime_storage="epoch")
+        if profile is not None:
+            cat_repo = InstrumentedRepository(cat_repo, "category")
+            budget_repo = InstrumentedRepository(budget_repo, "budget")
+            expense_repo = InstrumentedRepository(expense_repo, "expense")
+
+        Bookkeeper(main_window, cat_repo, budget_repo, expense_repo)
+        if profile is not None:
+            repos = [cat_repo, budget_repo, expense_repo]
+            dump_stats(profile, {repo.name: repo for repo in repos
+                                 if isinstance(repo, InstrumentedRepository)},
+                       statement_log)
     return 0
 
 
@@ -8,7 +8,17 @@
 """
 
 from abc import ABC, abstractmethod
-from typing import Generic, TypeVar, Protocol, Any
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass
+from itertools import islice
+from typing import (
+    Generic, TypeVar, Protocol, Any, Callable, Iterable, Iterator, Literal, Sequence
+)
+
+from bookkeeper.repository.fulltext import parse_query
+from bookkeeper.repository.query import (
+    AggregateFunction, GroupBy, Keyset, OrderBy, PageCursor, aggregate_objects
+)
 
 
 class Model(Protocol):  # pylint: disable=too-few-public-methods
@@ -21,6 +31,57 @@ class Model(Protocol):  # pylint: disable=too-few-public-methods
 T = TypeVar('T', bound=Model)
 
 
+@dataclass(frozen=True, init=False)
+class Index:
+    """
+    Описание индекса по одному или нескольким полям модели.
+    Модель объявляет индексы в атрибуте класса indexes, например:
+
+        indexes: ClassVar[tuple[Index, ...]] = (Index('name', unique=True),)
+
+    Репозитории, которые поддерживают индексы, создают их сами.
+    fulltext - полнотекстовый индекс по текстовым полям для метода search.
+    """
+    fields: tuple[str, ...]
+    unique: bool = False
+    fulltext: bool = False
+
+    def __init__(self, *fields: str, unique: bool = False,
+                 fulltext: bool = False) -> None:
+        if not fields:
+            raise ValueError('index must contain at least one field')
+        if unique and fulltext:
+            raise ValueError('fulltext index cannot be unique')
+        object.__setattr__(self, 'fields', fields)
+        object.__setattr__(self, 'unique', unique)
+        object.__setattr__(self, 'fulltext', fulltext)
+
+
+ChangeKind = Literal['added', 'updated', 'deleted']
+
+
+@dataclass(frozen=True)
+class ChangeEvent(Generic[T]):
+    """
+    Изменение одной записи репозитория.
+    kind - вид изменения, old - объект до изменения (None для 'added'),
+    new - объект после изменения (None для 'deleted').
+    """
+    kind: ChangeKind
+    old: T | None
+    new: T | None
+
+    @property
+    def pk(self) -> int:
+        """ id измененной записи """
+        obj = self.new if self.new is not None else self.old
+        assert obj is not None
+        return obj.pk
+
+
+Subscriber = Callable[[list[ChangeEvent[T]]], None]
+
+
 class AbstractRepository(ABC, Generic[T]):
     """
     Абстрактный репозиторий.
@@ -30,8 +91,38 @@ class AbstractRepository(ABC, Generic[T]):
     get_all
     update
     delete
+
+    Пакетные методы add_many, update_many, delete_many по умолчанию
+    вызывают одиночные методы в цикле, iter_all и iter_values перебирают
+    результат get_all, а aggregate вычисляется перебором объектов;
+    реализации могут переопределить их более эффективным способом.
+    Метод transaction по умолчанию ничего не делает.
+
+    Подписчики, зарегистрированные методом subscribe, получают списки
+    событий ChangeEvent; реализации сообщают о них методом _notify.
     """
 
+    _subscribers: tuple[Subscriber[T], ...] = ()
+
+    def subscribe(self, callback: Subscriber[T]) -> Callable[[], None]:
+        """
+        Подписаться на изменения: после каждой успешной операции записи
+        callback вызывается со списком событий ChangeEvent, пакетная
+        операция дает один список. Вернуть функцию отмены подписки.
+        """
+        self._subscribers = (*self._subscribers, callback)
+
+        def unsubscribe() -> None:
+            self._subscribers = tuple(s for s in self._subscribers if s is not callback)
+
+        return unsubscribe
+
+    def _notify(self, events: list[ChangeEvent[T]]) -> None:
+        """ Передать события всем подписчикам """
+        if events:
+            for callback in self._subscribers:
+                callback(events)
+
     @abstractmethod
     def add(self, obj: T) -> int:
         """
@@ -44,12 +135,105 @@ class AbstractRepository(ABC, Generic[T]):
         """ Получить объект по id """
 
     @abstractmethod
-    def get_all(self, where: dict[str, Any] | None = None) -> list[T]:
+    def get_all(self, where: dict[str, Any] | None = None, *,
+                order_by: OrderBy = None,
+                limit: int | None = None,
+                offset: int = 0) -> list[T]:
         """
         Получить все записи по некоторому условию
         where - условие в виде словаря {'название_поля': значение}
-        если условие не задано (по умолчанию), вернуть все записи
+        если условие не задано (по умолчанию), вернуть все записи.
+        Значением может быть предикат из модуля query (Ge, Between, In...).
+        order_by - поле или список полей для сортировки,
+        '-' перед названием поля - сортировка по убыванию
+        limit, offset - сколько записей вернуть и сколько пропустить
+        """
+
+    def iter_all(self, where: dict[str, Any] | None = None,
+                 batch_size: int = 1000, *,
+                 order_by: OrderBy = None,
+                 limit: int | None = None,
+                 offset: int = 0) -> Iterator[T]:
+        """
+        Перебрать все записи по некоторому условию, не загружая их в память
+        целиком. Параметры выборки задаются так же, как в get_all,
+        batch_size - сколько записей реализация может читать за раз.
+        """
+        yield from self.get_all(where, order_by=order_by, limit=limit, offset=offset)
+
+    def page(self, key: str = 'pk', limit: int = 100, *,
+             after: PageCursor | None = None,
+             before: PageCursor | None = None,
+             where: dict[str, Any] | None = None) -> list[T]:
+        """
+        Получить страницу из limit записей, упорядоченных по (key, pk).
+        key - название поля, '-' перед названием - порядок по убыванию.
+        after - курсор (значение поля key, pk) последней записи предыдущей
+        страницы, before - курсор первой записи следующей страницы
+        (для перехода назад); без курсора - первая страница.
+        Записи всегда возвращаются в порядке ключа. Курсор записи можно
+        получить методом query.Keyset.cursor_of.
+        """
+        keyset = Keyset.from_cursors(key, after, before)
+        objs = (obj for obj in self.iter_all(where, order_by=keyset.order_by())
+                if keyset.match(obj))
+        return keyset.arrange(islice(objs, limit))
+
+    def search(self, query: str, field: str,
+               where: dict[str, Any] | None = None,
+               limit: int | None = None) -> list[T]:
+        """
+        Полнотекстовый поиск по текстовому полю field: записи,
+        удовлетворяющие условию where, текст которых соответствует
+        запросу query (синтаксис см. в модуле fulltext), - более
+        релевантные раньше. Реализация по умолчанию перебирает все записи
+        и возвращает найденные в порядке перебора; репозитории
+        с полнотекстовыми индексами ищут по индексу и ранжируют результат.
+        """
+        text_query = parse_query(query)
+        if not text_query:
+            return []
+        found = (obj for obj in self.iter_all(where)
+                 if text_query.matches(getattr(obj, field)))
+        return list(islice(found, limit))
+
+    def iter_values(self, fields: Sequence[str],
+                    where: dict[str, Any] | None = None,
+                    batch_size: int = 1000, *,
+                    order_by: OrderBy = None,
+                    limit: int | None = None,
+                    offset: int = 0) -> Iterator[tuple[Any, ...]]:
+        """
+        Перебрать значения полей fields записей, удовлетворяющих условию,
+        в виде кортежей, не создавая объекты там, где это возможно.
+        Параметры выборки задаются так же, как в iter_all.
         """
+        for obj in self.iter_all(where, batch_size, order_by=order_by,
+                                 limit=limit, offset=offset):
+            yield tuple(getattr(obj, name) for name in fields)
+
+    def get_values(self, fields: Sequence[str],
+                   where: dict[str, Any] | None = None, *,
+                   order_by: OrderBy = None,
+                   limit: int | None = None,
+                   offset: int = 0) -> list[tuple[Any, ...]]:
+        """ Получить список значений полей fields, см. iter_values """
+        return list(self.iter_values(fields, where, order_by=order_by,
+                                     limit=limit, offset=offset))
+
+    def aggregate(self, func: AggregateFunction,
+                  field: str = 'pk',
+                  where: dict[str, Any] | None = None,
+                  group_by: GroupBy = None) -> Any:
+        """
+        Вычислить агрегатную функцию func ('sum', 'count', 'min', 'max')
+        от поля field по записям, удовлетворяющим условию where.
+        Без группировки вернуть одно значение, с группировкой group_by
+        (название поля или query.TimeBucket) - словарь {ключ группы: значение}.
+        Пустые значения пропускаются; сумма, минимум и максимум по пустому
+        набору - None, количество - 0.
+        """
+        return aggregate_objects(self.iter_all(where), func, field, group_by)
 
     @abstractmethod
     def update(self, obj: T) -> None:
@@ -58,3 +242,30 @@ class AbstractRepository(ABC, Generic[T]):
     @abstractmethod
     def delete(self, pk: int) -> None:
         """ Удалить запись """
+
+    def transaction(self) -> AbstractContextManager[Any]:
+        """
+        Единица работы: изменения, сделанные внутри блока with, фиксируются
+        вместе при выходе из него или откатываются при исключении.
+        Репозитории, хранящие данные в одной базе, разделяют транзакцию.
+        Реализация по умолчанию не поддерживает откат и применяет
+        изменения сразу.
+        """
+        return nullcontext()
+
+    def add_many(self, objs: Iterable[T]) -> list[int]:
+        """
+        Добавить несколько объектов в репозиторий, вернуть список их id,
+        также записать id в атрибут pk каждого объекта.
+        """
+        return [self.add(obj) for obj in objs]
+
+    def update_many(self, objs: Iterable[T]) -> None:
+        """ Обновить данные о нескольких объектах """
+        for obj in objs:
+            self.update(obj)
+
+    def delete_many(self, pks: Iterable[int]) -> None:
+        """ Удалить несколько записей """
+        for pk in pks:
+            self.delete(pk)
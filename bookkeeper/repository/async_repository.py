@@ -0,0 +1,264 @@
+"""
+Модуль описывает асинхронный интерфейс репозитория
+
+Асинхронный репозиторий повторяет методы AbstractRepository, но их нужно
+ожидать (await repo.add(obj)), а записи перебираются асинхронно
+(async for obj in repo.iter_all()). Реализация AsyncRepository оборачивает
+обычный репозиторий: блокирующие вызовы выполняются в исполнителе
+(concurrent.futures.Executor), чтобы не останавливать цикл событий,
+а быстрые репозитории в памяти вызываются напрямую.
+"""
+
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import (
+    Any, AsyncIterator, Callable, Generic, Iterable, Iterator, Sequence, TypeVar
+)
+
+from bookkeeper.repository.abstract_repository import AbstractRepository, T
+from bookkeeper.repository.query import AggregateFunction, GroupBy, OrderBy, PageCursor
+from bookkeeper.repository.sqlite_repository import (
+    DatetimeStorage, SQliteDatabase, SQliteRepository
+)
+
+R = TypeVar('R')
+
+
+class AbstractAsyncRepository(ABC, Generic[T]):
+    """
+    Абстрактный асинхронный репозиторий. Смысл методов и параметров
+    тот же, что у AbstractRepository.
+    """
+
+    @abstractmethod
+    async def add(self, obj: T) -> int:
+        """ Добавить объект в репозиторий, вернуть id объекта """
+
+    @abstractmethod
+    async def get(self, pk: int) -> T | None:
+        """ Получить объект по id """
+
+    @abstractmethod
+    async def get_all(self, where: dict[str, Any] | None = None, *,
+                      order_by: OrderBy = None,
+                      limit: int | None = None,
+                      offset: int = 0) -> list[T]:
+        """ Получить все записи по некоторому условию """
+
+    @abstractmethod
+    def iter_all(self, where: dict[str, Any] | None = None,
+                 batch_size: int = 1000, *,
+                 order_by: OrderBy = None,
+                 limit: int | None = None,
+                 offset: int = 0) -> AsyncIterator[T]:
+        """ Асинхронно перебрать записи по некоторому условию """
+
+    @abstractmethod
+    async def page(self, key: str = 'pk', limit: int = 100, *,
+                   after: PageCursor | None = None,
+                   before: PageCursor | None = None,
+                   where: dict[str, Any] | None = None) -> list[T]:
+        """ Получить страницу записей, упорядоченных по (key, pk) """
+
+    @abstractmethod
+    async def search(self, query: str, field: str,
+                     where: dict[str, Any] | None = None,
+                     limit: int | None = None) -> list[T]:
+        """ Полнотекстовый поиск по текстовому полю field """
+
+    @abstractmethod
+    async def get_values(self, fields: Sequence[str],
+                         where: dict[str, Any] | None = None, *,
+                         order_by: OrderBy = None,
+                         limit: int | None = None,
+                         offset: int = 0) -> list[tuple[Any, ...]]:
+        """ Получить список значений полей fields """
+
+    @abstractmethod
+    async def aggregate(self, func: AggregateFunction,
+                        field: str = 'pk',
+                        where: dict[str, Any] | None = None,
+                        group_by: GroupBy = None) -> Any:
+        """ Вычислить агрегатную функцию """
+
+    @abstractmethod
+    async def update(self, obj: T) -> None:
+        """ Обновить данные об объекте """
+
+    @abstractmethod
+    async def delete(self, pk: int) -> None:
+        """ Удалить запись """
+
+    @abstractmethod
+    async def add_many(self, objs: Iterable[T]) -> list[int]:
+        """ Добавить несколько объектов """
+
+    @abstractmethod
+    async def update_many(self, objs: Iterable[T]) -> None:
+        """ Обновить данные о нескольких объектах """
+
+    @abstractmethod
+    async def delete_many(self, pks: Iterable[int]) -> None:
+        """ Удалить несколько записей """
+
+
+class AsyncRepository(AbstractAsyncRepository[T]):
+    """
+    Асинхронная обертка над обычным репозиторием inner.
+
+    Если задан executor, каждый вызов выполняется в нем, иначе - сразу
+    в цикле событий (подходит для MemoryRepository). Исполнитель с одним
+    потоком выполняет поставленные в очередь запросы подряд, не дожидаясь,
+    пока цикл событий заберет результат предыдущего.
+    """
+
+    def __init__(self, inner: AbstractRepository[T],
+                 executor: Executor | None = None) -> None:
+        self.inner = inner
+        self._executor = executor
+
+    async def run(self, func: Callable[..., R], *args: Any, **kwargs: Any) -> R:
+        """
+        Выполнить функцию там же, где выполняются вызовы репозитория.
+        Так можно выполнить составную операцию, например, в транзакции:
+
+            await repo.run(lambda: ...)
+        """
+        if self._executor is None:
+            return func(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+                                          partial(func, *args, **kwargs))
+
+    async def add(self, obj: T) -> int:
+        return await self.run(self.inner.add, obj)
+
+    async def get(self, pk: int) -> T | None:
+        return await self.run(self.inner.get, pk)
+
+    async def get_all(self, where: dict[str, Any] | None = None, *,
+                      order_by: OrderBy = None,
+                      limit: int | None = None,
+                      offset: int = 0) -> list[T]:
+        return await self.run(self.inner.get_all, where,
+                              order_by=order_by, limit=limit, offset=offset)
+
+    def iter_all(self, where: dict[str, Any] | None = None,
+                 batch_size: int = 1000, *,
+                 order_by: OrderBy = None,
+                 limit: int | None = None,
+                 offset: int = 0) -> AsyncIterator[T]:
+        """
+        Перебрать записи, получая их из исполнителя пачками по batch_size
+        """
+        return self._iter_batches(
+            self.inner.iter_all(where, batch_size, order_by=order_by,
+                                limit=limit, offset=offset),
+            batch_size,
+        )
+
+    async def _iter_batches(self, records: Iterator[T],
+                            batch_size: int) -> AsyncIterator[T]:
+        try:
+            while batch := await self.run(lambda: list(islice(records, batch_size))):
+                for obj in batch:
+                    yield obj
+        finally:
+            close = getattr(records, "close", None)
+            if close is not None:
+                await self.run(close)
+
+    async def page(self, key: str = 'pk', limit: int = 100, *,
+                   after: PageCursor | None = None,
+                   before: PageCursor | None = None,
+                   where: dict[str, Any] | None = None) -> list[T]:
+        return await self.run(self.inner.page, key, limit,
+                              after=after, before=before, where=where)
+
+    async def search(self, query: str, field: str,
+                     where: dict[str, Any] | None = None,
+                     limit: int | None = None) -> list[T]:
+        return await self.run(self.inner.search, query, field, where, limit)
+
+    async def get_values(self, fields: Sequence[str],
+                         where: dict[str, Any] | None = None, *,
+                         order_by: OrderBy = None,
+                         limit: int | None = None,
+                         offset: int = 0) -> list[tuple[Any, ...]]:
+        return await self.run(self.inner.get_values, fields, where,
+                              order_by=order_by, limit=limit, offset=offset)
+
+    async def aggregate(self, func: AggregateFunction,
+                        field: str = 'pk',
+                        where: dict[str, Any] | None = None,
+                        group_by: GroupBy = None) -> Any:
+        return await self.run(self.inner.aggregate, func, field, where, group_by)
+
+    async def update(self, obj: T) -> None:
+        await self.run(self.inner.update, obj)
+
+    async def delete(self, pk: int) -> None:
+        await self.run(self.inner.delete, pk)
+
+    async def add_many(self, objs: Iterable[T]) -> list[int]:
+        return await self.run(self.inner.add_many, list(objs))
+
+    async def update_many(self, objs: Iterable[T]) -> None:
+        await self.run(self.inner.update_many, list(objs))
+
+    async def delete_many(self, pks: Iterable[int]) -> None:
+        await self.run(self.inner.delete_many, list(pks))
+
+
+class AsyncSQliteRepository(AsyncRepository[T]):
+    """
+    Асинхронный репозиторий SQLite. Все запросы выполняются в отдельном
+    потоке со своим соединением. Создается корутиной create: открытие
+    репозитория (проверка и миграция схемы) тоже выполняется в исполнителе
+    и не останавливает цикл событий. Чтобы несколько репозиториев одной
+    базы работали в одном потоке (и могли разделять транзакции в run),
+    передайте им общие SQliteDatabase и executor. Собственный исполнитель
+    и подключение закрываются методом close.
+    """
+
+    def __init__(self, sqlite: SQliteRepository[T], executor: Executor,
+                 owns_executor: bool = False) -> None:
+        self.sqlite = sqlite
+        self._owns_executor = owns_executor
+        super().__init__(sqlite, executor)
+
+    @classmethod
+    async def create(cls,
+                     base_name: str | os.PathLike[str] | SQliteDatabase,
+                     class_type: type,
+                     executor: Executor | None = None,
+                     datetime_storage: DatetimeStorage = "text",
+                     text_indexes: Iterable[str] = ()) -> "AsyncSQliteRepository[Any]":
+        """
+        Открыть SQliteRepository в исполнителе executor (по умолчанию -
+        собственном однопоточном) и обернуть его
+        """
+        owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix="sqlite-repository")
+        loop = asyncio.get_running_loop()
+        try:
+            sqlite = await loop.run_in_executor(executor, partial(
+                SQliteRepository[Any], base_name, class_type, datetime_storage,
+                text_indexes=list(text_indexes)))
+        except BaseException:
+            if owns_executor:
+                executor.shutdown()
+            raise
+        return cls(sqlite, executor, owns_executor)
+
+    async def close(self) -> None:
+        """ Закрыть подключение и остановить собственный исполнитель """
+        await self.run(self.sqlite.close)
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,228 @@
+"""
+Модуль описывает кеширующую обертку над репозиторием
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Iterable, Iterator, Sequence
+
+from bookkeeper.repository.abstract_repository import AbstractRepository, Subscriber, T
+from bookkeeper.repository.query import (
+    AggregateFunction, GroupBy, OrderBy, PageCursor, matches, order_fields
+)
+
+
+@dataclass
+class CacheStats:
+    """
+    Счетчики кеша: попадания, промахи и вытеснения
+    """
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+@dataclass
+class _CachedQuery:
+    where: dict[str, Any] | None
+    offset: int
+    objects: list[Any]
+    pks: set[int]
+
+
+class CachedRepository(AbstractRepository[T]):
+    """
+    Репозиторий, кеширующий чтение из другого репозитория (inner).
+
+    Последние полученные объекты хранятся в карте идентичности {pk: объект}
+    размером не более max_objects, результаты get_all - в кеше запросов
+    размером не более max_queries, ключ которого - условие выборки.
+    При переполнении вытесняются давно не использованные записи (LRU).
+    Запись выполняется сразу во внутреннем репозитории, после чего из кеша
+    удаляются только затронутые записи: сам объект и результаты запросов,
+    в которые объект входил или должен войти после изменения.
+    Счетчики доступны в атрибутах object_stats и query_stats.
+
+    Кеш корректен, только если внутренний репозиторий изменяется
+    исключительно через эту обертку.
+    """
+
+    def __init__(self, inner: AbstractRepository[T],
+                 max_objects: int = 1024,
+                 max_queries: int = 128) -> None:
+        self.inner = inner
+        self.max_objects = max_objects
+        self.max_queries = max_queries
+        self.object_stats = CacheStats()
+        self.query_stats = CacheStats()
+        self._objects: OrderedDict[int, T] = OrderedDict()
+        self._queries: OrderedDict[Hashable, _CachedQuery] = OrderedDict()
+
+    def clear(self) -> None:
+        """ Очистить кеш """
+        self._objects.clear()
+        self._queries.clear()
+
+    def _remember(self, obj: T) -> None:
+        self._objects[obj.pk] = obj
+        self._objects.move_to_end(obj.pk)
+        if len(self._objects) > self.max_objects:
+            self._objects.popitem(last=False)
+            self.object_stats.evictions += 1
+
+    @staticmethod
+    def _query_key(where: dict[str, Any] | None, order_by: OrderBy,
+                   limit: int | None, offset: int) -> Hashable | None:
+        key = (
+            None if where is None else tuple(sorted(where.items())),
+            tuple(order_fields(order_by)),
+            limit,
+            offset,
+        )
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _invalidate(self, pk: int, new_obj: T | None = None) -> None:
+        """
+        Удалить из кеша объект pk и результаты запросов, которые могут
+        измениться: объект входил в результат, удовлетворяет условию после
+        изменения или запрос пропускает первые записи (offset)
+        """
+        self._objects.pop(pk, None)
+        for key, query in list(self._queries.items()):
+            if (pk in query.pks or query.offset
+                    or (new_obj is not None and matches(new_obj, query.where))):
+                del self._queries[key]
+
+    def subscribe(self, callback: Subscriber[T]) -> Callable[[], None]:
+        """ Подписаться на изменения внутреннего репозитория """
+        return self.inner.subscribe(callback)
+
+    @contextmanager
+    def transaction(self) -> Iterator[Any]:
+        """
+        Транзакция внутреннего репозитория. При откате кеш очищается,
+        так как он мог запомнить отмененные изменения.
+        """
+        try:
+            with self.inner.transaction() as transaction:
+                yield transaction
+        except BaseException:
+            self.clear()
+            raise
+
+    def add(self, obj: T) -> int:
+        pk = self.inner.add(obj)
+        self._invalidate(pk, obj)
+        return pk
+
+    def get(self, pk: int) -> T | None:
+        obj = self._objects.get(pk)
+        if obj is not None:
+            self._objects.move_to_end(pk)
+            self.object_stats.hits += 1
+            return obj
+        self.object_stats.misses += 1
+        obj = self.inner.get(pk)
+        if obj is not None:
+            self._remember(obj)
+        return obj
+
+    def get_all(self, where: dict[str, Any] | None = None, *,
+                order_by: OrderBy = None,
+                limit: int | None = None,
+                offset: int = 0) -> list[T]:
+        key = self._query_key(where, order_by, limit, offset)
+        query = None if key is None else self._queries.get(key)
+        if query is not None:
+            self._queries.move_to_end(key)
+            self.query_stats.hits += 1
+            return list(query.objects)
+        self.query_stats.misses += 1
+        objs = self.inner.get_all(where, order_by=order_by, limit=limit, offset=offset)
+        if key is not None:
+            self._queries[key] = _CachedQuery(
+                None if where is None else dict(where), offset,
+                list(objs), {obj.pk for obj in objs},
+            )
+            if len(self._queries) > self.max_queries:
+                self._queries.popitem(last=False)
+                self.query_stats.evictions += 1
+        for obj in objs:
+            self._remember(obj)
+        return objs
+
+    def iter_all(self, where: dict[str, Any] | None = None,
+                 batch_size: int = 1000, *,
+                 order_by: OrderBy = None,
+                 limit: int | None = None,
+                 offset: int = 0) -> Iterator[T]:
+        """
+        Перебрать записи из кеша запросов, если результат там есть,
+        иначе - из внутреннего репозитория без кеширования
+        """
+        key = self._query_key(where, order_by, limit, offset)
+        query = None if key is None else self._queries.get(key)
+        if query is not None:
+            self.query_stats.hits += 1
+            yield from list(query.objects)
+            return
+        yield from self.inner.iter_all(where, batch_size, order_by=order_by,
+                                       limit=limit, offset=offset)
+
+    def page(self, key: str = 'pk', limit: int = 100, *,
+             after: PageCursor | None = None,
+             before: PageCursor | None = None,
+             where: dict[str, Any] | None = None) -> list[T]:
+        return self.inner.page(key, limit, after=after, before=before, where=where)
+
+    def search(self, query: str, field: str,
+               where: dict[str, Any] | None = None,
+               limit: int | None = None) -> list[T]:
+        return self.inner.search(query, field, where, limit)
+
+    def iter_values(self, fields: Sequence[str],
+                    where: dict[str, Any] | None = None,
+                    batch_size: int = 1000, *,
+                    order_by: OrderBy = None,
+                    limit: int | None = None,
+                    offset: int = 0) -> Iterator[tuple[Any, ...]]:
+        return self.inner.iter_values(fields, where, batch_size, order_by=order_by,
+                                      limit=limit, offset=offset)
+
+    def aggregate(self, func: AggregateFunction,
+                  field: str = 'pk',
+                  where: dict[str, Any] | None = None,
+                  group_by: GroupBy = None) -> Any:
+        return self.inner.aggregate(func, field, where, group_by)
+
+    def update(self, obj: T) -> None:
+        self.inner.update(obj)
+        self._invalidate(obj.pk, obj)
+
+    def delete(self, pk: int) -> None:
+        self.inner.delete(pk)
+        self._invalidate(pk)
+
+    def add_many(self, objs: Iterable[T]) -> list[int]:
+        objs = list(objs)
+        pks = self.inner.add_many(objs)
+        for obj in objs:
+            self._invalidate(obj.pk, obj)
+        return pks
+
+    def update_many(self, objs: Iterable[T]) -> None:
+        objs = list(objs)
+        self.inner.update_many(objs)
+        for obj in objs:
+            self._invalidate(obj.pk, obj)
+
+    def delete_many(self, pks: Iterable[int]) -> None:
+        pks = list(pks)
+        self.inner.delete_many(pks)
+        for pk in pks:
+            self._invalidate(pk)
@@ -0,0 +1,363 @@
+"""
+Модуль описывает репозиторий расходов, хранящий данные по столбцам
+
+Вместо словаря объектов Expense значения каждого поля хранятся в отдельном
+массиве array целых чисел: сумма, категория и даты (в микросекундах
+от 1970-01-01) занимают по 8 байт на запись, комментарии хранятся один раз
+в таблице строк, а в записи - только номер строки. Объекты Expense
+создаются только при чтении. Если установлен NumPy, условия выборки
+и агрегатные функции вычисляются сразу над целыми столбцами.
+"""
+
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository.abstract_repository import AbstractRepository, ChangeEvent
+from bookkeeper.repository.query import (
+    AggregateFunction, Between, Eq, GroupBy, In, Ne, Lt, Le, Gt, Ge, OrderBy,
+    Predicate, apply_query, as_predicate, convert_predicate, order_fields
+)
+from bookkeeper.repository.row_mapper import EPOCH, MICROSECOND
+
+try:
+    import numpy as np
+except ImportError:  # без NumPy столбцы обрабатываются на чистом Python
+    HAS_NUMPY = False
+else:
+    HAS_NUMPY = True
+
+_INT_FIELDS = ("amount", "category")
+_DATE_FIELDS = ("expense_date", "added_date")
+_FIELDS = ("pk", *_INT_FIELDS, *_DATE_FIELDS, "comment")
+
+
+def _to_micro(value: datetime) -> int:
+    return (value - EPOCH) // MICROSECOND
+
+
+def _from_micro(value: int) -> datetime:
+    return EPOCH + value * MICROSECOND
+
+
+def _numpy_mask(column: Any, predicate: Predicate) -> Any:
+    """ Вычислить условие над столбцом NumPy, вернуть массив bool или None """
+    result: Any = None
+    match predicate:
+        case Eq(value=None) | Lt(value=None) | Le(value=None) | Gt(value=None) \
+                | Ge(value=None) | Between(low=None) | Between(high=None):
+            result = np.zeros(len(column), dtype=bool)
+        case Ne(value=None):
+            result = np.ones(len(column), dtype=bool)
+        case Eq(value=value):
+            result = column == value
+        case Ne(value=value):
+            result = column != value
+        case Lt(value=value):
+            result = column < value
+        case Le(value=value):
+            result = column <= value
+        case Gt(value=value):
+            result = column > value
+        case Ge(value=value):
+            result = column >= value
+        case Between(low=low, high=high):
+            result = (column >= low) & (column <= high)
+        case In(values=values):
+            result = np.isin(column, [v for v in values if v is not None])
+    return result
+
+
+class ExpenseColumnRepository(AbstractRepository[Expense]):
+    """
+    Репозиторий расходов (Expense), хранящий значения полей в столбцах.
+
+    Записи лежат в порядке возрастания pk, объект находится по pk делением
+    пополам. Удаленные записи помечаются и физически удаляются, когда их
+    становится больше половины. Условия where на поля amount, category,
+    даты, pk и равенство комментария проверяются по столбцам, не создавая
+    объекты (с NumPy - векторно), остальные - по созданным объектам.
+    Даты должны быть наивными (без часового пояса).
+    """
+
+    def __init__(self, objs: Iterable[Expense] = ()) -> None:
+        self._pk = array("q")
+        self._alive = bytearray()
+        self._columns = {name: array("q") for name in (*_INT_FIELDS, *_DATE_FIELDS)}
+        self._comment = array("l")
+        self._strings: list[str] = []
+        self._string_ids: dict[str, int] = {}
+        self._last_pk = 0
+        self._deleted = 0
+        self.add_many(objs)
+
+    def __len__(self) -> int:
+        return len(self._pk) - self._deleted
+
+    def _intern(self, value: str) -> int:
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return string_id
+
+    def _position(self, pk: int) -> int | None:
+        i = bisect_left(self._pk, pk)
+        if i < len(self._pk) and self._pk[i] == pk and self._alive[i]:
+            return i
+        return None
+
+    def _materialize(self, i: int) -> Expense:
+        columns = self._columns
+        return Expense(
+            columns["amount"][i],
+            columns["category"][i],
+            _from_micro(columns["expense_date"][i]),
+            _from_micro(columns["added_date"][i]),
+            self._strings[self._comment[i]],
+            self._pk[i],
+        )
+
+    def _write(self, i: int, obj: Expense) -> None:
+        columns = self._columns
+        columns["amount"][i] = obj.amount
+        columns["category"][i] = obj.category
+        columns["expense_date"][i] = _to_micro(obj.expense_date)
+        columns["added_date"][i] = _to_micro(obj.added_date)
+        self._comment[i] = self._intern(obj.comment)
+
+    def _append(self, obj: Expense) -> None:
+        self._last_pk += 1
+        obj.pk = self._last_pk
+        self._pk.append(obj.pk)
+        self._alive.append(1)
+        for column in self._columns.values():
+            column.append(0)
+        self._comment.append(0)
+        self._write(len(self._pk) - 1, obj)
+
+    def _check(self, obj: Expense) -> None:
+        """ Проверить значения полей до записи в столбцы """
+        array("q", [obj.amount, obj.category, _to_micro(obj.expense_date),
+                    _to_micro(obj.added_date)])
+        if not isinstance(obj.comment, str):
+            raise TypeError(f"comment must be str, not {type(obj.comment).__name__}")
+
+    def _compact(self) -> None:
+        """ Удалить помеченные записи, если их больше половины """
+        if self._deleted * 2 <= len(self._pk):
+            return
+        keep = [i for i, alive in enumerate(self._alive) if alive]
+        self._pk = array("q", (self._pk[i] for i in keep))
+        self._columns = {name: array("q", (column[i] for i in keep))
+                         for name, column in self._columns.items()}
+        self._comment = array("l", (self._comment[i] for i in keep))
+        self._alive = bytearray(b"\x01" * len(keep))
+        self._deleted = 0
+
+    def _raw_column(self, name: str) -> 'array[int]':
+        if name == "pk":
+            return self._pk
+        if name == "comment":
+            return self._comment
+        return self._columns[name]
+
+    def _converter(self, name: str) -> Callable[[Any], Any]:
+        if name in _DATE_FIELDS:
+            return _to_micro
+        if name == "comment":
+            return lambda value: self._string_ids.get(value, -1)
+        return lambda value: value
+
+    def _select(self, where: dict[str, Any] | None) -> tuple[list[int], dict[str, Any]]:
+        """
+        Отобрать по столбцам позиции записей, удовлетворяющих условию.
+        Вернуть позиции и часть условия, которую нужно проверить по объектам.
+        """
+        rest: dict[str, Any] = {}
+        conditions = []
+        for name, value in (where or {}).items():
+            if name not in _FIELDS:
+                raise ValueError(f"Expense has no field {name!r}")
+            predicate = as_predicate(value)
+            if name == "comment" and not isinstance(predicate, (Eq, Ne, In)):
+                converted = None
+            else:
+                converted = convert_predicate(predicate, self._converter(name))
+            if converted is None:
+                rest[name] = value
+            else:
+                conditions.append((self._raw_column(name), converted))
+
+        if HAS_NUMPY:
+            mask = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+            for column, predicate in conditions:
+                mask &= _numpy_mask(np.frombuffer(column, dtype=column.typecode),
+                                    predicate)
+            return np.flatnonzero(mask).tolist(), rest
+
+        positions = [i for i, alive in enumerate(self._alive) if alive]
+        for column, predicate in conditions:
+            positions = [i for i in positions if predicate.match(column[i])]
+        return positions, rest
+
+    def _sort(self, positions: list[int], order_by: OrderBy) -> None:
+        """ Упорядочить позиции по столбцам """
+        for name, descending in reversed(order_fields(order_by)):
+            if name not in _FIELDS:
+                raise ValueError(f"Expense has no field {name!r}")
+            key = self._getter(name) if name == "comment" \
+                else self._raw_column(name).__getitem__
+            positions.sort(key=key, reverse=descending)
+
+    def add(self, obj: Expense) -> int:
+        if getattr(obj, "pk", None) != 0:
+            raise ValueError(f"trying to add object {obj} with filled `pk` attribute")
+        self._check(obj)
+        self._append(obj)
+        self._notify([ChangeEvent("added", None, obj)])
+        return obj.pk
+
+    def add_many(self, objs: Iterable[Expense]) -> list[int]:
+        objs = list(objs)
+        for obj in objs:
+            if getattr(obj, "pk", None) != 0:
+                raise ValueError(f"trying to add object {obj} with filled `pk` attribute")
+            self._check(obj)
+        for obj in objs:
+            self._append(obj)
+        self._notify([ChangeEvent("added", None, obj) for obj in objs])
+        return [obj.pk for obj in objs]
+
+    def get(self, pk: int) -> Expense | None:
+        i = self._position(pk)
+        return None if i is None else self._materialize(i)
+
+    def get_all(self, where: dict[str, Any] | None = None, *,
+                order_by: OrderBy = None,
+                limit: int | None = None,
+                offset: int = 0) -> list[Expense]:
+        return list(self.iter_all(where, order_by=order_by, limit=limit, offset=offset))
+
+    def iter_all(self, where: dict[str, Any] | None = None,
+                 batch_size: int = 1000, *,
+                 order_by: OrderBy = None,
+                 limit: int | None = None,
+                 offset: int = 0) -> Iterator[Expense]:
+        """
+        Отобрать и упорядочить записи по столбцам и создать объекты
+        только для выбранных записей
+        """
+        positions, rest = self._select(where)
+        self._sort(positions, order_by)
+        objs = (self._materialize(i) for i in positions)
+        return apply_query(objs, rest or None, None, limit, offset)
+
+    def iter_values(self, fields: Sequence[str],
+                    where: dict[str, Any] | None = None,
+                    batch_size: int = 1000, *,
+                    order_by: OrderBy = None,
+                    limit: int | None = None,
+                    offset: int = 0) -> Iterator[tuple[Any, ...]]:
+        """ Перебрать значения полей прямо из столбцов, не создавая объекты """
+        for name in fields:
+            if name not in _FIELDS:
+                raise ValueError(f"Expense has no field {name!r}")
+        positions, rest = self._select(where)
+        if rest:
+            yield from super().iter_values(fields, where, batch_size, order_by=order_by,
+                                           limit=limit, offset=offset)
+            return
+        self._sort(positions, order_by)
+        stop = None if limit is None else offset + limit
+        getters = [self._getter(name) for name in fields]
+        for i in positions[offset:stop]:
+            yield tuple(getter(i) for getter in getters)
+
+    def _getter(self, name: str) -> Callable[[int], Any]:
+        column = self._raw_column(name)
+        if name in _DATE_FIELDS:
+            return lambda i: _from_micro(column[i])
+        if name == "comment":
+            return lambda i: self._strings[column[i]]
+        return column.__getitem__
+
+    def aggregate(self, func: AggregateFunction,
+                  field: str = "pk",
+                  where: dict[str, Any] | None = None,
+                  group_by: GroupBy = None) -> Any:
+        """
+        Без группировки вычислить функцию над столбцом (с NumPy - векторно),
+        с группировкой - перебором значений
+        """
+        if func not in ("sum", "count", "min", "max"):
+            raise ValueError(f"unknown aggregate function {func!r}")
+        if field not in _FIELDS:
+            raise ValueError(f"Expense has no field {field!r}")
+        positions, rest = self._select(where)
+        if group_by is not None or rest or field == "comment":
+            return super().aggregate(func, field, where, group_by)
+        if func == "count":
+            return len(positions)
+        if not positions:
+            return None
+        column = self._raw_column(field)
+        if HAS_NUMPY:
+            selected = np.frombuffer(column, dtype=column.typecode)[positions]
+            result = int(getattr(selected, func)())
+        else:
+            values = [column[i] for i in positions]
+            reducers: dict[str, Callable[[list[int]], int]] = {
+                "sum": sum, "min": min, "max": max}
+            result = reducers[func](values)
+        if field in _DATE_FIELDS and func != "sum":
+            return _from_micro(result)
+        return result
+
+    def update(self, obj: Expense) -> None:
+        if obj.pk == 0:
+            raise ValueError("attempt to update object with unknown primary key")
+        i = self._position(obj.pk)
+        if i is None:
+            raise ValueError(f"Object with pk = {obj.pk} does not exist")
+        self._check(obj)
+        old = self._materialize(i) if self._subscribers else None
+        self._write(i, obj)
+        self._notify([ChangeEvent("updated", old, obj)])
+
+    def update_many(self, objs: Iterable[Expense]) -> None:
+        objs = list(objs)
+        positions = []
+        for obj in objs:
+            i = self._position(obj.pk) if obj.pk else None
+            if i is None:
+                raise ValueError("attempt to update object with unknown primary key")
+            self._check(obj)
+            positions.append(i)
+        events = []
+        for i, obj in zip(positions, objs):
+            old = self._materialize(i) if self._subscribers else None
+            self._write(i, obj)
+            events.append(ChangeEvent("updated", old, obj))
+        self._notify(events)
+
+    def delete(self, pk: int) -> None:
+        self.delete_many([pk])
+
+    def delete_many(self, pks: Iterable[int]) -> None:
+        positions: dict[int, None] = {}
+        for pk in pks:
+            i = self._position(pk)
+            if i is None or i in positions:
+                raise KeyError(pk)
+            positions[i] = None
+        events = []
+        for i in positions:
+            if self._subscribers:
+                events.append(ChangeEvent("deleted", self._materialize(i), None))
+            self._alive[i] = 0
+        self._deleted += len(positions)
+        self._compact()
+        self._notify(events)
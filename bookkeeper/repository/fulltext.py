@@ -0,0 +1,97 @@
+"""
+Модуль описывает полнотекстовые запросы, общие для всех репозиториев
+
+Текст разбивается на слова (последовательности букв и цифр) и приводится
+к нижнему регистру так же, как это делает токенизатор unicode61 SQLite
+FTS5 с remove_diacritics 0, поэтому поиск в памяти и в SQLite находит
+одни и те же записи.
+
+Синтаксис запроса:
+    кофе молоко    - оба слова (в любом месте текста)
+    "черный кофе"  - фраза: слова подряд
+    коф*           - слово, начинающееся с "коф"
+    "черный коф"*  - фраза, последнее слово которой - префикс
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Iterator
+
+_TOKEN = re.compile(r"[^\W_]+")
+_QUERY = re.compile(r'"([^"]*)("?\*?)|(\S+)')
+
+
+def tokenize(text: str | None) -> list[str]:
+    """ Слова текста в нижнем регистре """
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+@dataclass(frozen=True)
+class TextTerm:
+    """
+    Условие запроса: слово или фраза (tokens - слова подряд);
+    если prefix, последнее слово может быть началом слова текста
+    """
+    tokens: tuple[str, ...]
+    prefix: bool = False
+
+    def to_fts5(self) -> str:
+        """ Условие в синтаксисе FTS5 """
+        # слова состоят только из букв и цифр, кавычки экранировать не нужно
+        return '"' + " ".join(self.tokens) + '"' + ("*" if self.prefix else "")
+
+    def count_in(self, tokens: list[str]) -> int:
+        """ Сколько раз условие встречается в словах текста tokens """
+        size = len(self.tokens)
+        *head, last = self.tokens
+        count = 0
+        for start in range(len(tokens) - size + 1):
+            word = tokens[start + size - 1]
+            if (word.startswith(last) if self.prefix else word == last) and all(
+                    tokens[start + i] == token for i, token in enumerate(head)):
+                count += 1
+        return count
+
+
+@dataclass(frozen=True)
+class TextQuery:
+    """
+    Полнотекстовый запрос: текст должен содержать все условия terms.
+    Создается функцией parse_query.
+    """
+    terms: tuple[TextTerm, ...]
+
+    def __bool__(self) -> bool:
+        return bool(self.terms)
+
+    def __iter__(self) -> Iterator[TextTerm]:
+        return iter(self.terms)
+
+    def to_fts5(self) -> str:
+        """ Запрос в синтаксисе FTS5 MATCH """
+        return " ".join(term.to_fts5() for term in self.terms)
+
+    def matches(self, text: str | None) -> bool:
+        """ Удовлетворяет ли текст запросу """
+        tokens = tokenize(text)
+        return all(term.count_in(tokens) for term in self.terms)
+
+
+def parse_query(text: str) -> TextQuery:
+    """
+    Разобрать запрос (синтаксис см. в описании модуля). Знаки препинания
+    внутри слова разбивают его на фразу: "кофе-брейк" ищется как фраза
+    "кофе брейк". Пустой запрос не содержит условий.
+    """
+    terms = []
+    for match in _QUERY.finditer(text):
+        phrase, suffix, word = match.groups()
+        if word is not None:
+            prefix = word.endswith("*")
+            tokens = tokenize(word)
+        else:
+            prefix = suffix.endswith("*")
+            tokens = tokenize(phrase)
+        if tokens:
+            terms.append(TextTerm(tuple(tokens), prefix))
+    return TextQuery(tuple(terms))
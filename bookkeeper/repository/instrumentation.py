@@ -0,0 +1,366 @@
+"""
+Модуль описывает инструментирование репозиториев: статистику вызовов
+методов и журнал SQL-запросов
+
+InstrumentedRepository - обертка над любым репозиторием, считающая для
+каждого метода число вызовов, ошибок, возвращенных записей и гистограмму
+времени вызова. StatementLog - журнал запросов SQliteDatabase
+(см. параметр statement_log): статистика по тексту запроса и список
+медленных запросов, выполнявшихся дольше порога slow_threshold.
+
+Инструментирование включается явно: без обертки и журнала код
+репозиториев не меняется, а у включенных объектов его можно временно
+отключить атрибутом enabled. Статистика доступна во время работы
+(as_dict) и сохраняется в JSON функцией dump_stats.
+"""
+
+import dataclasses
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterable, Iterator, Mapping, Sequence, TextIO
+
+from bookkeeper.repository.abstract_repository import AbstractRepository, Subscriber, T
+from bookkeeper.repository.query import AggregateFunction, GroupBy, OrderBy, PageCursor
+
+_BUCKETS = 32
+
+
+@dataclass
+class LatencyHistogram:
+    """
+    Гистограмма времени вызовов: counts[i] - число вызовов, длившихся
+    от 2**(i - 1) до 2**i микросекунд (counts[0] - меньше микросекунды)
+    """
+    counts: list[int] = dataclasses.field(default_factory=lambda: [0] * _BUCKETS)
+    total: float = 0.0
+    max: float = 0.0
+
+    def record(self, seconds: float) -> None:
+        """ Учесть вызов длительностью seconds секунд """
+        bucket = min(int(seconds * 1e6).bit_length(), _BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    @property
+    def count(self) -> int:
+        """ Число вызовов """
+        return sum(self.counts)
+
+    def quantile(self, q: float) -> float:
+        """ Верхняя граница корзины, в которую попадает квантиль q, в секундах """
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << bucket) / 1e6, self.max)
+        return 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        """ Гистограмма и основные показатели в секундах """
+        count = self.count
+        return {
+            "count": count,
+            "total": self.total,
+            "mean": self.total / count if count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            "buckets_us": {str(1 << bucket): count
+                           for bucket, count in enumerate(self.counts) if count},
+        }
+
+
+@dataclass
+class OperationStats:
+    """ Статистика операции: вызовы, ошибки, строки (записи) и время """
+    calls: int = 0
+    errors: int = 0
+    rows: int = 0
+    latency: LatencyHistogram = dataclasses.field(default_factory=LatencyHistogram)
+
+    def record(self, seconds: float, rows: int = 0, error: bool = False) -> None:
+        """ Учесть вызов """
+        self.calls += 1
+        self.errors += error
+        self.rows += rows
+        self.latency.record(seconds)
+
+    def as_dict(self) -> dict[str, Any]:
+        """ Статистика в виде словаря для JSON """
+        return {"calls": self.calls, "errors": self.errors, "rows": self.rows,
+                "latency": self.latency.as_dict()}
+
+
+def _rows(result: Any) -> int:
+    """ Число записей в результате метода репозитория """
+    if result is None:
+        return 0
+    if isinstance(result, (list, dict)):
+        return len(result)
+    return 1
+
+
+class InstrumentedRepository(AbstractRepository[T]):
+    """
+    Репозиторий, собирающий статистику вызовов методов другого
+    репозитория (inner) в словаре stats {название метода: OperationStats}.
+    Для iter_all и iter_values учитывается время получения записей
+    из внутреннего итератора, без времени обработки записей вызывающим
+    кодом; вызов учитывается, когда перебор закончен или прерван.
+    Если enabled равен False, вызовы передаются без учета.
+    """
+
+    def __init__(self, inner: AbstractRepository[T], name: str | None = None) -> None:
+        self.inner = inner
+        self.name = name or type(inner).__name__
+        self.enabled = True
+        self.stats: dict[str, OperationStats] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, method: str, seconds: float, rows: int, error: bool) -> None:
+        with self._lock:
+            stats = self.stats.get(method)
+            if stats is None:
+                stats = self.stats[method] = OperationStats()
+            stats.record(seconds, rows, error)
+
+    def _call(self, method: str, rows: int | None, func: Callable[..., Any],
+              *args: Any, **kwargs: Any) -> Any:
+        """
+        Вызвать func и учесть вызов; rows - число затронутых записей,
+        None - по результату
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            self._record(method, time.perf_counter() - start, 0, True)
+            raise
+        self._record(method, time.perf_counter() - start,
+                     _rows(result) if rows is None else rows, False)
+        return result
+
+    def _iterate(self, method: str, items: Iterator[Any]) -> Iterator[Any]:
+        if not self.enabled:
+            yield from items
+            return
+        clock = time.perf_counter
+        elapsed, rows, error = 0.0, 0, False
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    elapsed += clock() - start
+                    break
+                except BaseException:
+                    elapsed += clock() - start
+                    error = True
+                    raise
+                elapsed += clock() - start
+                rows += 1
+                yield item
+        finally:
+            self._record(method, elapsed, rows, error)
+
+    def reset(self) -> None:
+        """ Обнулить статистику """
+        with self._lock:
+            self.stats = {}
+
+    def as_dict(self) -> dict[str, Any]:
+        """ Статистика по методам в виде словаря для JSON """
+        with self._lock:
+            return {method: stats.as_dict() for method, stats in self.stats.items()}
+
+    def subscribe(self, callback: Subscriber[T]) -> Callable[[], None]:
+        """ Подписаться на изменения внутреннего репозитория """
+        return self.inner.subscribe(callback)
+
+    @contextmanager
+    def transaction(self) -> Iterator[Any]:
+        """ Транзакция внутреннего репозитория """
+        with self.inner.transaction() as transaction:
+            yield transaction
+
+    def add(self, obj: T) -> int:
+        pk: int = self._call("add", 1, self.inner.add, obj)
+        return pk
+
+    def get(self, pk: int) -> T | None:
+        obj: T | None = self._call("get", None, self.inner.get, pk)
+        return obj
+
+    def get_all(self, where: dict[str, Any] | None = None, *,
+                order_by: OrderBy = None,
+                limit: int | None = None,
+                offset: int = 0) -> list[T]:
+        objs: list[T] = self._call("get_all", None, self.inner.get_all, where,
+                                   order_by=order_by, limit=limit, offset=offset)
+        return objs
+
+    def iter_all(self, where: dict[str, Any] | None = None,
+                 batch_size: int = 1000, *,
+                 order_by: OrderBy = None,
+                 limit: int | None = None,
+                 offset: int = 0) -> Iterator[T]:
+        return self._iterate("iter_all", self.inner.iter_all(
+            where, batch_size, order_by=order_by, limit=limit, offset=offset))
+
+    def page(self, key: str = 'pk', limit: int = 100, *,
+             after: PageCursor | None = None,
+             before: PageCursor | None = None,
+             where: dict[str, Any] | None = None) -> list[T]:
+        objs: list[T] = self._call("page", None, self.inner.page, key, limit,
+                                   after=after, before=before, where=where)
+        return objs
+
+    def search(self, query: str, field: str,
+               where: dict[str, Any] | None = None,
+               limit: int | None = None) -> list[T]:
+        objs: list[T] = self._call("search", None, self.inner.search, query, field,
+                                   where, limit)
+        return objs
+
+    def iter_values(self, fields: Sequence[str],
+                    where: dict[str, Any] | None = None,
+                    batch_size: int = 1000, *,
+                    order_by: OrderBy = None,
+                    limit: int | None = None,
+                    offset: int = 0) -> Iterator[tuple[Any, ...]]:
+        return self._iterate("iter_values", self.inner.iter_values(
+            fields, where, batch_size, order_by=order_by, limit=limit, offset=offset))
+
+    def get_values(self, fields: Sequence[str],
+                   where: dict[str, Any] | None = None, *,
+                   order_by: OrderBy = None,
+                   limit: int | None = None,
+                   offset: int = 0) -> list[tuple[Any, ...]]:
+        values: list[tuple[Any, ...]] = self._call(
+            "get_values", None, self.inner.get_values, fields, where,
+            order_by=order_by, limit=limit, offset=offset)
+        return values
+
+    def aggregate(self, func: AggregateFunction,
+                  field: str = 'pk',
+                  where: dict[str, Any] | None = None,
+                  group_by: GroupBy = None) -> Any:
+        return self._call("aggregate", None, self.inner.aggregate,
+                          func, field, where, group_by)
+
+    def update(self, obj: T) -> None:
+        self._call("update", 1, self.inner.update, obj)
+
+    def delete(self, pk: int) -> None:
+        self._call("delete", 1, self.inner.delete, pk)
+
+    def add_many(self, objs: Iterable[T]) -> list[int]:
+        pks: list[int] = self._call("add_many", None, self.inner.add_many, objs)
+        return pks
+
+    def update_many(self, objs: Iterable[T]) -> None:
+        objs = list(objs)
+        self._call("update_many", len(objs), self.inner.update_many, objs)
+
+    def delete_many(self, pks: Iterable[int]) -> None:
+        pks = list(pks)
+        self._call("delete_many", len(pks), self.inner.delete_many, pks)
+
+
+@dataclass
+class SlowStatement:
+    """ Медленный запрос: текст, параметры, время выполнения и момент начала """
+    sql: str
+    params: Any
+    seconds: float
+    started: datetime
+
+    def as_dict(self) -> dict[str, Any]:
+        """ Запрос в виде словаря для JSON """
+        return {"sql": self.sql, "params": repr(self.params), "seconds": self.seconds,
+                "started": self.started.isoformat(sep=" ")}
+
+
+class StatementLog:
+    """
+    Журнал SQL-запросов: статистика OperationStats по тексту запроса
+    (в statements, не больше max_statements различных текстов, остальные
+    учитываются под ключом OTHER) и последние max_slow запросов,
+    выполнявшихся не меньше slow_threshold секунд (в slow).
+    Время запроса - от выполнения до получения последней строки
+    результата; строки - прочитанные строки или число измененных строк.
+    Если enabled равен False, запросы не учитываются.
+    """
+    OTHER = "<other>"
+
+    def __init__(self, slow_threshold: float = 0.1,
+                 max_statements: int = 1000,
+                 max_slow: int = 100) -> None:
+        self.slow_threshold = slow_threshold
+        self.max_statements = max_statements
+        self.enabled = True
+        self.statements: dict[str, OperationStats] = {}
+        self.slow: deque[SlowStatement] = deque(maxlen=max_slow)
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, params: Any, seconds: float, rows: int,
+               error: bool = False) -> None:
+        """ Учесть выполненный запрос """
+        with self._lock:
+            stats = self.statements.get(sql)
+            if stats is None:
+                key = sql if len(self.statements) < self.max_statements else self.OTHER
+                stats = self.statements.setdefault(key, OperationStats())
+            stats.record(seconds, rows, error)
+            if seconds >= self.slow_threshold:
+                started = datetime.now() - timedelta(seconds=seconds)
+                self.slow.append(SlowStatement(sql, params, seconds, started))
+
+    def reset(self) -> None:
+        """ Очистить журнал """
+        with self._lock:
+            self.statements = {}
+            self.slow.clear()
+
+    def as_dict(self) -> dict[str, Any]:
+        """ Журнал в виде словаря для JSON; запросы - по убыванию общего времени """
+        with self._lock:
+            ordered = sorted(self.statements.items(),
+                             key=lambda item: item[1].latency.total, reverse=True)
+            return {
+                "slow_threshold": self.slow_threshold,
+                "statements": {sql: stats.as_dict() for sql, stats in ordered},
+                "slow": [statement.as_dict() for statement in self.slow],
+            }
+
+
+def dump_stats(file: str | os.PathLike[str] | TextIO,
+               repositories: Mapping[str, InstrumentedRepository[Any]] | None = None,
+               statement_log: StatementLog | None = None) -> None:
+    """
+    Записать в JSON-файл file (путь или текстовый файл) статистику
+    репозиториев {имя: репозиторий} и журнал запросов
+    """
+    report: dict[str, Any] = {"created": datetime.now().isoformat(sep=" ")}
+    if repositories is not None:
+        report["repositories"] = {name: repo.as_dict()
+                                  for name, repo in repositories.items()}
+    if statement_log is not None:
+        report["sql"] = statement_log.as_dict()
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "w", encoding="utf-8") as stream:
+            json.dump(report, stream, ensure_ascii=False, indent=1)
+    else:
+        json.dump(report, file, ensure_ascii=False, indent=1)
@@ -0,0 +1,542 @@
+"""
+Модуль описывает репозиторий расходов в виде журнала, в который
+записи только дописываются
+
+Каждый расход хранится записью фиксированной длины в файле журнала,
+комментарии - в отдельном файле, в записи - только смещение и длина
+комментария. Файл журнала отображается в память (mmap), поэтому при
+открытии ничего не читается и не разбирается, а записи читаются прямо
+из отображения пачками. Комментарии тоже читаются через отображение
+файла комментариев, которое пересоздается, когда файл вырастает.
+
+Изменение и удаление дописывают в конец журнала новую запись с тем же pk
+(для удаления - с пометкой), которая заменяет прежние. Пока таких записей
+нет, записи журнала упорядочены по pk и объект находится делением
+пополам; после первой замены при необходимости строится словарь
+{pk: номер записи}. Сжатие (compact) переписывает журнал, оставляя только
+действующие записи; оно копирует записи без блокировки репозитория,
+поэтому его можно запустить в фоновом потоке.
+"""
+
+import mmap
+import os
+import struct
+import threading
+from datetime import datetime
+from types import TracebackType
+from typing import Any, Callable, Iterable, Iterator
+
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository.abstract_repository import AbstractRepository, ChangeEvent
+from bookkeeper.repository.query import (
+    OrderBy, Predicate, apply_query, as_predicate, convert_predicate
+)
+from bookkeeper.repository.row_mapper import EPOCH, MICROSECOND
+
+MAGIC = b"BKEXPLOG"
+VERSION = 1
+
+# сигнатура, версия, длина записи, число записей, число замененных записей,
+# последний выданный pk, поколение файла комментариев
+_HEADER = struct.Struct("<8sIIqqqq")
+# pk, сумма, категория, дата расхода, дата добавления (микросекунды от 1970 г.),
+# смещение и длина комментария, флаги
+_RECORD = struct.Struct("<qqqqqQIi")
+_PK = struct.Struct("<q")
+_DELETED = 1
+
+_COLUMNS = {"pk": 0, "amount": 1, "category": 2, "expense_date": 3, "added_date": 4}
+_DATE_FIELDS = ("expense_date", "added_date")
+
+Record = tuple[int, int, int, int, int, int, int, int]
+
+
+def _to_micro(value: datetime) -> int:
+    return (value - EPOCH) // MICROSECOND
+
+
+def _from_micro(value: int) -> datetime:
+    return EPOCH + value * MICROSECOND
+
+
+class ExpenseLogRepository(AbstractRepository[Expense]):
+    """
+    Репозиторий расходов (Expense) в журнале path (и файлах комментариев
+    path.comments.N рядом с ним).
+
+    Запись сначала дописывается в журнал, и только потом увеличивается
+    счетчик записей в заголовке, так что недописанная при сбое запись
+    не будет прочитана. Если sync (по умолчанию), перед обновлением
+    заголовка новые записи и комментарии записываются на диск (msync
+    и fsync), так что и после сбоя системы заголовок не указывает
+    на недописанные данные; sync=False быстрее, но защищает только
+    от сбоя процесса. Если доля замененных записей превышает половину
+    и их не меньше compact_threshold, после изменения запускается сжатие
+    в фоновом потоке, не останавливающее чтение и запись. Методы можно
+    вызывать из разных потоков; перебор записей продолжается корректно
+    и после сжатия. Даты должны быть наивными.
+    """
+
+    def __init__(self, path: str | os.PathLike[str],
+                 compact_threshold: int | None = 1024,
+                 sync: bool = True) -> None:
+        self._path = os.fspath(path)
+        self.compact_threshold = compact_threshold
+        self.sync = sync
+        self._lock = threading.RLock()
+        self._compacting = threading.Lock()
+        self._compaction: threading.Thread | None = None
+        self._open()
+
+    # --- файлы ---
+
+    def _comments_path(self, generation: int) -> str:
+        return f"{self._path}.comments.{generation}"
+
+    def _open(self) -> None:
+        if not os.path.exists(self._path) or os.path.getsize(self._path) == 0:
+            self._create(self._path, [], b"", 0, 0)
+            self._replace(self._path)
+        self._file = open(self._path, "r+b")  # pylint: disable=consider-using-with
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        magic, version, record_size, *counters = _HEADER.unpack_from(self._mm)
+        self._count: int = counters[0]
+        self._superseded: int = counters[1]
+        self._last_pk: int = counters[2]
+        self._generation: int = counters[3]
+        if magic != MAGIC or version != VERSION or record_size != _RECORD.size:
+            self._close_files()
+            raise ValueError(f"{self._path} is not an expense log")
+        self._comments = open(  # pylint: disable=consider-using-with
+            self._comments_path(self._generation), "ab")
+        self._comments_reader = open(  # pylint: disable=consider-using-with
+            self._comments_path(self._generation), "rb")
+        self._comments_mm: mmap.mmap | None = None
+        self._index: dict[int, int] | None = None
+        self._keys: list[int] | None = None
+
+    @staticmethod
+    def _create(path: str, records: list[Record], comments: bytes,
+                last_pk: int, generation: int) -> None:
+        """
+        Записать действующие записи records в новый журнал path.tmp,
+        а комментарии - в файл комментариев поколения generation. Оба файла
+        записываются на диск до того, как журнал заменит прежний (_replace).
+        """
+        capacity = max(len(records), 1024)
+        with open(f"{path}.comments.{generation}", "wb") as file:
+            file.write(comments)
+            file.flush()
+            os.fsync(file.fileno())
+        buffer = bytearray(_HEADER.size + capacity * _RECORD.size)
+        _HEADER.pack_into(buffer, 0, MAGIC, VERSION, _RECORD.size, len(records), 0,
+                          last_pk, generation)
+        for i, record in enumerate(records):
+            _RECORD.pack_into(buffer, _HEADER.size + i * _RECORD.size, *record)
+        with open(path + ".tmp", "wb") as file:
+            file.write(buffer)
+            file.flush()
+            os.fsync(file.fileno())
+
+    @staticmethod
+    def _extend(path: str, records: list[Record], comments: bytes,
+                counters: tuple[int, int, int, int]) -> None:
+        """
+        Дописать в конец нового журнала path.tmp записи records и их
+        комментарии, после чего записать заголовок со счетчиками counters
+        (число записей, число замененных записей, последний pk, поколение)
+        """
+        count, _, _, generation = counters
+        with open(f"{path}.comments.{generation}", "ab") as file:
+            file.write(comments)
+            file.flush()
+            os.fsync(file.fileno())
+        with open(path + ".tmp", "r+b") as file:
+            file.seek(_HEADER.size + (count - len(records)) * _RECORD.size)
+            file.write(b"".join(_RECORD.pack(*record) for record in records))
+            file.seek(0)
+            file.write(_HEADER.pack(MAGIC, VERSION, _RECORD.size, *counters))
+            file.flush()
+            os.fsync(file.fileno())
+
+    @staticmethod
+    def _replace(path: str) -> None:
+        """
+        Заменить журнал файлом path.tmp и записать на диск каталог, чтобы
+        после сбоя системы не вернулся прежний журнал
+        """
+        os.replace(path + ".tmp", path)
+        if hasattr(os, "O_DIRECTORY"):  # каталог можно открыть только в POSIX
+            fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _close_files(self) -> None:
+        self._mm.close()
+        self._file.close()
+        if hasattr(self, "_comments"):
+            if self._comments_mm is not None:
+                self._comments_mm.close()
+            self._comments.close()
+            self._comments_reader.close()
+
+    def close(self) -> None:
+        """ Дождаться сжатия, сохранить изменения и закрыть файлы """
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+        with self._lock:
+            self._mm.flush()
+            self._close_files()
+
+    def __enter__(self) -> "ExpenseLogRepository":
+        return self
+
+    def __exit__(self,
+                 exc_type: type[BaseException] | None,
+                 exc_val: BaseException | None,
+                 exc_tb: TracebackType | None) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count - self._superseded
+
+    # --- чтение записей ---
+
+    def _record(self, position: int) -> Record:
+        return _RECORD.unpack_from(self._mm, _HEADER.size + position * _RECORD.size)
+
+    def _pristine(self) -> bool:
+        """ Нет замененных записей: записи упорядочены по pk и все действуют """
+        return self._superseded == 0
+
+    def _search(self, pk: int) -> int:
+        """ Номер первой записи с pk не меньше данного (для журнала без замен) """
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (mid_pk,) = _PK.unpack_from(self._mm, _HEADER.size + mid * _RECORD.size)
+            if mid_pk < pk:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _get_index(self) -> dict[int, int]:
+        """ Словарь {pk: номер действующей записи} в порядке возрастания pk """
+        if self._index is None:
+            index: dict[int, int] = {}
+            for start in range(0, self._count, 4096):
+                for i, record in enumerate(self._read(start, 4096), start):
+                    if record[7] & _DELETED:
+                        index.pop(record[0], None)
+                    else:
+                        index[record[0]] = i
+            self._index = index
+        return self._index
+
+    def _read(self, start: int, count: int) -> list[Record]:
+        """ Прочитать подряд до count записей, начиная с номера start """
+        stop = min(start + count, self._count)
+        if start >= stop:
+            return []
+        with memoryview(self._mm) as view:
+            return list(_RECORD.iter_unpack(
+                view[_HEADER.size + start * _RECORD.size:
+                     _HEADER.size + stop * _RECORD.size]))
+
+    def _position(self, pk: int) -> int | None:
+        if self._pristine():
+            i = self._search(pk)
+            if i < self._count and self._record(i)[0] == pk:
+                return i
+            return None
+        return self._get_index().get(pk)
+
+    def _read_after(self, last_pk: int, count: int) -> list[Record]:
+        """ До count действующих записей с pk больше last_pk по возрастанию pk """
+        with self._lock:
+            if self._pristine():
+                return self._read(self._search(last_pk + 1), count)
+            index = self._get_index()
+            if self._keys is None:
+                self._keys = list(index)
+            keys = self._keys
+            lo, hi = 0, len(keys)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if keys[mid] <= last_pk:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return [self._record(index[pk]) for pk in keys[lo:lo + count]]
+
+    def _scan(self, batch_size: int,
+              conditions: list[tuple[int, Predicate]]) -> Iterator[Expense]:
+        """
+        Перебрать объекты действующих записей, удовлетворяющих условиям
+        на столбцы записи. Объекты создаются под блокировкой, чтобы сжатие
+        не изменило файл комментариев между чтением записи и комментария.
+        """
+        last_pk = 0
+        while True:
+            with self._lock:
+                batch = self._read_after(last_pk, batch_size)
+                objs = [self._materialize(record) for record in batch
+                        if all(predicate.match(record[column])
+                               for column, predicate in conditions)]
+            if not batch:
+                return
+            yield from objs
+            last_pk = batch[-1][0]
+
+    def _comment_bytes(self, offset: int, length: int) -> bytes:
+        """ Байты комментария; отображение файла пересоздается, если он вырос """
+        end = offset + length
+        if self._comments_mm is None or end > len(self._comments_mm):
+            if self._comments_mm is not None:
+                self._comments_mm.close()
+            self._comments_mm = mmap.mmap(self._comments_reader.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+        return self._comments_mm[offset:end]
+
+    def _comment(self, offset: int, length: int) -> str:
+        if not length:
+            return ""
+        return self._comment_bytes(offset, length).decode()
+
+    def _materialize(self, record: Record) -> Expense:
+        pk, amount, category, expense_date, added_date, offset, length, _ = record
+        return Expense(amount, category, _from_micro(expense_date),
+                       _from_micro(added_date), self._comment(offset, length), pk)
+
+    # --- запись ---
+
+    def _write_header(self) -> None:
+        _HEADER.pack_into(self._mm, 0, MAGIC, VERSION, _RECORD.size, self._count,
+                          self._superseded, self._last_pk, self._generation)
+
+    def _encode(self, pk: int, obj: Expense) -> Record:
+        comment = obj.comment.encode()
+        offset = self._comments.tell()
+        if comment:
+            self._comments.write(comment)
+        return (pk, obj.amount, obj.category, _to_micro(obj.expense_date),
+                _to_micro(obj.added_date), offset, len(comment), 0)
+
+    def _append(self, records: list[Record], superseded: int = 0) -> None:
+        """ Дописать записи и только после этого обновить заголовок """
+        self._comments.flush()
+        start = _HEADER.size + self._count * _RECORD.size
+        end = start + len(records) * _RECORD.size
+        if end > len(self._mm):
+            self._mm.resize(max(end, 2 * len(self._mm)))
+        if superseded and self._pristine():
+            self._get_index()
+        for i, record in enumerate(records, self._count):
+            _RECORD.pack_into(self._mm, _HEADER.size + i * _RECORD.size, *record)
+        if self.sync:
+            os.fsync(self._comments.fileno())
+            # msync принимает только смещение, кратное гранулярности отображения
+            start -= start % mmap.ALLOCATIONGRANULARITY
+            self._mm.flush(start, end - start)
+        for i, record in enumerate(records, self._count):
+            if self._index is not None:
+                if record[7] & _DELETED:
+                    del self._index[record[0]]
+                    self._keys = None
+                else:
+                    if record[0] not in self._index and self._keys is not None:
+                        self._keys.append(record[0])
+                    self._index[record[0]] = i
+        self._count += len(records)
+        self._superseded += superseded
+        self._last_pk = max(self._last_pk, max(record[0] for record in records))
+        self._write_header()
+        if (self.compact_threshold is not None
+                and self._superseded >= self.compact_threshold
+                and 2 * self._superseded > self._count):
+            self.compact_in_background()
+
+    def add(self, obj: Expense) -> int:
+        return self.add_many([obj])[0]
+
+    def add_many(self, objs: Iterable[Expense]) -> list[int]:
+        objs = list(objs)
+        for obj in objs:
+            if getattr(obj, "pk", None) != 0:
+                raise ValueError(f"trying to add object {obj} with filled `pk` attribute")
+        if not objs:
+            return []
+        with self._lock:
+            records = [self._encode(self._last_pk + i, obj)
+                       for i, obj in enumerate(objs, 1)]
+            self._append(records)
+        for obj, record in zip(objs, records):
+            obj.pk = record[0]
+        self._notify([ChangeEvent("added", None, obj) for obj in objs])
+        return [obj.pk for obj in objs]
+
+    def get(self, pk: int) -> Expense | None:
+        with self._lock:
+            i = self._position(pk)
+            return None if i is None else self._materialize(self._record(i))
+
+    def get_all(self, where: dict[str, Any] | None = None, *,
+                order_by: OrderBy = None,
+                limit: int | None = None,
+                offset: int = 0) -> list[Expense]:
+        return list(self.iter_all(where, order_by=order_by, limit=limit, offset=offset))
+
+    def iter_all(self, where: dict[str, Any] | None = None,
+                 batch_size: int = 1000, *,
+                 order_by: OrderBy = None,
+                 limit: int | None = None,
+                 offset: int = 0) -> Iterator[Expense]:
+        """
+        Перебрать действующие записи по возрастанию pk, читая журнал пачками.
+        Условия на числовые поля и даты проверяются по записям до создания
+        объектов.
+        """
+        conditions = []
+        rest: dict[str, Any] = {}
+        for name, value in (where or {}).items():
+            converted = None
+            if name in _COLUMNS:
+                converted = convert_predicate(
+                    as_predicate(value),
+                    _to_micro if name in _DATE_FIELDS else lambda v: v)
+            elif name != "comment":
+                raise ValueError(f"Expense has no field {name!r}")
+            if converted is None:
+                rest[name] = value
+            else:
+                conditions.append((_COLUMNS[name], converted))
+        objs = self._scan(batch_size, conditions)
+        return apply_query(objs, rest or None, order_by, limit, offset)
+
+    def update(self, obj: Expense) -> None:
+        self.update_many([obj])
+
+    def update_many(self, objs: Iterable[Expense]) -> None:
+        objs = list(objs)
+        if not objs:
+            return
+        with self._lock:
+            old = []
+            for obj in objs:
+                i = self._position(obj.pk) if obj.pk else None
+                if i is None:
+                    raise ValueError("attempt to update object with unknown primary key")
+                old.append(self._materialize(self._record(i))
+                           if self._subscribers else None)
+            self._append([self._encode(obj.pk, obj) for obj in objs], len(objs))
+        self._notify([ChangeEvent("updated", o, obj) for o, obj in zip(old, objs)])
+
+    def delete(self, pk: int) -> None:
+        self.delete_many([pk])
+
+    def delete_many(self, pks: Iterable[int]) -> None:
+        pks = list(pks)
+        if not pks:
+            return
+        if len(set(pks)) != len(pks):
+            raise KeyError("Some of the objects are repeated")
+        with self._lock:
+            old = []
+            for pk in pks:
+                i = self._position(pk)
+                if i is None:
+                    raise KeyError(pk)
+                old.append(self._materialize(self._record(i))
+                           if self._subscribers else None)
+            self._append([(pk, 0, 0, 0, 0, 0, 0, _DELETED) for pk in pks], 2 * len(pks))
+        self._notify([ChangeEvent("deleted", o, None) for o in old])
+
+    # --- сжатие ---
+
+    def compact(self) -> None:
+        """
+        Переписать журнал и файл комментариев, оставив только действующие
+        записи. Действующие записи копируются из снимка журнала без
+        блокировки, так что чтение и изменения в это время продолжаются.
+        Под блокировкой в новый журнал дописываются только записи,
+        появившиеся за время копирования, и он атомарно заменяет прежний.
+        """
+        with self._compacting:
+            with self._lock:
+                if self._pristine():
+                    return
+                self._comments.flush()
+                count, superseded = self._count, self._superseded
+                comments_size = self._comments.tell()
+            generation = self._generation + 1
+            records, comments = self._snapshot(count, comments_size)
+            self._create(self._path, records, comments, 0, generation)
+            with self._lock:
+                tail, tail_comments = self._relocate(
+                    self._read(count, self._count - count), self._comment_bytes,
+                    len(comments))
+                self._extend(self._path, tail, tail_comments,
+                             (len(records) + len(tail), self._superseded - superseded,
+                              self._last_pk, generation))
+                old_comments = self._comments_path(self._generation)
+                self._replace(self._path)
+                self._close_files()
+                self._open()
+            os.remove(old_comments)
+
+    def _snapshot(self, count: int, comments_size: int) -> tuple[list[Record], bytes]:
+        """
+        Действующие записи среди первых count записей журнала по возрастанию
+        pk с комментариями, перенесенными в новый файл. Журнал и комментарии
+        читаются через собственные отображения файлов: записи до count
+        и первые comments_size байт комментариев больше не меняются.
+        """
+        live: dict[int, Record] = {}
+        with open(self._path, "rb") as file, mmap.mmap(
+                file.fileno(), _HEADER.size + count * _RECORD.size,
+                access=mmap.ACCESS_READ) as log:
+            for start in range(0, count, 4096):
+                stop = min(start + 4096, count)
+                for record in _RECORD.iter_unpack(
+                        log[_HEADER.size + start * _RECORD.size:
+                            _HEADER.size + stop * _RECORD.size]):
+                    if record[7] & _DELETED:
+                        live.pop(record[0], None)
+                    else:
+                        live[record[0]] = record
+        records = [live[pk] for pk in sorted(live)]
+        if not comments_size:
+            return self._relocate(records, lambda offset, length: b"", 0)
+        with open(self._comments_path(self._generation), "rb") as file, mmap.mmap(
+                file.fileno(), comments_size, access=mmap.ACCESS_READ) as text:
+            return self._relocate(
+                records, lambda offset, length: text[offset:offset + length], 0)
+
+    @staticmethod
+    def _relocate(records: list[Record], comment_bytes: Callable[[int, int], bytes],
+                  base: int) -> tuple[list[Record], bytes]:
+        """
+        Записи с комментариями, перенесенными в новый файл подряд, начиная
+        со смещения base, и байты этих комментариев
+        """
+        moved: list[Record] = []
+        comments = bytearray()
+        for pk, amount, category, expense_date, added_date, offset, length, flags \
+                in records:
+            moved.append((pk, amount, category, expense_date, added_date,
+                          base + len(comments), length, flags))
+            if length:
+                comments += comment_bytes(offset, length)
+        return moved, bytes(comments)
+
+    def compact_in_background(self) -> threading.Thread:
+        """ Запустить сжатие в фоновом потоке, если оно еще не идет """
+        with self._lock:
+            if self._compaction is None or not self._compaction.is_alive():
+                self._compaction = threading.Thread(target=self.compact, daemon=True)
+                self._compaction.start()
+            return self._compaction
@@ -2,42 +2,521 @@
 Модуль описывает репозиторий, работающий в оперативной памяти
 """
 
-from itertools import count
-from typing import Any
+import os
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from heapq import nsmallest
+from itertools import count, islice
+from math import inf, log
+from typing import Any, BinaryIO, Iterable, Iterator
 
-from bookkeeper.repository.abstract_repository import AbstractRepository, T
+from bookkeeper.repository.abstract_repository import AbstractRepository, ChangeEvent, T
+from bookkeeper.repository.fulltext import TextQuery, TextTerm, parse_query, tokenize
+from bookkeeper.repository.query import (
+    Keyset, OrderBy, PageCursor, Predicate, Eq, In, Lt, Le, Gt, Ge, Between,
+    apply_query, matches
+)
+from bookkeeper.repository.snapshot import Snapshot, read_snapshot, write_snapshot
+
+
+class _HashIndex:
+    """
+    Хеш-индекс по полю: значение -> множество pk.
+    Обслуживает условия равенства и In.
+    """
+
+    def __init__(self, attr: str) -> None:
+        self.attr = attr
+        self._keys: dict[int, Any] = {}
+        self._buckets: defaultdict[Any, dict[int, None]] = defaultdict(dict)
+
+    def add(self, pk: int, obj: Any) -> None:
+        value = getattr(obj, self.attr)
+        self._keys[pk] = value
+        self._buckets[value][pk] = None
+
+    def build(self, objs: dict[int, Any]) -> None:
+        """ Заполнить пустой индекс объектами {pk: объект} """
+        for pk, obj in objs.items():
+            self.add(pk, obj)
+
+    def remove(self, pk: int) -> None:
+        if pk not in self._keys:
+            return
+        value = self._keys.pop(pk)
+        bucket = self._buckets[value]
+        del bucket[pk]
+        if not bucket:
+            del self._buckets[value]
+
+    def lookup(self, predicate: Predicate) -> set[int] | None:
+        """ Множество pk, удовлетворяющих условию, или None """
+        if isinstance(predicate, Eq):
+            return set(self._buckets.get(predicate.value, ()))
+        if isinstance(predicate, In):
+            return {pk for value in predicate.values
+                    for pk in self._buckets.get(value, ())}
+        return None
+
+
+class _SortedIndex:
+    """
+    Упорядоченный индекс по полю: отсортированный список пар (значение, pk).
+    Обслуживает равенство, In и сравнения. Значения None хранятся отдельно,
+    так как они не удовлетворяют ни одному сравнению.
+    """
+
+    def __init__(self, attr: str) -> None:
+        self.attr = attr
+        self._keys: dict[int, Any] = {}
+        self._entries: list[tuple[Any, int]] = []
+        self._nulls: set[int] = set()
+
+    def add(self, pk: int, obj: Any) -> None:
+        value = getattr(obj, self.attr)
+        self._keys[pk] = value
+        if value is None:
+            self._nulls.add(pk)
+        else:
+            insort(self._entries, (value, pk))
+
+    def build(self, objs: dict[int, Any], order: Iterable[int] | None = None) -> None:
+        """
+        Заполнить пустой индекс объектами {pk: объект} одной сортировкой,
+        а не вставкой по одному. order - готовый порядок pk объектов
+        со значениями, отличными от None (например, из снимка).
+        """
+        attr = self.attr
+        keys = self._keys = {pk: getattr(obj, attr) for pk, obj in objs.items()}
+        self._nulls = {pk for pk, value in keys.items() if value is None}
+        if order is None:
+            self._entries = sorted((value, pk) for pk, value in keys.items()
+                                   if value is not None)
+        else:
+            self._entries = [(keys[pk], pk) for pk in order]
+            if len(self._entries) + len(self._nulls) != len(keys):
+                raise ValueError(f"Index order for {attr} does not match objects")
+
+    def order(self) -> 'array[int]':
+        """ pk объектов со значениями, отличными от None, в порядке индекса """
+        return array("q", [pk for _, pk in self._entries])
+
+    def remove(self, pk: int) -> None:
+        if pk not in self._keys:
+            return
+        value = self._keys.pop(pk)
+        if value is None:
+            self._nulls.discard(pk)
+        else:
+            del self._entries[bisect_left(self._entries, (value, pk))]
+
+    def _range(self, low: Any = None, high: Any = None,
+               low_strict: bool = False, high_strict: bool = False) -> set[int]:
+        entries = self._entries
+        start, stop = 0, len(entries)
+        # (v,) меньше любой пары (v, pk), а (v, inf) - больше
+        if low is not None:
+            start = bisect_left(entries, (low, inf) if low_strict else (low,))
+        if high is not None:
+            stop = bisect_left(entries, (high,) if high_strict else (high, inf))
+        return {pk for _, pk in entries[start:stop]}
+
+    def lookup(self, predicate: Predicate) -> set[int] | None:
+        """ Множество pk, удовлетворяющих условию, или None """
+        result: set[int] | None = None
+        match predicate:
+            case Eq(value=None):
+                result = set(self._nulls)
+            case Eq(value=value):
+                result = self._range(value, value)
+            case In(values=values):
+                result = set().union(*(self._range(v, v) for v in values
+                                       if v is not None))
+            case Lt(value=value):
+                result = self._range(high=value, high_strict=True)
+            case Le(value=value):
+                result = self._range(high=value)
+            case Gt(value=value):
+                result = self._range(low=value, low_strict=True)
+            case Ge(value=value):
+                result = self._range(low=value)
+            case Between(low=low, high=high):
+                result = self._range(low, high)
+        return result
+
+    def scan(self, keyset: Keyset) -> Iterator[int]:
+        """
+        Перебрать pk в порядке просмотра страницы keyset, начиная сразу
+        за курсором. None меньше любого значения.
+        """
+        nulls = sorted(self._nulls)
+        entries = self._entries
+        cursor = keyset.cursor
+        if keyset.ascending:
+            if cursor is None:
+                null_start, start = 0, 0
+            elif cursor[0] is None:
+                null_start, start = bisect_right(nulls, cursor[1]), 0
+            else:
+                null_start, start = len(nulls), bisect_right(entries, cursor)
+            yield from nulls[null_start:]
+            for i in range(start, len(entries)):
+                yield entries[i][1]
+        else:
+            if cursor is None:
+                null_stop, stop = len(nulls), len(entries)
+            elif cursor[0] is None:
+                null_stop, stop = bisect_left(nulls, cursor[1]), 0
+            else:
+                null_stop, stop = len(nulls), bisect_left(entries, cursor)
+            for i in range(stop - 1, -1, -1):
+                yield entries[i][1]
+            yield from reversed(nulls[:null_stop])
+
+
+class _TextIndex:
+    """
+    Инвертированный индекс по текстовому полю: слово -> {pk: позиции слова
+    в тексте}. Обслуживает полнотекстовые запросы (модуль fulltext)
+    и ранжирует результаты по BM25. Слова хранятся также в упорядоченном
+    списке, чтобы префиксы находились делением пополам.
+    """
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, attr: str) -> None:
+        self.attr = attr
+        self._postings: dict[str, dict[int, list[int]]] = {}
+        self._words: list[str] = []
+        self._keys: dict[int, tuple[str, ...]] = {}
+        self._lengths: dict[int, int] = {}
+        self._total_length = 0
+
+    def add(self, pk: int, obj: Any) -> None:
+        tokens = tokenize(getattr(obj, self.attr))
+        positions: dict[str, list[int]] = {}
+        for position, token in enumerate(tokens):
+            positions.setdefault(token, []).append(position)
+        for token, token_positions in positions.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                insort(self._words, token)
+            posting[pk] = token_positions
+        self._keys[pk] = tuple(positions)
+        self._lengths[pk] = len(tokens)
+        self._total_length += len(tokens)
+
+    def build(self, objs: dict[int, Any]) -> None:
+        """ Заполнить пустой индекс объектами {pk: объект} """
+        for pk, obj in objs.items():
+            self.add(pk, obj)
+
+    def remove(self, pk: int) -> None:
+        if pk not in self._keys:
+            return
+        for token in self._keys.pop(pk):
+            posting = self._postings[token]
+            del posting[pk]
+            if not posting:
+                del self._postings[token]
+                del self._words[bisect_left(self._words, token)]
+        self._total_length -= self._lengths.pop(pk)
+
+    def lookup(self, predicate: Predicate) -> set[int] | None:
+        """ Индекс не обслуживает условия where """
+        del predicate
+        return None
+
+    def _prefixed(self, prefix: str) -> list[str]:
+        """ Слова индекса, начинающиеся с prefix """
+        start = bisect_left(self._words, prefix)
+        stop = bisect_left(self._words, prefix + chr(0x10FFFF), start)
+        return self._words[start:stop]
+
+    def _positions(self, token: str, prefix: bool) -> dict[int, list[int]]:
+        """ Позиции слова (или всех слов с префиксом token) в текстах """
+        if not prefix:
+            return self._postings.get(token, {})
+        words = self._prefixed(token)
+        if len(words) == 1:
+            return self._postings[words[0]]
+        merged: dict[int, list[int]] = {}
+        for word in words:
+            for pk, positions in self._postings[word].items():
+                merged.setdefault(pk, []).extend(positions)
+        return merged
+
+    def _occurrences(self, term: TextTerm) -> dict[int, int]:
+        """ Сколько раз условие встречается в каждом тексте, где оно есть """
+        last = len(term.tokens) - 1
+        if last == 0 and term.prefix:
+            # позиции не нужны: достаточно сложить число вхождений слов
+            counts: dict[int, int] = {}
+            for word in self._prefixed(term.tokens[0]):
+                for pk, positions in self._postings[word].items():
+                    counts[pk] = counts.get(pk, 0) + len(positions)
+            return counts
+        postings = [self._positions(token, term.prefix and i == last)
+                    for i, token in enumerate(term.tokens)]
+        first, *rest = postings
+        if not rest:
+            return {pk: len(positions) for pk, positions in first.items()}
+        result = {}
+        for pk in min(postings, key=len):
+            if all(pk in posting for posting in postings):
+                following = [set(posting[pk]) for posting in rest]
+                frequency = sum(1 for position in first[pk]
+                                if all(position + i in positions
+                                       for i, positions in enumerate(following, 1)))
+                if frequency:
+                    result[pk] = frequency
+        return result
+
+    def search(self, query: TextQuery) -> dict[int, float]:
+        """ Оценки BM25 текстов, содержащих все условия запроса, по pk """
+        documents = len(self._lengths)
+        average = self._total_length / documents if documents else 0.0
+        scores: dict[int, float] = {}
+        for number, term in enumerate(query):
+            occurrences = self._occurrences(term)
+            idf = log((documents - len(occurrences) + 0.5) / (len(occurrences) + 0.5) + 1)
+            term_scores = {}
+            for pk, frequency in occurrences.items():
+                # текст должен содержать все условия запроса
+                if number == 0 or pk in scores:
+                    norm = 1 - self.B + self.B * self._lengths[pk] / average
+                    term_scores[pk] = scores.get(pk, 0.0) + (
+                        idf * frequency * (self.K1 + 1) / (frequency + self.K1 * norm))
+            scores = term_scores
+            if not scores:
+                break
+        return scores
 
 
 class MemoryRepository(AbstractRepository[T]):
     """
     Репозиторий, работающий в оперативной памяти. Хранит данные в словаре.
+
+    indexes - поля, по которым строятся хеш-индексы (поиск по равенству и In),
+    sorted_indexes - поля, по которым строятся упорядоченные индексы
+    (также сравнения и диапазоны), text_indexes - текстовые поля,
+    по которым строятся инвертированные индексы для метода search.
+    Индексы обновляются методами add, update и delete и автоматически
+    используются в get_all и iter_all; в этом случае объекты возвращаются
+    в порядке возрастания pk. Значения индексируемых полей должны быть
+    хешируемыми (для упорядоченных индексов - сравнимыми), а объекты
+    нельзя изменять в обход update.
+
+    Подписчики получают события сразу после изменения. Если в update
+    передан тот же объект, что хранится в репозитории, old и new в событии
+    совпадают.
+
+    Содержимое репозитория можно сохранить в двоичный снимок методом dump
+    и восстановить методом load (см. модуль snapshot).
     """
 
-    def __init__(self) -> None:
+    def __init__(self,
+                 indexes: Iterable[str] = (),
+                 sorted_indexes: Iterable[str] = (),
+                 text_indexes: Iterable[str] = ()) -> None:
         self._container: dict[int, T] = {}
         self._counter = count(1)
+        self._indexes: dict[str, list[_HashIndex | _SortedIndex | _TextIndex]] = (
+            defaultdict(list))
+        for attr in indexes:
+            self._indexes[attr].append(_HashIndex(attr))
+        for attr in sorted_indexes:
+            self._indexes[attr].append(_SortedIndex(attr))
+        for attr in text_indexes:
+            self._indexes[attr].append(_TextIndex(attr))
+
+    def dump(self, file: str | os.PathLike[str] | BinaryIO) -> None:
+        """
+        Сохранить в снимок объекты, позицию счетчика pk и описание индексов.
+        file - путь или файл, открытый для записи в двоичном режиме.
+        Все объекты должны быть одного класса с полями типов int, float,
+        str и datetime (или None).
+        """
+        next_pk = next(self._counter)
+        self._counter = count(next_pk)
+        indexes = []
+        sorted_indexes = {}
+        text_indexes = []
+        for attr, attr_indexes in self._indexes.items():
+            for index in attr_indexes:
+                if isinstance(index, _SortedIndex):
+                    sorted_indexes[attr] = index.order()
+                elif isinstance(index, _TextIndex):
+                    text_indexes.append(attr)
+                else:
+                    indexes.append(attr)
+        write_snapshot(file, Snapshot(list(self._container.values()), next_pk,
+                                      indexes, sorted_indexes, tuple(text_indexes)))
+
+    @classmethod
+    def load(cls, file: str | os.PathLike[str] | BinaryIO,
+             class_type: type) -> 'MemoryRepository[Any]':
+        """
+        Создать репозиторий из снимка объектов класса class_type, сохраненного
+        методом dump: с теми же объектами, индексами и следующим pk.
+        Упорядоченные индексы восстанавливаются без сортировки.
+        """
+        snapshot = read_snapshot(file, class_type)
+        repo: MemoryRepository[Any] = cls(snapshot.indexes, snapshot.sorted_indexes,
+                                          snapshot.text_indexes)
+        objs = snapshot.objects
+        repo._container = dict(zip([obj.pk for obj in objs], objs))
+        repo._counter = count(snapshot.next_pk)
+        for attr_indexes in repo._indexes.values():
+            for index in attr_indexes:
+                if isinstance(index, _SortedIndex):
+                    index.build(repo._container, snapshot.sorted_indexes[index.attr])
+                else:
+                    index.build(repo._container)
+        return repo
+
+    def _store(self, pk: int, obj: T) -> T | None:
+        """ Сохранить объект, вернуть прежний объект с тем же pk """
+        for attr_indexes in self._indexes.values():
+            for index in attr_indexes:
+                index.remove(pk)
+                index.add(pk, obj)
+        old = self._container.get(pk)
+        self._container[pk] = obj
+        return old
+
+    def _remove(self, pk: int) -> T:
+        old = self._container.pop(pk)
+        for attr_indexes in self._indexes.values():
+            for index in attr_indexes:
+                index.remove(pk)
+        return old
+
+    def _lookup(self, where: dict[str, Any]) -> set[int] | None:
+        """
+        Найти по индексам множество pk, среди которых содержатся все
+        объекты, удовлетворяющие условию, или None, если индексы не помогут
+        """
+        result: set[int] | None = None
+        for attr, value in where.items():
+            predicate = value if isinstance(value, Predicate) else Eq(value)
+            for index in self._indexes.get(attr, ()):
+                pks = index.lookup(predicate)
+                if pks is not None:
+                    result = pks if result is None else result & pks
+                    break
+        return result
 
     def add(self, obj: T) -> int:
         if getattr(obj, 'pk', None) != 0:
             raise ValueError(f'trying to add object {obj} with filled `pk` attribute')
         pk = next(self._counter)
-        self._container[pk] = obj
         obj.pk = pk
+        self._store(pk, obj)
+        self._notify([ChangeEvent('added', None, obj)])
         return pk
 
     def get(self, pk: int) -> T | None:
         return self._container.get(pk)
 
-    def get_all(self, where: dict[str, Any] | None = None) -> list[T]:
-        if where is None:
-            return list(self._container.values())
-        return [obj for obj in self._container.values()
-                if all(getattr(obj, attr) == value for attr, value in where.items())]
+    def get_all(self, where: dict[str, Any] | None = None, *,
+                order_by: OrderBy = None,
+                limit: int | None = None,
+                offset: int = 0) -> list[T]:
+        return list(self.iter_all(where, order_by=order_by, limit=limit, offset=offset))
+
+    def iter_all(self, where: dict[str, Any] | None = None,
+                 batch_size: int = 1000, *,
+                 order_by: OrderBy = None,
+                 limit: int | None = None,
+                 offset: int = 0) -> Iterator[T]:
+        """
+        Перебрать объекты прямо из словаря, без копирования.
+        Изменять репозиторий во время перебора нельзя.
+        """
+        if where is None and order_by is None and limit is None and not offset:
+            yield from self._container.values()
+            return
+        objs: Iterable[T] = self._container.values()
+        if where:
+            pks = self._lookup(where)
+            if pks is not None:
+                objs = (self._container[pk] for pk in sorted(pks))
+        yield from apply_query(objs, where, order_by, limit, offset)
+
+    def page(self, key: str = 'pk', limit: int = 100, *,
+             after: PageCursor | None = None,
+             before: PageCursor | None = None,
+             where: dict[str, Any] | None = None) -> list[T]:
+        """
+        Получить страницу по упорядоченному индексу поля key, если он есть:
+        курсор находится делением пополам, и просматриваются только
+        объекты страницы (и не прошедшие условие where)
+        """
+        keyset = Keyset.from_cursors(key, after, before)
+        index = next((index for index in self._indexes.get(keyset.field, ())
+                      if isinstance(index, _SortedIndex)), None)
+        if index is None:
+            return super().page(key, limit, after=after, before=before, where=where)
+        objs = (self._container[pk] for pk in index.scan(keyset))
+        return keyset.arrange(islice((obj for obj in objs if matches(obj, where)), limit))
+
+    def search(self, query: str, field: str,
+               where: dict[str, Any] | None = None,
+               limit: int | None = None) -> list[T]:
+        """
+        Полнотекстовый поиск по инвертированному индексу поля field,
+        если он есть: результаты упорядочены по убыванию оценки BM25
+        (при равенстве - по pk). Иначе см. AbstractRepository.search.
+        """
+        index = next((index for index in self._indexes.get(field, ())
+                      if isinstance(index, _TextIndex)), None)
+        if index is None:
+            return super().search(query, field, where, limit)
+        scores = index.search(parse_query(query))
+        if where or limit is None:
+            pks = sorted(scores, key=lambda pk: (-scores[pk], pk))
+        else:
+            pks = nsmallest(limit, scores, key=lambda pk: (-scores[pk], pk))
+        objs = (self._container[pk] for pk in pks)
+        return list(islice((obj for obj in objs if matches(obj, where)), limit))
 
     def update(self, obj: T) -> None:
         if obj.pk == 0:
             raise ValueError('attempt to update object with unknown primary key')
-        self._container[obj.pk] = obj
+        old = self._store(obj.pk, obj)
+        self._notify([ChangeEvent('updated', old, obj)])
 
     def delete(self, pk: int) -> None:
-        self._container.pop(pk)
+        old = self._remove(pk)
+        self._notify([ChangeEvent('deleted', old, None)])
+
+    def add_many(self, objs: Iterable[T]) -> list[int]:
+        objs = list(objs)
+        for obj in objs:
+            if getattr(obj, 'pk', None) != 0:
+                raise ValueError(f'trying to add object {obj} with filled `pk` attribute')
+        pks = []
+        for obj in objs:
+            pk = next(self._counter)
+            obj.pk = pk
+            self._store(pk, obj)
+            pks.append(pk)
+        self._notify([ChangeEvent('added', None, obj) for obj in objs])
+        return pks
+
+    def update_many(self, objs: Iterable[T]) -> None:
+        objs = list(objs)
+        if any(obj.pk == 0 for obj in objs):
+            raise ValueError('attempt to update object with unknown primary key')
+        self._notify([ChangeEvent('updated', self._store(obj.pk, obj), obj)
+                      for obj in objs])
+
+    def delete_many(self, pks: Iterable[int]) -> None:
+        pks = list(pks)
+        for pk in pks:
+            if pk not in self._container:
+                raise KeyError(pk)
+        self._notify([ChangeEvent('deleted', self._remove(pk), None) for pk in pks])
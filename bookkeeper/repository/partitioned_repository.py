@@ -0,0 +1,321 @@
+"""
+Модуль описывает репозиторий SQLite, разделенный на таблицы по периодам
+
+Записи модели хранятся в таблицах по году или месяцу значения поля даты:
+Expense_2023 или Expense_2023_05. Выборки с условием на это поле читают
+только таблицы нужных периодов, так что запрос за месяц не зависит
+от объема истории, а старые таблицы не меняются и не мешают новым.
+
+Первичные ключи остаются общими для всех таблиц: служебная таблица
+_partition_<модель> хранит для каждого pk период, в таблице которого
+лежит запись, поэтому get находит запись одним поиском по первичному ключу.
+"""
+
+import os
+import re
+from datetime import datetime, timedelta
+from functools import partial
+from heapq import merge
+from itertools import islice
+from operator import attrgetter
+from typing import Any, Iterable, Iterator, Literal
+
+from bookkeeper.repository.abstract_repository import AbstractRepository, ChangeEvent, T
+from bookkeeper.repository.query import (
+    AggregateFunction, Between, Eq, Ge, GroupBy, Gt, In, Le, Lt, OrderBy,
+    apply_query, as_predicate
+)
+from bookkeeper.repository.sqlite_repository import (
+    DatetimeStorage, SQliteDatabase, SQliteRepository, reset_pks
+)
+
+PartitionPeriod = Literal["year", "month"]
+
+_PATTERNS = {"year": r"\d{4}", "month": r"\d{4}_\d{2}"}
+
+
+class PartitionedSQliteRepository(AbstractRepository[T]):
+    """
+    Репозиторий SQLite, хранящий объекты класса class_type в таблицах
+    по периодам (period - год или месяц) значения поля field (datetime
+    или date, не None). Каждая таблица - обычная таблица SQliteRepository
+    с индексами модели.
+
+    Условие where на поле field (равенство, In, сравнения, Between)
+    ограничивает чтение таблицами подходящих периодов, остальные
+    условия проверяются в каждой таблице. Без order_by get_all и iter_all
+    возвращают записи в порядке pk, как и SQliteRepository; с сортировкой
+    или limit из каждой таблицы читается не больше offset + limit записей.
+    Если при изменении объекта значение field переходит в другой период,
+    запись переносится в другую таблицу с тем же pk.
+    search ищет в таблицах от последнего периода к первому.
+    """
+
+    def __init__(self,
+                 base_name: str | os.PathLike[str] | SQliteDatabase,
+                 class_type: type,
+                 field: str,
+                 period: PartitionPeriod = "year",
+                 datetime_storage: DatetimeStorage = "text") -> None:
+        if period not in _PATTERNS:
+            raise ValueError(f"Unknown partition period {period!r}")
+        self._db, self._owns_db = SQliteDatabase.open(base_name)
+        self._class_type = class_type
+        self._field = field
+        self._period = period
+        self._datetime_storage = datetime_storage
+        self._registry = f"_partition_{class_type.__name__}"
+        self._partitions: dict[str, SQliteRepository[T]] = {}
+
+        con = self._db.connection
+        con.execute(f"CREATE TABLE IF NOT EXISTS {self._registry}"
+                    + "(pk INTEGER PRIMARY KEY NOT NULL, partition TEXT NOT NULL)")
+        pattern = re.compile(f"{class_type.__name__}_({_PATTERNS[period]})")
+        tables = con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        for (table,) in tables.fetchall():
+            found = pattern.fullmatch(table)
+            if found:
+                self._partition(found.group(1))
+
+    def close(self) -> None:
+        """ Закрыть подключение, если репозиторий им владеет """
+        if self._owns_db:
+            self._db.close()
+
+    @property
+    def partitions(self) -> list[str]:
+        """ Периоды существующих таблиц по возрастанию: '2023' или '2023_05' """
+        return sorted(self._partitions)
+
+    def partition_key(self, value: Any) -> str:
+        """ Период, в таблице которого хранится объект со значением поля value """
+        if value is None:
+            raise ValueError(f"{self._field} of a partitioned object must not be None")
+        if self._period == "year":
+            return f"{value.year:04d}"
+        return f"{value.year:04d}_{value.month:02d}"
+
+    def _partition(self, key: str) -> SQliteRepository[T]:
+        """
+        Репозиторий таблицы периода key; таблица создается при первом
+        обращении и забывается, если создавшая ее транзакция откатывается
+        """
+        repo = self._partitions.get(key)
+        if repo is None:
+            repo = SQliteRepository[T](
+                self._db, self._class_type, self._datetime_storage,
+                table_name=f"{self._class_type.__name__}_{key}")
+            self._partitions[key] = repo
+            self._db.on_rollback(partial(self._partitions.pop, key, None))
+        return repo
+
+    def _selected(self, where: dict[str, Any] | None) -> list[str]:
+        """ Периоды, в таблицах которых могут быть записи, удовлетворяющие where """
+        keys = self.partitions
+        if not where or self._field not in where:
+            return keys
+        low = high = None
+        match as_predicate(where[self._field]):
+            case Eq(value=value):
+                if value is None:
+                    return []
+                low = high = self.partition_key(value)
+            case In(values=values):
+                wanted = {self.partition_key(value) for value in values
+                          if value is not None}
+                return [key for key in keys if key in wanted]
+            case Between(low=start, high=end):
+                low, high = self.partition_key(start), self.partition_key(end)
+            case Ge(value=value) | Gt(value=value):
+                low = self.partition_key(value)
+            case Le(value=value):
+                high = self.partition_key(value)
+            case Lt(value=value):
+                # значение строго меньше начала периода value не входит в него
+                step = (timedelta(microseconds=1) if isinstance(value, datetime)
+                        else timedelta(days=1))
+                high = self.partition_key(value - step)
+        return [key for key in keys
+                if (low is None or key >= low) and (high is None or key <= high)]
+
+    def _locate(self, pk: int) -> str | None:
+        """ Период записи pk """
+        row = self._db.connection.execute(
+            f"SELECT partition FROM {self._registry} WHERE pk = ?", (pk,)).fetchone()
+        return None if row is None else str(row[0])
+
+    def _allocate(self, keys: list[str]) -> list[int]:
+        """ Выделить pk новым записям периодов keys (вызывается в транзакции) """
+        con = self._db.connection
+        (last_pk,) = con.execute(
+            f"SELECT COALESCE(MAX(pk), 0) FROM {self._registry}").fetchone()
+        pks = list(range(last_pk + 1, last_pk + 1 + len(keys)))
+        con.executemany(f"INSERT INTO {self._registry} (pk, partition) VALUES (?, ?)",
+                        zip(pks, keys))
+        return pks
+
+    def _publish(self, events: list[ChangeEvent[T]]) -> None:
+        """ Передать события подписчикам после фиксации транзакции """
+        if self._subscribers:
+            self._db.on_commit(partial(self._notify, events))
+
+    def transaction(self) -> Any:
+        """ Транзакция базы данных, общая для всех таблиц """
+        return self._db.transaction()
+
+    def add(self, obj: T) -> int:
+        (pk,) = self.add_many([obj])
+        return pk
+
+    def add_many(self, objs: Iterable[T]) -> list[int]:
+        """
+        Добавить объекты одной транзакцией; если она откатывается (в том
+        числе вместе с внешней транзакцией), атрибут pk снова нулевой
+        """
+        objs = list(objs)
+        for obj in objs:
+            if getattr(obj, "pk", None) != 0:
+                raise ValueError("Trying to add object with filled 'pk' attribute")
+        keys = [self.partition_key(getattr(obj, self._field)) for obj in objs]
+        if not objs:
+            return []
+        groups: dict[str, list[T]] = {}
+        with self._db.transaction():
+            self._db.on_rollback(partial(reset_pks, objs))
+            pks = self._allocate(keys)
+            for obj, pk, key in zip(objs, pks, keys):
+                obj.pk = pk
+                groups.setdefault(key, []).append(obj)
+            for key, group in groups.items():
+                self._partition(key).insert_many(group)
+            self._publish([ChangeEvent("added", None, obj) for obj in objs])
+        return pks
+
+    def get(self, pk: int) -> T | None:
+        key = self._locate(pk)
+        return None if key is None else self._partitions[key].get(pk)
+
+    def get_all(self, where: dict[str, Any] | None = None, *,
+                order_by: OrderBy = None,
+                limit: int | None = None,
+                offset: int = 0) -> list[T]:
+        """
+        Получить записи из таблиц подходящих периодов, см. описание класса
+        """
+        keys = self._selected(where)
+        if len(keys) == 1:
+            return self._partitions[keys[0]].get_all(
+                where, order_by=order_by, limit=limit, offset=offset)
+        order_by = order_by or "pk"
+        prefetch = None if limit is None else offset + limit
+        objs = [obj for key in keys for obj in self._partitions[key].get_all(
+            where, order_by=order_by, limit=prefetch)]
+        return list(apply_query(objs, None, order_by, limit, offset))
+
+    def iter_all(self, where: dict[str, Any] | None = None,
+                 batch_size: int = 1000, *,
+                 order_by: OrderBy = None,
+                 limit: int | None = None,
+                 offset: int = 0) -> Iterator[T]:
+        """
+        Без сортировки - слить курсоры таблиц подходящих периодов в порядке
+        pk, не загружая записи в память целиком; с сортировкой - см. get_all
+        """
+        if order_by is not None:
+            yield from self.get_all(where, order_by=order_by, limit=limit, offset=offset)
+            return
+        iterators = [self._partitions[key].iter_all(where, batch_size, order_by="pk")
+                     for key in self._selected(where)]
+        stop = None if limit is None else offset + limit
+        yield from islice(merge(*iterators, key=attrgetter("pk")), offset, stop)
+
+    def search(self, query: str, field: str,
+               where: dict[str, Any] | None = None,
+               limit: int | None = None) -> list[T]:
+        found: list[T] = []
+        for key in reversed(self._selected(where)):
+            if limit is not None and len(found) >= limit:
+                break
+            found.extend(self._partitions[key].search(
+                query, field, where, None if limit is None else limit - len(found)))
+        return found
+
+    def aggregate(self, func: AggregateFunction,
+                  field: str = "pk",
+                  where: dict[str, Any] | None = None,
+                  group_by: GroupBy = None) -> Any:
+        """
+        Вычислить агрегатную функцию в каждой таблице подходящих периодов
+        и объединить результаты
+        """
+        if func not in ("sum", "count", "min", "max"):
+            raise ValueError(f"unknown aggregate function {func!r}")
+        results = [self._partitions[key].aggregate(func, field, where, group_by)
+                   for key in self._selected(where)]
+        if group_by is None:
+            return _combine(func, results)
+        groups: dict[Any, list[Any]] = {}
+        for result in results:
+            for group, value in result.items():
+                groups.setdefault(group, []).append(value)
+        return {group: _combine(func, values) for group, values in groups.items()}
+
+    def _update(self, obj: T) -> T | None:
+        """ Обновить объект, перенеся его в таблицу нового периода; вернуть прежний """
+        key = self._locate(obj.pk)
+        if key is None:
+            raise ValueError(f"Object with pk = {obj.pk} does not exist")
+        old = self._partitions[key].get(obj.pk) if self._subscribers else None
+        new_key = self.partition_key(getattr(obj, self._field))
+        if new_key == key:
+            self._partitions[key].update(obj)
+        else:
+            self._partitions[key].delete(obj.pk)
+            self._partition(new_key).insert_many([obj])
+            self._db.connection.execute(
+                f"UPDATE {self._registry} SET partition = ? WHERE pk = ?",
+                (new_key, obj.pk))
+        return old
+
+    def _delete(self, pk: int) -> T | None:
+        """ Удалить запись; вернуть прежний объект, если есть подписчики """
+        key = self._locate(pk)
+        if key is None:
+            raise KeyError(f"Object with pk = {pk} does not exist")
+        old = self._partitions[key].get(pk) if self._subscribers else None
+        self._partitions[key].delete(pk)
+        self._db.connection.execute(f"DELETE FROM {self._registry} WHERE pk = ?", (pk,))
+        return old
+
+    def update(self, obj: T) -> None:
+        self.update_many([obj])
+
+    def update_many(self, objs: Iterable[T]) -> None:
+        """ Обновить данные о нескольких объектах одной транзакцией """
+        objs = list(objs)
+        with self._db.transaction():
+            events = [ChangeEvent("updated", self._update(obj), obj) for obj in objs]
+            self._publish(events)
+
+    def delete(self, pk: int) -> None:
+        self.delete_many([pk])
+
+    def delete_many(self, pks: Iterable[int]) -> None:
+        """ Удалить несколько записей одной транзакцией """
+        with self._db.transaction():
+            events = [ChangeEvent[T]("deleted", self._delete(pk), None) for pk in pks]
+            self._publish(events)
+
+
+def _combine(func: AggregateFunction, values: list[Any]) -> Any:
+    """ Объединить значения агрегатной функции по таблицам, как это сделал бы SQL """
+    present = [value for value in values if value is not None]
+    if func == "count":
+        return sum(present)
+    if not present:
+        return None
+    if func == "min":
+        return min(present)
+    if func == "max":
+        return max(present)
+    return sum(present)
@@ -0,0 +1,488 @@
+"""
+Модуль описывает условия для выборки объектов из репозитория
+
+Условие where задается словарем {'название_поля': значение}. Значение может
+быть обычным объектом (проверяется равенство) или предикатом из этого модуля:
+
+    repo.get_all({'expense_date': Ge(start), 'category': In([1, 2])},
+                 order_by='-expense_date', limit=10)
+
+Каждый предикат умеет проверять значение в памяти (match) и переводить себя
+в параметризованное условие SQL (to_sql), поэтому все репозитории понимают
+условия одинаково. Как и в SQL, значение None не удовлетворяет ни одному
+сравнению, а равенство None означает IS NULL.
+
+Постраничная выборка по ключу (keyset pagination) описывается классом
+Keyset: следующая страница начинается сразу после курсора (значение, pk)
+последнего объекта предыдущей, поэтому не нужно пропускать записи (OFFSET).
+
+Здесь же описаны агрегатные запросы (сумма, количество, минимум, максимум)
+с группировкой по полю или по периоду времени (TimeBucket).
+"""
+
+import re
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Literal, Sequence, TypeVar
+
+Obj = TypeVar('Obj')
+
+OrderBy = str | Sequence[str] | None
+
+Converter = Callable[[Any], Any]
+
+
+class Predicate(ABC):
+    """
+    Условие на значение одного поля
+    """
+
+    @abstractmethod
+    def match(self, value: Any) -> bool:
+        """ Проверить, удовлетворяет ли значение условию """
+
+    @abstractmethod
+    def to_sql(self, column: str, convert: Converter) -> tuple[str, list[Any]]:
+        """
+        Перевести условие в SQL, вернуть текст условия и список параметров.
+        convert - функция перевода значений в представление SQL
+        """
+
+
+@dataclass(frozen=True)
+class Eq(Predicate):
+    """ Поле равно значению """
+    value: Any
+
+    def match(self, value: Any) -> bool:
+        return bool(value == self.value)
+
+    def to_sql(self, column: str, convert: Converter) -> tuple[str, list[Any]]:
+        if self.value is None:
+            return f"{column} IS NULL", []
+        return f"{column} = ?", [convert(self.value)]
+
+
+@dataclass(frozen=True)
+class Ne(Predicate):
+    """ Поле не равно значению """
+    value: Any
+
+    def match(self, value: Any) -> bool:
+        if self.value is None:
+            return value is not None
+        return value is not None and bool(value != self.value)
+
+    def to_sql(self, column: str, convert: Converter) -> tuple[str, list[Any]]:
+        if self.value is None:
+            return f"{column} IS NOT NULL", []
+        return f"{column} != ?", [convert(self.value)]
+
+
+@dataclass(frozen=True)
+class _Compare(Predicate):
+    value: Any
+    _operator = ''
+
+    def match(self, value: Any) -> bool:
+        return value is not None and self._compare(value)
+
+    def _compare(self, value: Any) -> bool:
+        raise NotImplementedError
+
+    def to_sql(self, column: str, convert: Converter) -> tuple[str, list[Any]]:
+        return f"{column} {self._operator} ?", [convert(self.value)]
+
+
+@dataclass(frozen=True)
+class Lt(_Compare):
+    """ Поле меньше значения """
+    _operator = '<'
+
+    def _compare(self, value: Any) -> bool:
+        return bool(value < self.value)
+
+
+@dataclass(frozen=True)
+class Le(_Compare):
+    """ Поле меньше или равно значению """
+    _operator = '<='
+
+    def _compare(self, value: Any) -> bool:
+        return bool(value <= self.value)
+
+
+@dataclass(frozen=True)
+class Gt(_Compare):
+    """ Поле больше значения """
+    _operator = '>'
+
+    def _compare(self, value: Any) -> bool:
+        return bool(value > self.value)
+
+
+@dataclass(frozen=True)
+class Ge(_Compare):
+    """ Поле больше или равно значению """
+    _operator = '>='
+
+    def _compare(self, value: Any) -> bool:
+        return bool(value >= self.value)
+
+
+@dataclass(frozen=True)
+class Between(Predicate):
+    """ Поле лежит в отрезке [low, high] (включая границы) """
+    low: Any
+    high: Any
+
+    def match(self, value: Any) -> bool:
+        return value is not None and bool(self.low <= value <= self.high)
+
+    def to_sql(self, column: str, convert: Converter) -> tuple[str, list[Any]]:
+        return f"{column} BETWEEN ? AND ?", [convert(self.low), convert(self.high)]
+
+
+@dataclass(frozen=True)
+class In(Predicate):
+    """ Поле равно одному из значений """
+    values: tuple[Any, ...]
+
+    def __init__(self, values: Iterable[Any]) -> None:
+        object.__setattr__(self, 'values', tuple(values))
+
+    def match(self, value: Any) -> bool:
+        return value is not None and value in self.values
+
+    def to_sql(self, column: str, convert: Converter) -> tuple[str, list[Any]]:
+        if not self.values:
+            return "0", []
+        placeholders = ", ".join("?" * len(self.values))
+        return f"{column} IN ({placeholders})", [convert(v) for v in self.values]
+
+
+@dataclass(frozen=True)
+class Like(Predicate):
+    """
+    Строка соответствует шаблону SQL LIKE: % - любая последовательность
+    символов, _ - один любой символ. Регистр не учитывается.
+
+    Встроенный LIKE SQLite приводит к одному регистру только латиницу,
+    поэтому шаблон с другими буквами сравнивается со значением, приведенным
+    к нижнему регистру функцией unicode_lower (ее регистрирует
+    SQliteDatabase); шаблоны из ASCII проверяются встроенным LIKE.
+    Отличия от проверки в памяти остаются для редких символов, у которых
+    нижний регистр не единственный или длиннее одного символа: например,
+    знак кельвина совпадает с k только в памяти, а 'İ' в SQLite
+    не соответствует шаблону '_'.
+    """
+    pattern: str
+    _regex: re.Pattern[str] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        regex = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c)
+                        for c in self.pattern)
+        object.__setattr__(self, '_regex',
+                           re.compile(regex, re.IGNORECASE | re.DOTALL))
+
+    def match(self, value: Any) -> bool:
+        return isinstance(value, str) and self._regex.fullmatch(value) is not None
+
+    def to_sql(self, column: str, convert: Converter) -> tuple[str, list[Any]]:
+        if self.pattern.isascii():
+            return f"{column} LIKE ?", [self.pattern]
+        return f"unicode_lower({column}) LIKE ?", [self.pattern.lower()]
+
+
+def convert_predicate(predicate: Predicate, convert: Converter) -> Predicate | None:
+    """
+    Перевести значения условия в другое представление функцией convert,
+    сохраняющей порядок (например, даты - в целые числа), чтобы проверять
+    условие над хранимыми значениями. None не переводится.
+    Вернуть None, если условие нельзя перевести (Like).
+    """
+    def conv(value: Any) -> Any:
+        return None if value is None else convert(value)
+
+    match predicate:
+        case Eq(value=value):
+            return Eq(conv(value))
+        case Ne(value=value):
+            return Ne(conv(value))
+        case In(values=values):
+            return In(conv(v) for v in values)
+        case Lt(value=value) | Le(value=value) | Gt(value=value) | Ge(value=value):
+            return type(predicate)(conv(value))
+        case Between(low=low, high=high):
+            return Between(conv(low), conv(high))
+    return None
+
+
+def as_predicate(value: Any) -> Predicate:
+    """ Значение условия в виде предиката (обычные значения - равенство) """
+    if isinstance(value, Predicate):
+        return value
+    return Eq(value)
+
+
+def matches(obj: Any, where: dict[str, Any] | None) -> bool:
+    """ Проверить, удовлетворяет ли объект условию where """
+    if where is None:
+        return True
+    for attr, value in where.items():
+        if isinstance(value, Predicate):
+            if not value.match(getattr(obj, attr)):
+                return False
+        elif getattr(obj, attr) != value:
+            return False
+    return True
+
+
+def order_fields(order_by: OrderBy) -> list[tuple[str, bool]]:
+    """
+    Разобрать порядок сортировки: название поля или последовательность
+    названий, '-' перед названием означает сортировку по убыванию.
+    Вернуть список пар (поле, по убыванию).
+    """
+    if order_by is None:
+        return []
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    return [(name[1:], True) if name.startswith('-') else (name, False)
+            for name in order_by]
+
+
+def apply_query(objs: Iterable[Obj],
+                where: dict[str, Any] | None = None,
+                order_by: OrderBy = None,
+                limit: int | None = None,
+                offset: int = 0) -> Iterator[Obj]:
+    """
+    Отфильтровать, упорядочить и ограничить последовательность объектов
+    так же, как это сделал бы SQL-запрос. Без сортировки объекты
+    перебираются лениво.
+    """
+    result: Iterable[Obj] = (obj for obj in objs if matches(obj, where))
+    order = order_fields(order_by)
+    if order:
+        ordered = list(result)
+        # None меньше любого значения, как NULL в SQLite
+        for name, descending in reversed(order):
+            ordered.sort(key=_sort_key(name), reverse=descending)
+        result = ordered
+    stop = None if limit is None else offset + limit
+    return islice(result, offset, stop)
+
+
+def _sort_key(attr: str) -> Callable[[Any], tuple[bool, Any]]:
+    def key(obj: Any) -> tuple[bool, Any]:
+        value = getattr(obj, attr)
+        return (value is not None, value)
+    return key
+
+
+PageCursor = tuple[Any, int]
+
+
+@dataclass(frozen=True)
+class Keyset:
+    """
+    Условие страницы при выборке по ключу (значение поля key, pk).
+    key - название поля, '-' перед названием - порядок по убыванию;
+    cursor - пара (значение поля, pk) объекта, на котором закончилась
+    предыдущая страница (None - с начала);
+    forward - выбирать объекты после курсора (True) или перед ним (False).
+    Значения None считаются меньше любых других, как NULL в SQLite.
+    """
+    key: str = 'pk'
+    cursor: PageCursor | None = None
+    forward: bool = True
+
+    @classmethod
+    def from_cursors(cls, key: str,
+                     after: PageCursor | None,
+                     before: PageCursor | None) -> 'Keyset':
+        """ Условие страницы после курсора after или перед курсором before """
+        if after is not None and before is not None:
+            raise ValueError('only one of `after` and `before` may be given')
+        if before is not None:
+            return cls(key, before, forward=False)
+        return cls(key, after)
+
+    @property
+    def field(self) -> str:
+        """ Название поля ключа """
+        return self.key.removeprefix('-')
+
+    @property
+    def ascending(self) -> bool:
+        """ Идет ли просмотр по возрастанию значений поля """
+        return self.forward != self.key.startswith('-')
+
+    def cursor_of(self, obj: Any) -> PageCursor:
+        """ Курсор, указывающий на объект obj """
+        return getattr(obj, self.field), obj.pk
+
+    def order_by(self) -> list[str]:
+        """ Порядок просмотра: для forward=False - обратный порядку ключа """
+        sign = '' if self.ascending else '-'
+        if self.field == 'pk':
+            return [sign + 'pk']
+        return [sign + self.field, sign + 'pk']
+
+    def arrange(self, objs: Iterable[Obj]) -> list[Obj]:
+        """ Расположить объекты страницы, выбранные в порядке order_by, по ключу """
+        result = list(objs)
+        if not self.forward:
+            result.reverse()
+        return result
+
+    def match(self, obj: Any) -> bool:
+        """ Лежит ли объект по нужную сторону от курсора """
+        if self.cursor is None:
+            return True
+        value, pk = self.cursor_of(obj)
+        cursor_value, cursor_pk = self.cursor
+        key = (value is not None, value, pk)
+        cursor_key = (cursor_value is not None, cursor_value, cursor_pk)
+        return key > cursor_key if self.ascending else key < cursor_key
+
+    def to_sql(self, convert: Converter) -> tuple[str, list[Any]]:
+        """ Условие SQL, отбирающее объекты по нужную сторону от курсора """
+        if self.cursor is None:
+            return '1', []
+        value, pk = self.cursor
+        column = self.field
+        sign = '>' if self.ascending else '<'
+        if column == 'pk':
+            return f"pk {sign} ?", [pk]
+        if value is None:
+            if self.ascending:
+                return f"(({column} IS NULL AND pk > ?) OR {column} IS NOT NULL)", [pk]
+            return f"({column} IS NULL AND pk < ?)", [pk]
+        clause = f"({column}, pk) {sign} (?, ?)"
+        if not self.ascending:
+            clause = f"({clause} OR {column} IS NULL)"
+        return clause, [convert(value), pk]
+
+
+def to_sql(where: dict[str, Any] | None,
+           convert: Converter,
+           order_by: OrderBy = None,
+           limit: int | None = None,
+           offset: int = 0,
+           keyset: Keyset | None = None) -> tuple[str, list[Any]]:
+    """
+    Перевести условие выборки в параметризованный SQL: вернуть окончание
+    запроса после FROM (WHERE, ORDER BY, LIMIT) и список параметров.
+    Условие страницы keyset добавляется к where. Названия полей
+    подставляются в текст запроса как есть и должны быть проверены
+    вызывающей стороной.
+    """
+    text = ''
+    params: list[Any] = []
+    clauses = []
+    for column, value in (where or {}).items():
+        clause, clause_params = as_predicate(value).to_sql(column, convert)
+        clauses.append(clause)
+        params.extend(clause_params)
+    if keyset is not None and keyset.cursor is not None:
+        clause, clause_params = keyset.to_sql(convert)
+        clauses.append(clause)
+        params.extend(clause_params)
+    if clauses:
+        text += " WHERE " + " AND ".join(clauses)
+    order = order_fields(order_by)
+    if order:
+        text += " ORDER BY " + ", ".join(
+            f"{name} DESC" if descending else name for name, descending in order
+        )
+    if limit is not None or offset:
+        text += " LIMIT ?"
+        params.append(-1 if limit is None else limit)
+    if offset:
+        text += " OFFSET ?"
+        params.append(offset)
+    return text, params
+
+
+AggregateFunction = Literal['sum', 'count', 'min', 'max']
+
+Period = Literal['day', 'week', 'month']
+
+
+@dataclass(frozen=True)
+class TimeBucket:
+    """
+    Группировка по периоду времени: значение поля field (datetime или date)
+    заменяется на дату начала периода - день, неделя (с понедельника)
+    или первое число месяца.
+    """
+    field: str
+    period: Period = 'day'
+
+    def __post_init__(self) -> None:
+        if self.period not in ('day', 'week', 'month'):
+            raise ValueError(f'unknown period {self.period!r}')
+
+    def key(self, value: date | None) -> date | None:
+        """ Дата начала периода, в который попадает значение """
+        if value is None:
+            return None
+        if isinstance(value, datetime):
+            value = value.date()
+        if self.period == 'week':
+            return value - timedelta(value.weekday())
+        if self.period == 'month':
+            return value.replace(day=1)
+        return value
+
+
+GroupBy = str | TimeBucket | None
+
+
+def aggregate_objects(objs: Iterable[Any],
+                      func: AggregateFunction,
+                      field_name: str = 'pk',
+                      group_by: GroupBy = None) -> Any:
+    """
+    Вычислить агрегатную функцию func ('sum', 'count', 'min', 'max')
+    от поля field_name по объектам objs так же, как это делает SQL:
+    значения None пропускаются, сумма, минимум и максимум пустого
+    набора - None, количество - 0.
+    Без группировки возвращается одно значение, с группировкой group_by
+    (название поля или TimeBucket) - словарь {ключ группы: значение}.
+    """
+    if func not in _AGGREGATES:
+        raise ValueError(f'unknown aggregate function {func!r}')
+    groups: defaultdict[Any, list[Any]] = defaultdict(list)
+    for obj in objs:
+        if isinstance(group_by, TimeBucket):
+            key = group_by.key(getattr(obj, group_by.field))
+        elif group_by is not None:
+            key = getattr(obj, group_by)
+        else:
+            key = None
+        groups[key].append(getattr(obj, field_name))
+    if group_by is None:
+        return _AGGREGATES[func](groups[None])
+    return {key: _AGGREGATES[func](values) for key, values in groups.items()}
+
+
+def _aggregate(reducer: Callable[[list[Any]], Any],
+               empty: Any = None) -> Callable[[list[Any]], Any]:
+    def aggregate(values: list[Any]) -> Any:
+        values = [value for value in values if value is not None]
+        return reducer(values) if values else empty
+    return aggregate
+
+
+_AGGREGATES: dict[str, Callable[[list[Any]], Any]] = {
+    'sum': _aggregate(sum),
+    'count': _aggregate(len, 0),
+    'min': _aggregate(min),
+    'max': _aggregate(max),
+}
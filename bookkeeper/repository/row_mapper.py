@@ -0,0 +1,124 @@
+"""
+Модуль строит для класса модели функции перевода объектов в строки
+таблицы SQLite и обратно
+
+Функции генерируются один раз для класса и набора полей: в них нет цикла
+по полям, вызовов getattr/setattr и выбора преобразования по типу поля,
+а для датаклассов объект создается одним вызовом конструктора, так что
+значения по умолчанию (например, datetime.now) не вычисляются зря.
+"""
+
+import dataclasses
+import datetime
+import inspect
+import sqlite3
+from functools import lru_cache
+from types import NoneType
+from typing import Any, Callable, ClassVar, NamedTuple, get_args, get_origin
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+FieldTypes = tuple[tuple[str, Any], ...]
+
+
+class RowMapper(NamedTuple):
+    """
+    Пара функций перевода для одного класса модели.
+    decode(cursor, row) создает объект из строки (pk, поле1, поле2, ...)
+    и подходит для использования в качестве row_factory курсора.
+    encode(obj) возвращает кортеж значений полей (без pk) для SQL.
+    """
+    decode: Callable[[sqlite3.Cursor | None, tuple[Any, ...]], Any]
+    encode: Callable[[Any], tuple[Any, ...]]
+
+
+def _strip_optional(tpy: Any) -> Any:
+    """ Тип X для аннотаций вида X | None """
+    args = [arg for arg in get_args(tpy) if arg is not NoneType]
+    if len(args) == 1 and len(get_args(tpy)) == 2:
+        return args[0]
+    return tpy
+
+
+def model_fields(class_type: type) -> FieldTypes:
+    """
+    Пары (название поля, тип) класса модели по аннотациям, без pk
+    и атрибутов класса (ClassVar). Для полей вида X | None тип - X.
+    """
+    return tuple(
+        (name, _strip_optional(tpy))
+        for name, tpy in inspect.get_annotations(class_type, eval_str=True).items()
+        if get_origin(tpy) is not ClassVar  # type: ignore[comparison-overlap]
+        and name != "pk"
+    )
+
+
+def _decode_expr(var: str, tpy: Any, epoch_datetimes: bool) -> str:
+    if tpy is not datetime.datetime:
+        return var
+    if epoch_datetimes:
+        return f"None if {var} is None else EPOCH + {var} * MICROSECOND"
+    return f"None if {var} is None else fromisoformat({var})"
+
+
+def _encode_expr(attr: str, var: str, tpy: Any, epoch_datetimes: bool) -> str:
+    if tpy is not datetime.datetime:
+        return f"obj.{attr}"
+    if epoch_datetimes:
+        converted = f"({var} - EPOCH) // MICROSECOND"
+    else:
+        converted = f"{var}.isoformat(' ', 'seconds')"
+    return f"None if ({var} := obj.{attr}) is None else {converted}"
+
+
+def _uses_constructor(class_type: type, names: set[str]) -> bool:
+    """ Можно ли создать объект, передав все поля в конструктор """
+    if not dataclasses.is_dataclass(class_type):
+        return False
+    init_fields = {f.name for f in dataclasses.fields(class_type) if f.init}
+    return init_fields == names
+
+
+@lru_cache(maxsize=None)
+def compile_mapper(class_type: type,
+                   fields: FieldTypes,
+                   epoch_datetimes: bool) -> RowMapper:
+    """
+    Построить функции перевода для класса class_type.
+    fields - пары (название поля, тип) в порядке столбцов таблицы, без pk;
+    epoch_datetimes - хранятся ли даты как целые микросекунды.
+    Результат кешируется.
+    """
+    names = ["pk"] + [name for name, _ in fields]
+    types = dict(fields)
+    variables = {name: f"v{i}" for i, name in enumerate(names)}
+    decoded = {name: _decode_expr(variables[name], types.get(name), epoch_datetimes)
+               for name in names}
+
+    lines = [
+        "def decode(cursor, row):",
+        f"    {', '.join(variables.values())}, = row",
+    ]
+    if _uses_constructor(class_type, set(names)):
+        args = ", ".join(f"({decoded[f.name]})"
+                         for f in dataclasses.fields(class_type) if f.init)
+        lines.append(f"    return cls({args})")
+    else:
+        lines.append("    obj = cls()")
+        lines.extend(f"    obj.{name} = {decoded[name]}" for name in names)
+        lines.append("    return obj")
+
+    values = ", ".join(_encode_expr(name, f"e{i}", tpy, epoch_datetimes)
+                       for i, (name, tpy) in enumerate(fields))
+    lines.append("def encode(obj):")
+    lines.append(f"    return ({values},)" if fields else "    return ()")
+
+    namespace: dict[str, Any] = {
+        "cls": class_type,
+        "EPOCH": EPOCH,
+        "MICROSECOND": MICROSECOND,
+        "fromisoformat": datetime.datetime.fromisoformat,
+    }
+    exec("\n".join(lines), namespace)  # pylint: disable=exec-used
+    return RowMapper(namespace["decode"], namespace["encode"])
@@ -0,0 +1,278 @@
+"""
+Модуль описывает двоичный формат снимка объектов, хранящихся в памяти
+
+Объекты записываются по столбцам: значения каждого поля упакованы подряд
+(целые числа и даты - 8-байтными целыми, даты - в микросекундах
+от 1970 г., числа с плавающей точкой - double, строки - одной строкой
+UTF-8 с разделителями). При загрузке столбец читается целиком одним
+вызовом array.frombytes или str.split, а объекты создаются одним map
+по столбцам без разбора отдельных значений. Строки и даты, которые часто
+повторяются (комментарии, даты расходов), хранятся словарем: различные
+значения и номера значений, так что при загрузке каждое значение
+создается один раз.
+Вместе с объектами сохраняются следующий pk и описание индексов,
+для упорядоченных индексов - порядок pk, чтобы не сортировать заново.
+
+Формат: сигнатура, версия и длина заголовка (struct "<8sII"), заголовок
+в JSON с описанием столбцов, затем блоки данных, каждый с длиной
+в начале ("<Q"). Поддерживаются поля типов int, float, str и наивные
+datetime, в том числе со значением None.
+"""
+
+import dataclasses
+import gc
+import json
+import os
+import struct
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import repeat
+from operator import attrgetter
+from typing import Any, BinaryIO, Iterator, NamedTuple
+
+from bookkeeper.repository.row_mapper import (
+    EPOCH, MICROSECOND, compile_mapper, model_fields
+)
+
+MAGIC = b"BKMEMSNP"
+VERSION = 1
+
+_PREFIX = struct.Struct("<8sII")
+_LENGTH = struct.Struct("<Q")
+_SEPARATOR = "\0"
+
+_KINDS = {int: "int", float: "float", str: "str", datetime: "datetime"}
+_PLACEHOLDERS: dict[str, Any] = {"int": 0, "float": 0.0, "str": "", "datetime": EPOCH}
+
+
+class Snapshot(NamedTuple):
+    """
+    Содержимое снимка.
+    objects - объекты одного класса в порядке хранения,
+    next_pk - pk, который получит следующий добавленный объект,
+    indexes - поля хеш-индексов,
+    sorted_indexes - поля упорядоченных индексов и pk объектов в порядке
+    индекса (объекты со значением поля None в него не входят),
+    text_indexes - поля полнотекстовых индексов
+    """
+    objects: list[Any]
+    next_pk: int
+    indexes: list[str]
+    sorted_indexes: dict[str, 'array[int]']
+    text_indexes: tuple[str, ...] = ()
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    """
+    Отключить сборщик циклического мусора на время создания множества
+    объектов: иначе он многократно обходит все уже созданные объекты
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _columns(class_type: type) -> list[tuple[str, str]]:
+    """ Пары (название поля, вид столбца), начиная с pk """
+    columns = [("pk", "int")]
+    for name, tpy in model_fields(class_type):
+        if tpy not in _KINDS:
+            raise TypeError(f"Field {name} of type {tpy} is not supported")
+        columns.append((name, _KINDS[tpy]))
+    return columns
+
+
+def _encode(kind: str, values: list[Any]) -> list[bytes]:
+    """ Блоки данных столбца """
+    if kind == "int":
+        return [array("q", values).tobytes()]
+    if kind == "float":
+        return [array("d", values).tobytes()]
+    if kind == "datetime":
+        return [array("q", [(value - EPOCH) // MICROSECOND
+                            for value in values]).tobytes()]
+    text = _SEPARATOR.join(values)
+    if text.count(_SEPARATOR) == max(len(values) - 1, 0):
+        return [text.encode()]
+    # в строках встречается разделитель: сохраняются и их длины
+    return [text.encode(), array("q", map(len, values)).tobytes()]
+
+
+def _strings(blocks: Iterator[memoryview], count: int, separated: bool) -> list[str]:
+    text = str(next(blocks), "utf-8")
+    if not separated:
+        return text.split(_SEPARATOR) if count else []
+    lengths = array("q")
+    lengths.frombytes(next(blocks))
+    result, start = [], 0
+    for length in lengths:
+        result.append(text[start:start + length])
+        start += length + 1
+    return result
+
+
+def _decode(kind: str, blocks: Iterator[memoryview], count: int,
+            separated: bool) -> list[Any]:
+    """ Значения столбца """
+    if kind == "str":
+        strings = _strings(blocks, count, separated)
+        if len(strings) != count:
+            raise ValueError("Snapshot is damaged")
+        return strings
+    column = array("d" if kind == "float" else "q")
+    column.frombytes(next(blocks))
+    if len(column) != count:
+        raise ValueError("Snapshot is damaged")
+    if kind == "datetime":
+        return [EPOCH + value * MICROSECOND for value in column]
+    return column.tolist()
+
+
+def _construct(class_type: type, names: list[str], values: list[list[Any]]) -> list[Any]:
+    """ Создать объекты по столбцам значений полей names """
+    if dataclasses.is_dataclass(class_type):
+        init = [field.name for field in dataclasses.fields(class_type) if field.init]
+        if sorted(init) == sorted(names):
+            columns = dict(zip(names, values))
+            return list(map(class_type, *(columns[name] for name in init)))
+    # значения уже преобразованы: тип object - без преобразования
+    fields = tuple((name, object) for name in names[1:])
+    decode = compile_mapper(class_type, fields, False).decode
+    return list(map(decode, repeat(None), zip(*values)))
+
+
+def _write(stream: BinaryIO, snapshot: Snapshot) -> None:
+    objs = snapshot.objects
+    columns = _columns(type(objs[0])) if objs else []
+    header: dict[str, Any] = {
+        "class": type(objs[0]).__qualname__ if objs else None,
+        "count": len(objs),
+        "next_pk": snapshot.next_pk,
+        "columns": [],
+        "indexes": snapshot.indexes,
+        "sorted_indexes": list(snapshot.sorted_indexes),
+        "text_indexes": snapshot.text_indexes,
+    }
+    blocks: list[bytes] = []
+    for name, kind in columns:
+        values = list(map(attrgetter(name), objs))
+        nulls = bytes(value is None for value in values)
+        has_nulls = any(nulls)
+        if has_nulls:
+            blocks.append(nulls)
+            placeholder = _PLACEHOLDERS[kind]
+            values = [placeholder if value is None else value for value in values]
+        distinct, indices = None, []
+        if kind in ("str", "datetime"):
+            codes: dict[Any, int] = {}
+            indices = [codes.setdefault(value, len(codes)) for value in values]
+            if len(codes) * 2 <= len(values):
+                distinct = len(codes)
+                values = list(codes)
+        data = _encode(kind, values)
+        header["columns"].append({"name": name, "kind": kind, "nulls": has_nulls,
+                                  "separated": len(data) > 1, "distinct": distinct})
+        if distinct is not None:
+            data.append(array("q", indices).tobytes())
+        blocks.extend(data)
+    blocks.extend(order.tobytes() for order in snapshot.sorted_indexes.values())
+
+    encoded = json.dumps(header).encode()
+    stream.write(_PREFIX.pack(MAGIC, VERSION, len(encoded)))
+    stream.write(encoded)
+    for block in blocks:
+        stream.write(_LENGTH.pack(len(block)))
+        stream.write(block)
+
+
+def write_snapshot(file: str | os.PathLike[str] | BinaryIO, snapshot: Snapshot) -> None:
+    """
+    Записать снимок в файл file (путь или файл, открытый для записи
+    в двоичном режиме). Файл по пути заменяется целиком только после
+    успешной записи.
+    """
+    if not isinstance(file, (str, os.PathLike)):
+        _write(file, snapshot)
+        return
+    path = os.fspath(file)
+    with open(path + ".tmp", "wb") as stream:
+        _write(stream, snapshot)
+    os.replace(path + ".tmp", path)
+
+
+def _blocks(data: memoryview, start: int) -> Iterator[memoryview]:
+    position = start
+    while position < len(data):
+        (length,) = _LENGTH.unpack_from(data, position)
+        position += _LENGTH.size
+        if position + length > len(data):
+            break
+        yield data[position:position + length]
+        position += length
+    raise ValueError("Snapshot is damaged")
+
+
+def _read_column(column: dict[str, Any], blocks: Iterator[memoryview],
+                 count: int) -> list[Any]:
+    """ Значения столбца, описанного в заголовке словарем column """
+    nulls = bytes(next(blocks)) if column["nulls"] else None
+    distinct = column["distinct"]
+    values = _decode(column["kind"], blocks, count if distinct is None else distinct,
+                     column["separated"])
+    if distinct is not None:
+        # столбец хранится словарем: различные значения и их номера
+        codes = array("q")
+        codes.frombytes(next(blocks))
+        if len(codes) != count:
+            raise ValueError("Snapshot is damaged")
+        values = list(map(values.__getitem__, codes))
+    if nulls is not None:
+        values = [None if null else value for value, null in zip(values, nulls)]
+    return values
+
+
+def _read(data: memoryview, class_type: type) -> Snapshot:
+    if len(data) < _PREFIX.size:
+        raise ValueError("Not a repository snapshot")
+    magic, version, header_size = _PREFIX.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a repository snapshot")
+    if version != VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}")
+    header = json.loads(bytes(data[_PREFIX.size:_PREFIX.size + header_size]))
+    count = header["count"]
+    columns = [(column["name"], column["kind"]) for column in header["columns"]]
+    if count and (header["class"] != class_type.__qualname__
+                  or columns != _columns(class_type)):
+        raise ValueError(f"Snapshot does not contain {class_type.__qualname__} objects")
+
+    blocks = _blocks(data, _PREFIX.size + header_size)
+    with _gc_paused():
+        values = [_read_column(column, blocks, count) for column in header["columns"]]
+        objs = _construct(class_type, [name for name, _ in columns], values)
+    sorted_indexes = {}
+    for attr in header["sorted_indexes"]:
+        sorted_indexes[attr] = order = array("q")
+        order.frombytes(next(blocks))
+    return Snapshot(objs, header["next_pk"], header["indexes"], sorted_indexes,
+                    tuple(header.get("text_indexes", ())))
+
+
+def read_snapshot(file: str | os.PathLike[str] | BinaryIO, class_type: type) -> Snapshot:
+    """
+    Прочитать снимок объектов класса class_type из файла file (путь или файл,
+    открытый для чтения в двоичном режиме). Если файл не является снимком
+    или содержит объекты другого класса, вызывается ValueError.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as stream:
+            data = stream.read()
+    else:
+        data = file.read()
+    return _read(memoryview(data), class_type)
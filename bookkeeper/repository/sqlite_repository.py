@@ -1,57 +1,634 @@
-import sqlite3
-import inspect
-from typing import Any, cast, Optional
-from bookkeeper.repository.abstract_repository import AbstractRepository, T
+"""
+Модуль описывает репозиторий, работающий с базой данных SQLite
+"""
+
 import datetime
+import os
+import sqlite3
+import threading
+import time
+from contextlib import AbstractContextManager, contextmanager
+from functools import partial
+from pathlib import Path
+from types import TracebackType
+from typing import (
+    Any, Callable, Iterable, Iterator, Literal, NamedTuple, Sequence, cast
+)
 
+from bookkeeper.repository.abstract_repository import (
+    AbstractRepository, ChangeEvent, Index, T
+)
+from bookkeeper.repository.fulltext import parse_query
+from bookkeeper.repository.instrumentation import StatementLog
+from bookkeeper.repository.query import (
+    AggregateFunction, GroupBy, In, Keyset, OrderBy, PageCursor, TimeBucket,
+    order_fields, to_sql
+)
+from bookkeeper.repository.row_mapper import (
+    EPOCH, MICROSECOND, compile_mapper, model_fields
+)
 
-class SQliteRepository(AbstractRepository[T]):
+DatetimeStorage = Literal["text", "epoch"]
+
+
+class _LoggedCursor(sqlite3.Cursor):
+    """
+    Курсор, записывающий запросы в журнал соединения. Запрос, возвращающий
+    строки, записывается, когда прочитана последняя строка или курсор
+    закрыт либо выполняет следующий запрос.
     """
-    Репозиторий, работающий в ??. ??
+    _pending: list[Any] | None = None
+
+    def _finish(self) -> None:
+        if self._pending is not None:
+            sql, params, elapsed, rows = self._pending
+            self._pending = None
+            self._log.record(sql, params, elapsed, rows)
+
+    @property
+    def _log(self) -> StatementLog:
+        return cast(_LoggedConnection, self.connection).statement_log
+
+    def _fetched(self, start: float, rows: int, exhausted: bool) -> None:
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - start
+            self._pending[3] += rows
+            if exhausted:
+                self._finish()
+
+    def execute(self, sql: str, parameters: Any = (), /) -> "_LoggedCursor":
+        """ Выполнить запрос и записать его в журнал """
+        self._finish()
+        log = self._log
+        if not log.enabled:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except BaseException:
+            log.record(sql, parameters, time.perf_counter() - start, 0, True)
+            raise
+        elapsed = time.perf_counter() - start
+        if self.description is None:
+            log.record(sql, parameters, elapsed, max(self.rowcount, 0))
+        else:
+            self._pending = [sql, parameters, elapsed, 0]
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable[Any], /
+                    ) -> "_LoggedCursor":
+        """ Выполнить запрос для каждого набора параметров, записав его один раз """
+        self._finish()
+        log = self._log
+        if not log.enabled:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except BaseException:
+            log.record(sql, None, time.perf_counter() - start, 0, True)
+            raise
+        log.record(sql, None, time.perf_counter() - start, max(self.rowcount, 0))
+        return self
+
+    def fetchone(self) -> Any:
+        """ Прочитать строку, учитывая время чтения в запросе """
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size: int | None = 1) -> list[Any]:
+        """ Прочитать не больше size строк, учитывая время чтения в запросе """
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows), len(rows) < (size or self.arraysize))
+        return rows
+
+    def fetchall(self) -> list[Any]:
+        """ Прочитать оставшиеся строки, учитывая время чтения в запросе """
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __next__(self) -> Any:
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0, True)
+            raise
+        self._fetched(start, 1, False)
+        return row
+
+    def close(self) -> None:
+        """ Записать незавершенный запрос и закрыть курсор """
+        self._finish()
+        super().close()
+
+    def __del__(self) -> None:
+        self._finish()
+
+
+class _LoggedConnection(sqlite3.Connection):
+    """ Соединение, курсоры которого записывают запросы в statement_log """
+    statement_log: StatementLog
+
+    def cursor(self, factory: Any = None) -> Any:
+        """ Курсор класса factory, по умолчанию - записывающий запросы """
+        return super().cursor(factory or _LoggedCursor)
+
+    def execute(self, sql: str, parameters: Any = (), /) -> _LoggedCursor:
+        """ Выполнить запрос новым курсором """
+        cursor: _LoggedCursor = self.cursor()
+        return cursor.execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters: Iterable[Any], /) -> _LoggedCursor:
+        """ Выполнить запрос для каждого набора параметров новым курсором """
+        cursor: _LoggedCursor = self.cursor()
+        return cursor.executemany(sql, parameters)
+
+
+def _unicode_lower(value: Any) -> Any:
+    """
+    Строка в нижнем регистре для всех алфавитов, в отличие от встроенной
+    функции lower; используется в условиях Like с нелатинскими буквами
+    """
+    return value.lower() if isinstance(value, str) else value
+
+
+def reset_pks(objs: Iterable[Any]) -> None:
+    """ Обнулить pk объектов, добавление которых откатилось """
+    for obj in objs:
+        obj.pk = 0
+
+
+class SQliteDatabase:
+    """
+    Подключение к файлу базы данных SQLite, общее для нескольких репозиториев.
+    Каждый поток получает собственное долгоживущее соединение, которое
+    создается при первом обращении; прагмы применяются один раз при
+    создании соединения. Закрывается методом close или при выходе
+    из блока with.
+
+    Метод transaction открывает единицу работы: все изменения, сделанные
+    внутри блока with через любые репозитории этой базы в текущем потоке,
+    фиксируются одной транзакцией при выходе из внешнего блока или
+    откатываются при исключении. Вложенные блоки используют точки
+    сохранения (SAVEPOINT) и откатывают только свои изменения.
+
+    Если задан statement_log, все запросы соединений записываются в этот
+    журнал (см. модуль instrumentation); без журнала соединения
+    не инструментируются.
+
+    cached_statements - размер кеша подготовленных запросов каждого
+    соединения: запрос с тем же текстом не разбирается и не планируется
+    заново. Репозитории передают значения параметрами, так что число
+    различных текстов запросов невелико.
+
+    Если read_only, файл открывается только для чтения (URI с mode=ro):
+    любая запись, в том числе миграция схемы, завершается ошибкой.
     """
 
-    def __init__(self, base_name: str, class_type: type) -> None:
+    def __init__(self, base_name: str | os.PathLike[str],
+                 statement_log: StatementLog | None = None,
+                 cached_statements: int = 256,
+                 read_only: bool = False) -> None:
         self._base_name = base_name
-        self._table_name = class_type.__name__
-        self._fields = inspect.get_annotations(class_type, eval_str=True)
-        self._fields.pop("pk")
+        self.read_only = read_only
+        self.statement_log = statement_log
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """ Соединение текущего потока """
+        con: sqlite3.Connection | None = getattr(self._local, "con", None)
+        if con is None:
+            con = self._connect()
+            self._local.con = con
+        return con
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+            database: str | os.PathLike[str] = self._base_name
+            if self.read_only:
+                database = Path(database).absolute().as_uri() + "?mode=ro"
+            if self.statement_log is None:
+                con = sqlite3.connect(database, check_same_thread=False,
+                                      cached_statements=self.cached_statements,
+                                      uri=self.read_only)
+            else:
+                logged = sqlite3.connect(database, check_same_thread=False,
+                                         cached_statements=self.cached_statements,
+                                         uri=self.read_only, factory=_LoggedConnection)
+                logged.statement_log = self.statement_log
+                con = logged
+            con.execute("PRAGMA foreign_keys = ON")
+            con.create_function("unicode_lower", 1, _unicode_lower, deterministic=True)
+            self._connections.append(con)
+        return con
+
+    @classmethod
+    def open(cls, base_name: "str | os.PathLike[str] | SQliteDatabase"
+             ) -> tuple["SQliteDatabase", bool]:
+        """
+        Подключение для репозитория: base_name, если это уже подключение,
+        иначе новое подключение к файлу. Второй элемент - владеет ли
+        репозиторий подключением, то есть должен ли он его закрыть.
+        """
+        if isinstance(base_name, SQliteDatabase):
+            return base_name, False
+        return cls(base_name), True
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """ Единица работы, см. описание класса """
+        con = self.connection
+        depth: int = getattr(self._local, "depth", 0)
+        pending: list[Callable[[], None]] = self._local.__dict__.setdefault("pending", [])
+        undo: list[Callable[[], object]] = self._local.__dict__.setdefault("undo", [])
+        mark, undo_mark = len(pending), len(undo)
+        savepoint = f"sp{depth}"
+        con.execute(f"SAVEPOINT {savepoint}" if depth else "BEGIN IMMEDIATE")
+        self._local.depth = depth + 1
+        try:
+            yield con
+        except BaseException:
+            del pending[mark:]
+            if depth:
+                con.execute(f"ROLLBACK TO {savepoint}")
+                con.execute(f"RELEASE {savepoint}")
+            else:
+                con.rollback()
+            self._undo(undo_mark)
+            raise
+        else:
+            if depth:
+                con.execute(f"RELEASE {savepoint}")
+            else:
+                try:
+                    con.commit()
+                except sqlite3.Error:
+                    pending.clear()
+                    con.rollback()
+                    self._undo(0)
+                    raise
+        finally:
+            self._local.depth = depth
+        if not depth:
+            undo.clear()
+            callbacks = pending[:]
+            pending.clear()
+            for callback in callbacks:
+                callback()
+
+    def _undo(self, mark: int) -> None:
+        """ Вызвать в обратном порядке callback'и on_rollback, начиная с mark """
+        undo: list[Callable[[], object]] = self._local.undo
+        callbacks = undo[mark:]
+        del undo[mark:]
+        for callback in reversed(callbacks):
+            callback()
+
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Вызвать callback после фиксации внешней транзакции текущего потока.
+        Если транзакция (или точка сохранения, в которой вызван метод)
+        откатывается, callback не вызывается. Вне транзакции callback
+        вызывается сразу.
+        """
+        if getattr(self._local, "depth", 0):
+            self._local.pending.append(callback)
+        else:
+            callback()
+
+    def on_rollback(self, callback: Callable[[], object]) -> None:
+        """
+        Вызвать callback, если транзакция текущего потока (или точка
+        сохранения, в которой вызван метод) откатывается: например,
+        чтобы забыть таблицу, созданную в этой транзакции. Вне транзакции
+        изменения уже зафиксированы, и callback не вызывается.
+        """
+        if getattr(self._local, "depth", 0):
+            self._local.undo.append(callback)
+
+    def close(self) -> None:
+        """ Закрыть соединения всех потоков """
+        with self._lock:
+            self._closed = True
+            for con in self._connections:
+                con.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def __enter__(self) -> "SQliteDatabase":
+        return self
+
+    def __exit__(self,
+                 exc_type: type[BaseException] | None,
+                 exc_val: BaseException | None,
+                 exc_tb: TracebackType | None) -> None:
+        self.close()
+
+
+class _Statements(NamedTuple):
+    """
+    Запросы по первичному ключу, составляемые один раз для таблицы;
+    значения передаются параметрами
+    """
+    insert: str
+    insert_with_pk: str
+    get: str
+    update: str
+    delete: str
+
+    @classmethod
+    def compile(cls, table: str, fields: Sequence[str]) -> "_Statements":
+        """ Запросы к таблице table с полями fields (без pk) """
+        names = ", ".join(fields)
+        placeholders = ", ".join("?" * len(fields))
+        columns = ", ".join(["pk", *fields])
+        return cls(
+            insert=f"INSERT INTO {table} ({names}) VALUES ({placeholders})",
+            insert_with_pk=(f"INSERT INTO {table} ({columns})"
+                            + f" VALUES ({', '.join('?' * (len(fields) + 1))})"),
+            get=f"SELECT {columns} FROM {table} WHERE pk = ?",
+            update=f"UPDATE {table} SET ({names}) = ({placeholders}) WHERE pk = ?",
+            delete=f"DELETE FROM {table} WHERE pk = ?",
+        )
+
+
+class SQliteRepository(AbstractRepository[T]):
+    """
+    Репозиторий, работающий с базой данных SQLite. Каждый класс моделей
+    хранится в отдельной таблице с именем класса (или table_name).
+    base_name - путь к файлу базы данных или общее подключение SQliteDatabase.
+    Если передан путь, репозиторий сам владеет подключением и закрывает его
+    в методе close.
+
+    Индексы, объявленные в атрибуте indexes класса модели, создаются
+    автоматически. Описание схемы каждой таблицы (столбцы и индексы)
+    запоминается в служебной таблице _schema вместе с номером версии;
+    если при открытии описание изменилось, схема обновляется на месте:
+    добавляются новые столбцы, создаются новые и удаляются лишние индексы.
+    Если схема не изменилась, при открытии выполняется только один запрос.
+
+    datetime_storage - способ хранения полей datetime: "text" - строка
+    '%Y-%m-%d %H:%M:%S' (по умолчанию), "epoch" - целое число микросекунд
+    от 1970-01-01 (для наивных дат без часового пояса). Целые числа быстрее
+    разбираются и сравниваются в индексах. При смене способа хранения
+    существующая таблица перестраивается с преобразованием значений.
+
+    Подписчики получают события после фиксации транзакции, в которой
+    сделаны изменения, и не получают их при откате. Прежние объекты
+    для событий читаются из базы, только если есть подписчики.
+
+    Для полнотекстового индекса (Index(..., fulltext=True) в модели
+    или поле из text_indexes) создается таблица FTS5 с внешним содержимым
+    (content=таблица модели) и триггеры, которые обновляют ее при
+    добавлении, изменении и удалении записей, так что репозиторий
+    не выполняет для этого отдельных запросов. Триггеры замедляют
+    каждое изменение, поэтому индекс создается только там, где нужен
+    search; репозитории одной таблицы должны передавать одинаковые
+    text_indexes, иначе каждый из них будет перестраивать схему.
+    """
+
+    SCHEMA_TABLE = "_schema"
+
+    def __init__(self,
+                 base_name: str | os.PathLike[str] | SQliteDatabase,
+                 class_type: type,
+                 datetime_storage: DatetimeStorage = "text",
+                 table_name: str | None = None,
+                 text_indexes: Iterable[str] = ()) -> None:
+        if datetime_storage not in ("text", "epoch"):
+            raise ValueError(f"Unknown datetime storage {datetime_storage!r}")
+        self._epoch_datetimes = datetime_storage == "epoch"
+        self._db, self._owns_db = SQliteDatabase.open(base_name)
+        self._table_name = table_name or class_type.__name__
+        self._fields = dict(model_fields(class_type))
         self._class_type = class_type
+        self._indexes: tuple[Index, ...] = getattr(class_type, "indexes", ())
+        for name in text_indexes:
+            if Index(name, fulltext=True) not in self._indexes:
+                self._indexes += (Index(name, fulltext=True),)
+        for index in self._indexes:
+            self._check_fields(index.fields)
+            if index.fulltext and any(self._fields[name] is not str
+                                      for name in index.fields):
+                raise ValueError("fulltext index fields must be strings")
+        self._columns = ", ".join(["pk", *self._fields])
+        self._sql = _Statements.compile(self._table_name, list(self._fields))
+        self._decode, self._encode = compile_mapper(
+            class_type, tuple(self._fields.items()), self._epoch_datetimes
+        )
+
+        if self._schema_version() != self._schema_signature():
+            if self._db.read_only:
+                raise sqlite3.OperationalError(
+                    f"schema of {self._table_name} does not match the model;"
+                    + " a read-only database cannot be migrated")
+            self._migrate()
+
+    def _schema_signature(self) -> str:
+        """ Описание схемы таблицы, при изменении которого нужна миграция """
+        columns = ", ".join(f"{name} {self._py_to_sql(tpy)}"
+                            for name, tpy in self._fields.items())
+        indexes = ", ".join(f"{self._index_name(index)}({', '.join(index.fields)})"
+                            for index in self._indexes)
+        return f"columns: {columns}; indexes: {indexes}"
 
-        with sqlite3.connect(self._base_name) as con:
-            cur = con.cursor()
-            cur.execute("PRAGMA foreign_keys = ON")
-            cur.execute(
-                f"CREATE TABLE IF NOT EXISTS {self._table_name}"
-                + "(pk INTEGER PRIMARY KEY NOT NULL"
-                + " ".join(
-                    f", {name} {self._py_to_sql(tpy)}"
-                    for name, tpy in self._fields.items()
+    def _index_name(self, index: Index) -> str:
+        prefix = "fts" if index.fulltext else "ux" if index.unique else "ix"
+        return "_".join([prefix, self._table_name, *index.fields])
+
+    def _schema_version(self) -> str | None:
+        try:
+            row = self._db.connection.execute(
+                f"SELECT signature FROM {self.SCHEMA_TABLE} WHERE table_name = ?",
+                [self._table_name],
+            ).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return None if row is None else cast(str, row[0])
+
+    def _migrate(self) -> None:
+        """
+        Привести схему таблицы в соответствие с моделью.
+        Выполняется в одной транзакции.
+        """
+        table = self._table_name
+        signature = self._schema_signature()
+        with self._db.transaction() as con:
+            con.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.SCHEMA_TABLE}"
+                + "(table_name TEXT PRIMARY KEY NOT NULL,"
+                + " version INTEGER NOT NULL, signature TEXT NOT NULL)"
+            )
+            if self._schema_version() == signature:
+                return
+            con.execute(self._create_table_sql(table))
+            existing = {row[1]: row[2]
+                        for row in con.execute(f"PRAGMA table_info({table})")}
+            if any(name in existing and existing[name] != self._py_to_sql(tpy)
+                   for name, tpy in self._fields.items()):
+                self._rebuild_table(con, existing)
+            for name, tpy in self._fields.items():
+                if name not in existing:
+                    con.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {name} {self._py_to_sql(tpy)}"
+                    )
+            declared = {self._index_name(index): index
+                        for index in self._indexes if not index.fulltext}
+            for (name,) in con.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index'"
+                    + " AND tbl_name = ?", [table]).fetchall():
+                if name.startswith(("ix_", "ux_")) and name not in declared:
+                    con.execute(f"DROP INDEX {name}")
+            for name, index in declared.items():
+                unique = "UNIQUE " if index.unique else ""
+                con.execute(
+                    f"CREATE {unique}INDEX IF NOT EXISTS {name}"
+                    + f" ON {table} ({', '.join(index.fields)})"
                 )
-                + ")"
+            self._migrate_fulltext(con)
+            con.execute(
+                f"INSERT INTO {self.SCHEMA_TABLE} (table_name, version, signature)"
+                + " VALUES (?, 1, ?) ON CONFLICT (table_name) DO UPDATE"
+                + " SET version = version + 1, signature = excluded.signature",
+                [table, signature],
             )
-        con.close()
+
+    def _migrate_fulltext(self, con: sqlite3.Connection) -> None:
+        """
+        Создать таблицы FTS5 и триггеры полнотекстовых индексов, удалить
+        лишние и заново проиндексировать таблицу (она могла измениться,
+        пока триггеров не было)
+        """
+        table = self._table_name
+        declared = {self._index_name(index): index
+                    for index in self._indexes if index.fulltext}
+        for name, sql in con.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'table'"
+                + " AND sql LIKE 'CREATE VIRTUAL TABLE%'").fetchall():
+            if (name.startswith(f"fts_{table}_") and f"content='{table}'" in sql
+                    and name not in declared):
+                for suffix in ("ai", "ad", "au"):
+                    con.execute(f"DROP TRIGGER IF EXISTS {name}_{suffix}")
+                con.execute(f"DROP TABLE {name}")
+        for name, index in declared.items():
+            columns = ", ".join(index.fields)
+            insert = (f"INSERT INTO {name} (rowid, {columns}) VALUES (new.pk, "
+                      + ", ".join(f"new.{field}" for field in index.fields) + ");")
+            delete = (f"INSERT INTO {name} ({name}, rowid, {columns})"
+                      + " VALUES ('delete', old.pk, "
+                      + ", ".join(f"old.{field}" for field in index.fields) + ");")
+            changed = " OR ".join(f"old.{field} IS NOT new.{field}"
+                                  for field in index.fields)
+            con.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({columns},"
+                + f" content='{table}', content_rowid='pk',"
+                + " tokenize='unicode61 remove_diacritics 0')"
+            )
+            con.execute(f"CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {table}"
+                        + f" BEGIN {insert} END")
+            con.execute(f"CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {table}"
+                        + f" BEGIN {delete} END")
+            con.execute(f"CREATE TRIGGER IF NOT EXISTS {name}_au"
+                        + f" AFTER UPDATE OF {columns} ON {table}"
+                        + f" WHEN {changed} BEGIN {delete} {insert} END")
+            con.execute(f"INSERT INTO {name} ({name}) VALUES ('rebuild')")
+
+    def _create_table_sql(self, table: str) -> str:
+        return (
+            f"CREATE TABLE IF NOT EXISTS {table}"
+            + "(pk INTEGER PRIMARY KEY NOT NULL"
+            + " ".join(
+                f", {name} {self._py_to_sql(tpy)}"
+                for name, tpy in self._fields.items()
+            )
+            + ")"
+        )
+
+    def _rebuild_table(self, con: sqlite3.Connection, existing: dict[str, str]) -> None:
+        """
+        Перестроить таблицу, у которой изменились типы столбцов,
+        преобразовав хранящиеся даты. Индексы таблицы удаляются вместе с ней
+        и создаются заново в _migrate.
+        """
+        table = self._table_name
+        new_table = f"{table}__rebuild"
+        con.execute(self._create_table_sql(new_table))
+        values = ["pk"]
+        for name, tpy in self._fields.items():
+            old_type = existing.get(name)
+            if old_type is None:
+                values.append("NULL")
+            elif tpy is datetime.datetime and old_type != self._py_to_sql(tpy):
+                if self._epoch_datetimes:
+                    values.append(f"CAST(strftime('%s', {name}) AS INTEGER) * 1000000")
+                else:
+                    values.append(f"strftime('%Y-%m-%d %H:%M:%S', {name} / 1000000,"
+                                  + " 'unixepoch')")
+            else:
+                values.append(name)
+            # после перестройки в таблице есть все столбцы модели
+            existing[name] = self._py_to_sql(tpy)
+        con.execute(f"INSERT INTO {new_table} ({self._columns})"
+                    + f" SELECT {', '.join(values)} FROM {table}")
+        con.execute(f"DROP TABLE {table}")
+        con.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+
+    def transaction(self) -> AbstractContextManager[Any]:
+        """
+        Единица работы над всей базой данных, см. SQliteDatabase.transaction
+        """
+        return self._db.transaction()
+
+    def close(self) -> None:
+        """ Закрыть подключение, если оно принадлежит репозиторию """
+        if self._owns_db:
+            self._db.close()
+
+    def __enter__(self) -> "SQliteRepository[T]":
+        return self
+
+    def __exit__(self,
+                 exc_type: type[BaseException] | None,
+                 exc_val: BaseException | None,
+                 exc_tb: TracebackType | None) -> None:
+        self.close()
 
     def _py_to_sql(self, tpy: type) -> str:
         if tpy == int:
             return "INTEGER"
-        if tpy == Optional[int]:
-            return "INTEGER"
         if tpy == str:
             return "TEXT"
         if tpy == float:
             return "REAL"
         if tpy == datetime.datetime:
-            return "TEXT"
+            return "INTEGER" if self._epoch_datetimes else "TEXT"
         raise ValueError(f"Type {tpy} is not supported")
 
     def _val_from_sql(self, tpy: type, val: Any) -> Any:
-        if tpy is datetime.datetime:
-            return datetime.datetime.strptime(val, "%Y-%m-%d %H:%M:%S")
+        if tpy is datetime.datetime and val is not None:
+            if self._epoch_datetimes:
+                return EPOCH + val * MICROSECOND
+            return datetime.datetime.fromisoformat(val)
         return val
 
     def _val_to_sql(self, val: Any) -> Any:
         if isinstance(val, datetime.datetime):
-            return val.strftime("%Y-%m-%d %H:%M:%S")
+            if self._epoch_datetimes:
+                return (val - EPOCH) // MICROSECOND
+            return val.isoformat(" ", "seconds")
 
         return val
 
@@ -59,102 +636,326 @@ class SQliteRepository(AbstractRepository[T]):
         if getattr(obj, "pk", None) != 0:
             raise ValueError("Trying to add object with filled 'pk' attribute")
 
-        names = ", ".join(self._fields)
-        placeholders = ", ".join("?" * len(self._fields))
+        values = self._encode(obj)
 
-        values = [self._val_to_sql(getattr(obj, key)) for key in self._fields]
-
-        with sqlite3.connect(self._base_name) as con:
-            cur = con.cursor()
-            cur.execute("PRAGMA foreign_keys = ON")
-            cur.execute(
-                f"INSERT INTO {self._table_name} ({names}) VALUES ({placeholders});",
-                values,
-            )
+        with self._db.transaction() as con:
+            cur = con.execute(self._sql.insert, values)
 
             assert cur.lastrowid is not None
             obj.pk = cur.lastrowid
-
-        con.close()
+            self._publish([ChangeEvent("added", None, obj)])
 
         return obj.pk
 
     def get(self, pk: int) -> T | None:
         """Получить объект по id"""
 
-        with sqlite3.connect(self._base_name) as con:
-            cur = con.cursor()
-            cur.execute("PRAGMA foreign_keys = ON")
-            cur.execute(f"SELECT * FROM {self._table_name} WHERE pk = {pk}")
-            res = cur.fetchone()
-        con.close()
-        if res is None:
-            return None
-        obj = self._class_type()
-        setattr(obj, "pk", res[0])
-        for i, (name, tpy) in enumerate(self._fields.items(), 1):
-            setattr(obj, name, self._val_from_sql(tpy, res[i]))
-        assert isinstance(obj, self._class_type)
-        return cast(T, obj)
+        cur = self._db.connection.cursor()
+        cur.row_factory = self._decode
+        cur.execute(self._sql.get, (pk,))
+        return cast(T | None, cur.fetchone())
 
-    def get_all(self, where: dict[str, Any] | None = None) -> list[T]:
+    def get_all(self, where: dict[str, Any] | None = None, *,
+                order_by: OrderBy = None,
+                limit: int | None = None,
+                offset: int = 0) -> list[T]:
         """
         Получить все записи по некоторому условию
         where - условие в виде словаря {'название_поля': значение}
-        если условие не задано (по умолчанию), вернуть все записи
+        если условие не задано (по умолчанию), вернуть все записи.
+        Условие, сортировка и ограничения выполняются средствами SQL.
         """
-        with sqlite3.connect(self._base_name) as con:
-            cur = con.cursor()
-            cur.execute("PRAGMA foreign_keys = ON")
-            if where is None:
-                cur.execute(f"SELECT * FROM {self._table_name}")
-            else:
-                where_keys = list(where.keys())
-                where_values = list(where.values())
-                text = f"SELECT * FROM {self._table_name} WHERE {where_keys[0]} = ?"
-                for i in range(1, len(where)):
-                    text += f" AND {where_keys[i]} = ?"
-                cur.execute(text, where_values)
-            res = cur.fetchall()
-        con.close()
-        out = []
-        for element in res:
-            obj = self._class_type()
-            setattr(obj, "pk", element[0])
-            for j, (name, tpy) in enumerate(self._fields.items(), 1):
-                setattr(obj, name, self._val_from_sql(tpy, element[j]))
-            out.append(obj)
-        return out
+        cur = self._select(self._columns, where, order_by, limit, offset,
+                           row_factory=self._decode)
+        return cur.fetchall()
+
+    def iter_all(self, where: dict[str, Any] | None = None,
+                 batch_size: int = 1000, *,
+                 order_by: OrderBy = None,
+                 limit: int | None = None,
+                 offset: int = 0) -> Iterator[T]:
+        """
+        Перебрать записи по условию where, читая из курсора
+        по batch_size строк и создавая объекты по мере перебора
+        """
+        cur = self._select(self._columns, where, order_by, limit, offset,
+                           row_factory=self._decode)
+        try:
+            while objs := cur.fetchmany(batch_size):
+                yield from objs
+        finally:
+            cur.close()
+
+    def page(self, key: str = "pk", limit: int = 100, *,
+             after: PageCursor | None = None,
+             before: PageCursor | None = None,
+             where: dict[str, Any] | None = None) -> list[T]:
+        """
+        Получить страницу запросом вида
+        WHERE (key, pk) > (?, ?) ORDER BY key, pk LIMIT ?.
+        Если по полю key есть индекс, запрос читает только строки страницы,
+        так что любая страница выбирается так же быстро, как первая.
+        """
+        keyset = Keyset.from_cursors(key, after, before)
+        return keyset.arrange(self._select(self._columns, where, keyset.order_by(), limit,
+                                           row_factory=self._decode, keyset=keyset))
+
+    def search(self, query: str, field: str,
+               where: dict[str, Any] | None = None,
+               limit: int | None = None) -> list[T]:
+        """
+        Полнотекстовый поиск запросом MATCH к таблице FTS5 полнотекстового
+        индекса, в который входит поле field; результаты упорядочены
+        по релевантности (bm25). Без такого индекса записи перебираются,
+        см. AbstractRepository.search.
+        """
+        index = next((index for index in self._indexes
+                      if index.fulltext and field in index.fields), None)
+        if index is None:
+            return super().search(query, field, where, limit)
+        text_query = parse_query(query)
+        if not text_query:
+            return []
+        if where:
+            self._check_fields(where)
+        fts = self._index_name(index)
+        match = text_query.to_fts5()
+        if len(index.fields) > 1:
+            match = f"{field} : ({match})"
+        text, params = to_sql(where, self._val_to_sql)
+        sql = (f"SELECT {self._columns} FROM (SELECT rowid AS fts_pk, rank AS fts_rank"
+               + f" FROM {fts} WHERE {fts} MATCH ?)"
+               + f" JOIN {self._table_name} ON pk = fts_pk{text} ORDER BY fts_rank")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        cur = self._db.connection.cursor()
+        cur.row_factory = self._decode
+        return cur.execute(sql, [match, *params]).fetchall()
+
+    def iter_values(self, fields: Sequence[str],
+                    where: dict[str, Any] | None = None,
+                    batch_size: int = 1000, *,
+                    order_by: OrderBy = None,
+                    limit: int | None = None,
+                    offset: int = 0) -> Iterator[tuple[Any, ...]]:
+        """
+        Перебрать значения полей fields, выбирая из таблицы только
+        нужные столбцы
+        """
+        self._check_fields(fields)
+        types = [self._fields.get(name, int) for name in fields]
+        cur = self._select(", ".join(fields), where, order_by, limit, offset)
+        try:
+            while rows := cur.fetchmany(batch_size):
+                for row in rows:
+                    yield tuple(self._val_from_sql(tpy, val)
+                                for tpy, val in zip(types, row))
+        finally:
+            cur.close()
+
+    def iter_batches(self, fields: Sequence[str],
+                     where: dict[str, Any] | None = None,
+                     batch_size: int = 1000, *,
+                     order_by: OrderBy = None,
+                     day_fields: Sequence[str] = ()) -> Iterator[list[tuple[Any, ...]]]:
+        """
+        Перебрать значения полей fields пачками по batch_size строк в том
+        виде, в котором их возвращает SQLite, без преобразования каждого
+        значения. Поля datetime из day_fields вычисляются в запросе как
+        номера дней (date.toordinal), что удобно для построения столбцов.
+        """
+        self._check_fields(fields)
+        self._check_fields(day_fields)
+        columns = ", ".join(self._day_sql(name) if name in day_fields else name
+                            for name in fields)
+        cur = self._select(columns, where, order_by)
+        try:
+            while rows := cur.fetchmany(batch_size):
+                yield rows
+        finally:
+            cur.close()
+
+    def _day_sql(self, field: str) -> str:
+        """ Выражение SQL для номера дня (date.toordinal) поля datetime """
+        if self._epoch_datetimes:
+            day = datetime.timedelta(days=1) // MICROSECOND
+            # целочисленное деление в SQLite отбрасывает дробную часть,
+            # для дат до 1970 года нужно округление вниз
+            return f"{field} / {day} - ({field} % {day} < 0) + {EPOCH.toordinal()}"
+        # julianday('0001-01-01') = 1721425.5, а date.toordinal дает для него 1
+        return f"CAST(julianday({field}) - 1721424.5 AS INTEGER)"
+
+    def aggregate(self, func: AggregateFunction,
+                  field: str = "pk",
+                  where: dict[str, Any] | None = None,
+                  group_by: GroupBy = None) -> Any:
+        """
+        Вычислить агрегатную функцию запросом с GROUP BY,
+        не создавая объекты моделей
+        """
+        if func not in ("sum", "count", "min", "max"):
+            raise ValueError(f"unknown aggregate function {func!r}")
+        self._check_fields([field])
+        if where:
+            self._check_fields(where)
+        text, params = to_sql(where, self._val_to_sql)
+        value_type = int if func == "count" else self._fields.get(field, int)
+        con = self._db.connection
+        if group_by is None:
+            (value,) = con.execute(
+                f"SELECT {func.upper()}({field}) FROM {self._table_name}{text}", params
+            ).fetchone()
+            return self._val_from_sql(value_type, value)
+
+        if isinstance(group_by, TimeBucket):
+            self._check_fields([group_by.field])
+            key_expr = self._bucket_sql(group_by)
+        else:
+            self._check_fields([group_by])
+            key_expr = group_by
+        rows = con.execute(
+            f"SELECT {key_expr}, {func.upper()}({field}) FROM {self._table_name}{text}"
+            + " GROUP BY 1", params
+        )
+        if isinstance(group_by, TimeBucket):
+            return {
+                None if key is None else datetime.date.fromisoformat(key):
+                    self._val_from_sql(value_type, value)
+                for key, value in rows
+            }
+        key_type = self._fields.get(group_by, int)
+        return {self._val_from_sql(key_type, key): self._val_from_sql(value_type, value)
+                for key, value in rows}
+
+    def _bucket_sql(self, bucket: TimeBucket) -> str:
+        """ Выражение SQL для даты начала периода в формате YYYY-MM-DD """
+        if self._epoch_datetimes:
+            value = f"{bucket.field} / 1000000, 'unixepoch'"
+        else:
+            value = bucket.field
+        modifiers = {
+            "day": "",
+            "week": ", 'weekday 0', '-6 days'",
+            "month": ", 'start of month'",
+        }[bucket.period]
+        return f"date({value}{modifiers})"
+
+    def _check_fields(self, names: Iterable[str]) -> None:
+        for name in names:
+            if name != "pk" and name not in self._fields:
+                raise ValueError(f"{self._table_name} has no field {name!r}")
+
+    def _select(self, columns: str,
+                where: dict[str, Any] | None,
+                order_by: OrderBy = None,
+                limit: int | None = None,
+                offset: int = 0,
+                row_factory: Any = None,
+                keyset: Keyset | None = None) -> sqlite3.Cursor:
+        if where:
+            self._check_fields(where)
+        self._check_fields(name for name, _ in order_fields(order_by))
+        text, params = to_sql(where, self._val_to_sql, order_by, limit, offset, keyset)
+        cur = self._db.connection.cursor()
+        cur.row_factory = row_factory
+        return cur.execute(f"SELECT {columns} FROM {self._table_name}{text}", params)
 
     def update(self, obj: T) -> None:
         """Обновить данные об объекте. Объект должен содержать поле pk."""
         if getattr(obj, "pk", None) is None:
             raise ValueError("Object does not exist")
 
-        names = ", ".join(self._fields)
-        placeholders = ", ".join("?" * len(self._fields))
+        values = self._encode(obj)
 
-        values = [self._val_to_sql(getattr(obj, key)) for key in self._fields]
-
-        with sqlite3.connect(self._base_name) as con:
-            cur = con.cursor()
-            cur.execute("PRAGMA foreign_keys = ON")
-            cur.execute(
-                f"UPDATE {self._table_name} "
-                + f"SET ({names}) = ({placeholders}) WHERE pk={obj.pk}",
-                values,
-            )
-            if con.total_changes == 0:
+        with self._db.transaction() as con:
+            old = self.get(obj.pk) if self._subscribers else None
+            cur = con.execute(self._sql.update, (*values, obj.pk))
+            if cur.rowcount == 0:
                 raise ValueError(f"Object with pk = {obj.pk} does not exist")
-
-        con.close()
+            self._publish([ChangeEvent("updated", old, obj)])
 
     def delete(self, pk: int) -> None:
         """Удалить запись"""
-        with sqlite3.connect(self._base_name) as con:
-            cur = con.cursor()
-            cur.execute("PRAGMA foreign_keys = ON")
-            cur.execute(f"DELETE FROM {self._table_name} WHERE pk = {pk}")
-            if con.total_changes == 0:
+        with self._db.transaction() as con:
+            old = self.get(pk) if self._subscribers else None
+            cur = con.execute(self._sql.delete, (pk,))
+            if cur.rowcount == 0:
                 raise KeyError(f"Object with pk = {pk} does not exist")
-        con.close()
+            self._publish([ChangeEvent("deleted", old, None)])
+
+    def add_many(self, objs: Iterable[T]) -> list[int]:
+        """
+        Добавить несколько объектов одной транзакцией. Первичные ключи
+        назначает SQLite, как и в add; если добавление откатывается (в том
+        числе вместе с внешней транзакцией), атрибут pk снова нулевой.
+        """
+        objs = list(objs)
+        for obj in objs:
+            if getattr(obj, "pk", None) != 0:
+                raise ValueError("Trying to add object with filled 'pk' attribute")
+        if not objs:
+            return []
+
+        with self._db.transaction() as con:
+            self._db.on_rollback(partial(reset_pks, objs))
+            # подготовленный запрос берется из кеша соединения, так что
+            # цикл не медленнее executemany, а pk каждой записи известен
+            for obj in objs:
+                cur = con.execute(self._sql.insert, self._encode(obj))
+                obj.pk = cast(int, cur.lastrowid)
+            self._publish([ChangeEvent("added", None, obj) for obj in objs])
+        return [obj.pk for obj in objs]
+
+    def insert_many(self, objs: Iterable[T]) -> None:
+        """
+        Добавить объекты с уже назначенными pk одной транзакцией, например
+        при переносе записей из другой таблицы. Если запись с таким pk
+        уже есть, вызывается sqlite3.IntegrityError.
+        """
+        objs = list(objs)
+        for obj in objs:
+            if not getattr(obj, "pk", None):
+                raise ValueError("Trying to insert object without 'pk' attribute")
+        if not objs:
+            return
+        with self._db.transaction() as con:
+            con.executemany(self._sql.insert_with_pk,
+                            ((obj.pk, *self._encode(obj)) for obj in objs))
+            self._publish([ChangeEvent("added", None, obj) for obj in objs])
+
+    def update_many(self, objs: Iterable[T]) -> None:
+        """ Обновить данные о нескольких объектах одной транзакцией """
+        objs = list(objs)
+        if not objs:
+            return
+        with self._db.transaction() as con:
+            old = self._old_objects(obj.pk for obj in objs)
+            cur = con.executemany(
+                self._sql.update, ((*self._encode(obj), obj.pk) for obj in objs))
+            if cur.rowcount != len(objs):
+                raise ValueError("Some of the objects do not exist")
+            self._publish([ChangeEvent("updated", old.get(obj.pk), obj) for obj in objs])
+
+    def delete_many(self, pks: Iterable[int]) -> None:
+        """ Удалить несколько записей одной транзакцией """
+        pks = list(pks)
+        if not pks:
+            return
+        with self._db.transaction() as con:
+            old = self._old_objects(pks)
+            cur = con.executemany(self._sql.delete, ((pk,) for pk in pks))
+            if cur.rowcount != len(pks):
+                raise KeyError("Some of the objects do not exist")
+            self._publish([ChangeEvent("deleted", old.get(pk), None) for pk in pks])
+
+    def _old_objects(self, pks: Iterable[int]) -> dict[int, T]:
+        """ Прежние объекты для событий, если есть подписчики """
+        if not self._subscribers:
+            return {}
+        return {obj.pk: obj for obj in self.get_all({"pk": In(list(pks))})}
+
+    def _publish(self, events: list[ChangeEvent[T]]) -> None:
+        """ Передать события подписчикам после фиксации транзакции """
+        if self._subscribers:
+            self._db.on_commit(partial(self._notify, events))
@@ -5,7 +5,7 @@
 import sys
 import datetime
 from PySide6 import QtWidgets, QtCore
-from typing import Callable
+from typing import Callable, Iterable
 from bookkeeper.models.category import Category
 from bookkeeper.models.expense import Expense
 from bookkeeper.models.budget import Budget
@@ -496,7 +496,7 @@ class MainWindow(QtWidgets.QWidget):
 
     def set_expense_list(
         self,
-        expenses: list[Expense],
+        expenses: Iterable[Expense],
         categories: dict[int, str],
     ) -> None:
         row = 0
@@ -0,0 +1,97 @@
+from datetime import date, datetime
+
+import pytest
+
+from bookkeeper import analytics
+from bookkeeper.analytics import (
+    category_totals, load_columns, month_over_month, period_totals, rolling_totals
+)
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.query import Ge
+from bookkeeper.repository.sqlite_repository import SQliteRepository
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(analytics, "HAS_NUMPY", False)
+    elif not analytics.HAS_NUMPY:
+        pytest.skip("numpy is not installed")
+
+
+@pytest.fixture
+def repo():
+    repo = MemoryRepository()
+    repo.add_many([
+        Expense(100, 1, datetime(2023, 1, 30, 10)),
+        Expense(50, 2, datetime(2023, 1, 30, 18)),
+        Expense(20, 1, datetime(2023, 2, 1)),  # среда
+        Expense(5, 3, datetime(2023, 2, 6)),  # понедельник
+        Expense(1, 1, datetime(2023, 4, 2)),
+    ])
+    return repo
+
+
+def test_load_columns(backend, repo):
+    columns = load_columns(repo, {"amount": Ge(20)})
+    assert list(columns.amount) == [100, 50, 20]
+    assert list(columns.category) == [1, 2, 1]
+    assert list(columns.day) == [date(2023, 1, 30).toordinal()] * 2 + [
+        date(2023, 2, 1).toordinal()]
+
+
+@pytest.mark.parametrize("storage", ["text", "epoch"])
+def test_load_columns_from_sqlite(backend, repo, tmp_path, storage):
+    dates = [datetime(1969, 12, 31, 23, 59), datetime(1970, 1, 1),
+             datetime(2023, 2, 28, 23, 59, 59), datetime(1, 1, 1, 12)]
+    repo.add_many([Expense(7, 4, moment) for moment in dates])
+    sqlite = SQliteRepository(tmp_path / "test.db", Expense, storage)
+    sqlite.add_many([Expense(obj.amount, obj.category, obj.expense_date)
+                     for obj in repo.get_all()])
+    for where in [None, {"amount": Ge(20)}, {"category": 4}]:
+        expected = load_columns(repo, where, batch_size=2)
+        columns = load_columns(sqlite, where, batch_size=2)
+        for got, wanted in zip(columns, expected):
+            assert list(got) == list(wanted)
+    assert list(load_columns(sqlite, {"category": 4}).day) == [
+        moment.toordinal() for moment in sorted(dates)]
+    sqlite.close()
+
+
+def test_period_totals(backend, repo):
+    columns = load_columns(repo)
+    daily = period_totals(columns, "day", end=date(2023, 2, 2))
+    assert daily.starts == [date(2023, 1, 30), date(2023, 1, 31),
+                            date(2023, 2, 1), date(2023, 2, 2)]
+    assert list(daily.totals) == [150, 0, 20, 0]
+    weekly = period_totals(columns, "week", start=date(2023, 2, 1), end=date(2023, 2, 28))
+    assert weekly.starts == [date(2023, 1, 30), date(2023, 2, 6), date(2023, 2, 13),
+                             date(2023, 2, 20), date(2023, 2, 27)]
+    assert list(weekly.totals) == [20, 5, 0, 0, 0]
+    monthly = period_totals(columns, "month")
+    assert monthly.starts == [date(2023, 1, 1), date(2023, 2, 1), date(2023, 3, 1),
+                              date(2023, 4, 1)]
+    assert list(monthly.totals) == [150, 25, 0, 1]
+    empty = period_totals(load_columns(MemoryRepository()), "month")
+    assert empty.starts == [] and len(empty.totals) == 0
+
+
+def test_category_totals(backend, repo):
+    assert list(category_totals(load_columns(repo))) == [0, 121, 50, 5]
+
+
+def test_rolling_totals(backend, repo):
+    daily = period_totals(load_columns(repo), "day")
+    weekly = rolling_totals(daily, 7)
+    assert weekly.starts == daily.starts
+    assert list(weekly.totals[:9]) == [150, 150, 170, 170, 170, 170, 170, 25, 25]
+    assert weekly.totals[-1] == 1
+    with pytest.raises(ValueError):
+        rolling_totals(daily, 0)
+
+
+def test_month_over_month(backend, repo):
+    result = month_over_month(load_columns(repo))
+    assert list(result.totals) == [150, 25, 0, 1]
+    assert list(result.deltas) == [150, -125, -25, 1]
@@ -0,0 +1,73 @@
+import argparse
+import json
+import sys
+import types
+
+from bookkeeper import benchmark
+from bookkeeper.models.category import Category
+from bookkeeper.repository.memory_repository import MemoryRepository
+
+import pytest
+
+
+def test_parse_size():
+    assert benchmark.parse_size("1k") == 1000
+    assert benchmark.parse_size("1M") == 1000000
+    assert benchmark.parse_size("250") == 250
+    with pytest.raises(argparse.ArgumentTypeError):
+        benchmark.parse_size("abc")
+
+
+def test_generate():
+    data = benchmark.generate(500, seed=1)
+    assert data == benchmark.generate(500, seed=1)
+    assert len(data.expenses) == 500
+    assert len(data.categories) == 10
+    repo = MemoryRepository()
+    cats = Category.create_from_tree(data.categories, repo)
+    assert all(len(list(cat.get_all_parents(repo))) <= 4 for cat in cats)
+    assert all(1 <= exp.category <= 10 for exp in data.expenses)
+    dates = [exp.expense_date for exp in data.expenses]
+    assert dates == sorted(dates)
+
+
+@pytest.mark.parametrize("backend", list(benchmark.BACKENDS))
+def test_run_backend(tmp_path, backend):
+    results = benchmark.run_backend(backend, benchmark.generate(50), calls=10,
+                                    repeat=2, directory=tmp_path)
+    timings = {timing.operation: timing for timing in results}
+    assert {"load", "get", "get_all", "get_all_where_category", "update", "add",
+            "delete", "category.get_subcategories",
+            "category.get_all_parents"} <= set(timings)
+    assert timings["get"].calls == 10
+    assert timings["get_all"].calls == 2
+    for timing in results:
+        assert (timing.backend, timing.size) == (backend, 50)
+        assert 0 <= timing.min <= timing.median <= timing.p95 <= timing.max
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_presenter(monkeypatch):
+    view = types.ModuleType("bookkeeper.view.app_window")
+    view.MainWindow = object
+    monkeypatch.setitem(sys.modules, "bookkeeper.view.app_window", view)
+    monkeypatch.delitem(sys.modules, "bookkeeper.presenter", raising=False)
+    try:
+        results = benchmark.run_backend("memory", benchmark.generate(50), calls=5)
+    finally:
+        sys.modules.pop("bookkeeper.presenter", None)
+    # презентер подписывается на репозиторий расходов, поэтому замеряется последним
+    assert results[-1].operation == "presenter.set_summ"
+
+
+def test_main(tmp_path, capsys):
+    output = tmp_path / "run.json"
+    args = ["--backend", "memory", "--size", "100", "--calls", "5", "--output"]
+    assert benchmark.main([*args, str(output)]) == 0
+    report = json.loads(output.read_text())
+    assert report["environment"]["python"]
+    assert {r["operation"] for r in report["results"]} >= {"get", "add", "delete"}
+
+    assert benchmark.main([*args, str(tmp_path / "next.json"),
+                           "--baseline", str(output)]) == 0
+    assert "get" in capsys.readouterr().err
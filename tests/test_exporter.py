@@ -0,0 +1,94 @@
+import io
+import json
+import sqlite3
+from datetime import date, datetime
+
+import pytest
+
+from bookkeeper.exporter import ExpenseExporter, main
+from bookkeeper.models.category import Category
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.sqlite_repository import SQliteDatabase, SQliteRepository
+
+
+def fill(expense_repo, category_repo):
+    food = Category("Продукты")
+    category_repo.add(food)
+    meat = Category("Мясо", food.pk)
+    books = Category("Книги")
+    category_repo.add_many([meat, books])
+    expense_repo.add_many([
+        Expense(100, food.pk, datetime(2023, 3, 1, 10), datetime(2023, 3, 1, 11), "хлеб"),
+        Expense(500, meat.pk, datetime(2023, 3, 2, 23, 59), datetime(2023, 3, 3), ""),
+        Expense(300, books.pk, datetime(2023, 3, 3), datetime(2023, 3, 3), "роман"),
+        Expense(50, 0, datetime(2023, 3, 4), datetime(2023, 3, 4), "без категории"),
+    ])
+    return food, meat, books
+
+
+def test_export_csv():
+    expense_repo, category_repo = MemoryRepository(), MemoryRepository()
+    fill(expense_repo, category_repo)
+    out = io.StringIO()
+    count = ExpenseExporter(expense_repo, category_repo, category_path=True).run(out)
+    assert count == 4
+    assert out.getvalue().splitlines() == [
+        "pk,expense_date,amount,category,category_path,comment,added_date",
+        "1,2023-03-01 10:00:00,100,Продукты,Продукты,хлеб,2023-03-01 11:00:00",
+        "2,2023-03-02 23:59:00,500,Мясо,Продукты / Мясо,,2023-03-03 00:00:00",
+        "3,2023-03-03 00:00:00,300,Книги,Книги,роман,2023-03-03 00:00:00",
+        "4,2023-03-04 00:00:00,50,,,без категории,2023-03-04 00:00:00",
+    ]
+
+
+def test_export_filters():
+    expense_repo, category_repo = MemoryRepository(), MemoryRepository()
+    food, meat, _ = fill(expense_repo, category_repo)
+    exporter = ExpenseExporter(expense_repo, category_repo)
+    out = io.StringIO()
+    exporter.run(out, "jsonl", exporter.where(date(2023, 3, 2), date(2023, 3, 3)))
+    assert [json.loads(line)["pk"] for line in out.getvalue().splitlines()] == [2, 3]
+    assert [row[0] for row in exporter.rows(
+        exporter.where(categories=[food.pk]))] == [1, 2]
+    assert [row[0] for row in exporter.rows(
+        exporter.where(categories=[food.pk], subcategories=False))] == [1]
+    assert [row[0] for row in exporter.rows(exporter.where(end=date(2023, 3, 1)))] == [1]
+    assert [row[0] for row in exporter.rows(
+        exporter.where(start=date(2023, 3, 3), categories=[meat.pk]))] == []
+    with pytest.raises(ValueError):
+        exporter.where(date(2023, 3, 2), date(2023, 3, 1))
+    with pytest.raises(ValueError):
+        exporter.run(out, "xml")
+
+
+def test_export_command(tmp_path, capsys):
+    db_path = tmp_path / "db.sqlite"
+    with SQliteDatabase(db_path) as db:
+        fill(SQliteRepository(db, Expense, datetime_storage="epoch"),
+             SQliteRepository(db, Category))
+    output = tmp_path / "expenses.jsonl"
+    assert main([str(db_path), str(output), "--start", "2023-03-02",
+                 "--category-path"]) == 0
+    rows = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert rows[0] == {"pk": 2, "expense_date": "2023-03-02 23:59:00", "amount": 500,
+                       "category": "Мясо", "category_path": "Продукты / Мясо",
+                       "comment": "", "added_date": "2023-03-03 00:00:00"}
+    assert len(rows) == 3
+    assert "3 expenses exported" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("storage", ["text", "epoch"])
+def test_export_command_does_not_change_database(tmp_path, storage):
+    db_path = tmp_path / "db.sqlite"
+    with SQliteDatabase(db_path) as db:
+        fill(SQliteRepository(db, Expense, datetime_storage=storage),
+             SQliteRepository(db, Category))
+    before = db_path.read_bytes()
+    output = tmp_path / "expenses.csv"
+    assert main([str(db_path), str(output)]) == 0
+    assert len(output.read_text(encoding="utf-8").splitlines()) == 5
+    other = "epoch" if storage == "text" else "text"
+    with pytest.raises(sqlite3.OperationalError):
+        main([str(db_path), str(output), "--datetime-storage", other])
+    assert db_path.read_bytes() == before
@@ -0,0 +1,89 @@
+import io
+from datetime import datetime
+
+import pytest
+
+from bookkeeper.importer import CsvFormat, ExpenseImporter, parse_amount
+from bookkeeper.models.category import Category
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.sqlite_repository import SQliteDatabase, SQliteRepository
+
+STATEMENT = """\
+Дата;Сумма;Категория;Описание
+01.03.2023;-1 250,50;Продукты;Магазин
+01.03.2023;-300;Транспорт;Такси
+02.03.2023;5000;Продукты;Возврат
+03.03.2023;-99,4;Кафе;Кофе
+"""
+
+BANK_FORMAT = CsvFormat(amount="Сумма", category="Категория", expense_date="Дата",
+                        comment="Описание", date_format="%d.%m.%Y", delimiter=";",
+                        debit_negative=True)
+
+
+@pytest.fixture
+def category_repo():
+    repo = MemoryRepository(indexes=["name"])
+    repo.add_many([Category("Продукты"), Category("Транспорт")])
+    return repo
+
+
+def test_parse_amount():
+    assert parse_amount("1 250,50") == 1251
+    assert parse_amount("\xa0-300.4 ") == -300
+    with pytest.raises(ValueError):
+        parse_amount("abc")
+    with pytest.raises(ValueError):
+        parse_amount("nan")
+
+
+def test_import(category_repo):
+    expense_repo = MemoryRepository()
+    importer = ExpenseImporter(expense_repo, category_repo, BANK_FORMAT,
+                               create_categories=True)
+    reports = []
+    result = importer.run(io.StringIO(STATEMENT), batch_size=2, skip_invalid=True,
+                          progress=reports.append)
+    assert (result.rows, result.imported, result.skipped) == (4, 3, 1)
+    assert [(r.rows, r.imported) for r in reports] == [(2, 2), (4, 3)]
+    cafe = category_repo.get_all({"name": "Кафе"})[0]
+    assert [(e.amount, e.category, e.expense_date, e.comment)
+            for e in expense_repo.get_all()] == [
+        (1251, 1, datetime(2023, 3, 1), "Магазин"),
+        (300, 2, datetime(2023, 3, 1), "Такси"),
+        (99, cafe.pk, datetime(2023, 3, 3), "Кофе"),
+    ]
+
+
+def test_invalid_row_stops_import(category_repo):
+    expense_repo = MemoryRepository()
+    importer = ExpenseImporter(expense_repo, category_repo, BANK_FORMAT)
+    with pytest.raises(ValueError, match="line 4"):
+        importer.run(io.StringIO(STATEMENT), batch_size=1)
+    assert len(expense_repo.get_all()) == 2
+    with pytest.raises(ValueError, match="line 2: unknown category 'Кафе'"):
+        importer.run(io.StringIO("Дата;Сумма;Категория;Описание\n01.03.2023;-1;Кафе;\n"))
+
+
+def test_missing_columns(category_repo):
+    importer = ExpenseImporter(MemoryRepository(), category_repo)
+    with pytest.raises(ValueError, match="amount"):
+        importer.run(io.StringIO("a,b\n1,2\n"))
+
+
+def test_import_file_into_sqlite(tmp_path):
+    path = tmp_path / "statement.csv"
+    lines = ["amount,category,expense_date,comment"]
+    lines += [f"{i},Продукты,2023-03-{1 + i % 28:02},#{i}" for i in range(2500)]
+    path.write_text("\n".join(lines), encoding="utf-8")
+    with SQliteDatabase(tmp_path / "db.sqlite") as db:
+        category_repo = SQliteRepository(db, Category)
+        expense_repo = SQliteRepository(db, Expense)
+        category_repo.add(Category("Продукты"))
+        batches = []
+        expense_repo.subscribe(batches.append)
+        result = ExpenseImporter(expense_repo, category_repo).run(path, batch_size=1000)
+        assert result.imported == 2500
+        assert [len(batch) for batch in batches] == [1000, 1000, 500]
+        assert expense_repo.aggregate("sum", "amount") == sum(range(2500))
@@ -107,3 +107,10 @@ def test_create_from_tree_error(repo):
     tree = [("1", "parent"), ("parent", None)]
     with pytest.raises(KeyError):
         Category.create_from_tree(tree, repo)
+
+
+def test_create_from_tree_repeated_name(repo):
+    tree = [("parent", None), ("1", "parent"), ("other", None), ("1", "other")]
+    with pytest.raises(ValueError):
+        Category.create_from_tree(tree, repo)
+    assert repo.get_all() == []
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import pytest
+
+from bookkeeper.repository.async_repository import AsyncRepository, AsyncSQliteRepository
+from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.query import Ge
+from bookkeeper.repository.sqlite_repository import SQliteDatabase
+
+
+@dataclass
+class Custom:
+    name: str = ""
+    value: int = 0
+    pk: int = 0
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_repo(request, tmp_path):
+    async def make():
+        if request.param == "memory":
+            return AsyncRepository(MemoryRepository())
+        return await AsyncSQliteRepository.create(tmp_path / "test_data.db", Custom)
+    return make
+
+
+async def collect(aiter):
+    return [obj async for obj in aiter]
+
+
+def test_crud(make_repo):
+    async def scenario():
+        repo = await make_repo()
+        obj = Custom("a", 1)
+        pk = await repo.add(obj)
+        assert obj.pk == pk
+        assert await repo.get(pk) == obj
+        await repo.update(Custom("b", 2, pk))
+        assert await repo.get(pk) == Custom("b", 2, pk)
+        await repo.delete(pk)
+        assert await repo.get(pk) is None
+        if isinstance(repo, AsyncSQliteRepository):
+            await repo.close()
+
+    asyncio.run(scenario())
+
+
+def test_bulk_and_queries(make_repo):
+    async def scenario():
+        repo = await make_repo()
+        pks = await repo.add_many(Custom(str(i), i) for i in range(10))
+        assert len(pks) == 10
+        assert await repo.get_all({"value": Ge(8)}) == [Custom("8", 8, pks[8]),
+                                                        Custom("9", 9, pks[9])]
+        assert await repo.get_values(["value"], {"name": "3"}) == [(3,)]
+        assert await repo.aggregate("sum", "value") == 45
+        found = await collect(repo.iter_all(batch_size=3, order_by="-value"))
+        assert [obj.value for obj in found] == list(range(9, -1, -1))
+        await repo.update_many([Custom("x", 0, pk) for pk in pks[:5]])
+        await repo.delete_many(pks[5:])
+        assert [obj.name for obj in await repo.get_all()] == ["x"] * 5
+        if isinstance(repo, AsyncSQliteRepository):
+            await repo.close()
+
+    asyncio.run(scenario())
+
+
+def test_iter_all_stops_early(make_repo):
+    async def scenario():
+        repo = await make_repo()
+        await repo.add_many(Custom(str(i), i) for i in range(10))
+        async for obj in repo.iter_all(batch_size=2):
+            assert obj.value == 0
+            break
+        assert len(await repo.get_all()) == 10
+        if isinstance(repo, AsyncSQliteRepository):
+            await repo.close()
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_runs_off_loop_thread(tmp_path):
+    async def scenario():
+        repo = await AsyncSQliteRepository.create(tmp_path / "test_data.db", Custom)
+        # схема проверена в исполнителе: в потоке цикла соединение не открыто
+        assert getattr(repo.sqlite._db._local, "con", None) is None
+        threads = await asyncio.gather(*(repo.run(threading.get_ident)
+                                         for _ in range(5)))
+        assert len(set(threads)) == 1
+        assert threads[0] != threading.get_ident()
+        pks = await asyncio.gather(*(repo.add(Custom(str(i))) for i in range(20)))
+        assert sorted(pks) == list(range(1, 21))
+        await repo.close()
+
+    asyncio.run(scenario())
+
+
+def test_shared_executor_transaction(tmp_path):
+    async def scenario():
+        with SQliteDatabase(tmp_path / "test_data.db") as db, \
+                ThreadPoolExecutor(max_workers=1) as executor:
+            first = await AsyncSQliteRepository.create(db, Custom, executor)
+            second = await AsyncSQliteRepository.create(db, Custom, executor)
+
+            def add_both():
+                with db.transaction():
+                    first.inner.add(Custom("a"))
+                    second.inner.add(Custom("b"))
+                    raise RuntimeError
+
+            with pytest.raises(RuntimeError):
+                await first.run(add_both)
+            assert await second.get_all() == []
+
+    asyncio.run(scenario())
@@ -0,0 +1,123 @@
+from dataclasses import dataclass
+
+import pytest
+
+from bookkeeper.repository.cached_repository import CachedRepository
+from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.query import Ge
+from bookkeeper.repository.sqlite_repository import SQliteRepository
+
+
+@dataclass
+class Custom:
+    name: str = ""
+    value: int = 0
+    pk: int = 0
+
+
+@pytest.fixture
+def inner(tmp_path):
+    return SQliteRepository(tmp_path / "test_data.db", Custom)
+
+
+@pytest.fixture
+def repo(inner):
+    return CachedRepository(inner, max_objects=3, max_queries=2)
+
+
+def test_crud(repo):
+    obj = Custom("a")
+    pk = repo.add(obj)
+    assert obj.pk == pk
+    assert repo.get(pk) == obj
+    obj2 = Custom("b", pk=pk)
+    repo.update(obj2)
+    assert repo.get(pk) == obj2
+    repo.delete(pk)
+    assert repo.get(pk) is None
+
+
+def test_get_is_cached(repo, inner):
+    pk = inner.add(Custom("a"))
+    first = repo.get(pk)
+    assert repo.get(pk) is first
+    assert (repo.object_stats.hits, repo.object_stats.misses) == (1, 1)
+
+
+def test_lru_eviction(repo, inner):
+    pks = inner.add_many([Custom(str(i)) for i in range(4)])
+    for pk in pks:
+        repo.get(pk)
+    assert repo.object_stats.evictions == 1
+    repo.get(pks[0])
+    assert repo.object_stats.misses == 5
+    repo.get(pks[3])
+    assert repo.object_stats.hits == 1
+
+
+def test_get_all_is_cached(repo, inner):
+    inner.add_many([Custom("a", 1), Custom("b", 2)])
+    assert repo.get_all({"name": "a"}) == [Custom("a", 1, 1)]
+    assert repo.get_all({"name": "a"}) == [Custom("a", 1, 1)]
+    assert (repo.query_stats.hits, repo.query_stats.misses) == (1, 1)
+    repo.get_all({"name": "b"})
+    repo.get_all({"value": Ge(1)})
+    assert repo.query_stats.evictions == 1
+
+
+def test_writes_invalidate_affected_queries(repo):
+    a, b = Custom("a", 1), Custom("b", 2)
+    repo.add_many([a, b])
+    assert repo.get_all({"name": "a"}) == [a]
+    assert repo.get_all({"name": "b"}) == [b]
+
+    c = Custom("a", 3)
+    repo.add(c)
+    assert repo.get_all({"name": "b"}) == [b]
+    assert repo.query_stats.hits == 1
+    assert repo.get_all({"name": "a"}) == [a, c]
+
+    repo.update(Custom("b", 1, a.pk))
+    assert repo.get_all({"name": "a"}) == [c]
+    assert repo.get_all({"name": "b"}) == [Custom("b", 1, a.pk), b]
+
+    repo.delete_many([b.pk])
+    assert repo.get_all({"name": "b"}) == [Custom("b", 1, a.pk)]
+
+
+def test_in_place_update_is_visible(repo):
+    obj = Custom("a")
+    repo.add(obj)
+    cached = repo.get_all({"name": "a"})[0]
+    cached.name = "b"
+    repo.update(cached)
+    assert repo.get_all({"name": "a"}) == []
+    assert repo.get_all({"name": "b"}) == [cached]
+
+
+def test_pass_through(repo):
+    repo.add_many([Custom("a", 1), Custom("b", 2)])
+    assert repo.aggregate("sum", "value") == 3
+    assert repo.get_values(["name"], order_by="-value") == [("b",), ("a",)]
+    assert list(repo.iter_all({"value": 2})) == [Custom("b", 2, 2)]
+
+
+def test_wraps_memory_repository():
+    repo = CachedRepository(MemoryRepository())
+    obj = Custom("a")
+    repo.add(obj)
+    assert repo.get_all() == [obj]
+    repo.delete(obj.pk)
+    assert repo.get_all() == []
+
+
+def test_rollback_clears_cache(repo):
+    obj = Custom("a")
+    repo.add(obj)
+    with pytest.raises(RuntimeError):
+        with repo.transaction():
+            repo.update(Custom("b", pk=obj.pk))
+            assert repo.get_all({"name": "b"}) == [Custom("b", pk=obj.pk)]
+            raise RuntimeError
+    assert repo.get_all({"name": "b"}) == []
+    assert repo.get(obj.pk) == obj
@@ -0,0 +1,109 @@
+from datetime import datetime
+
+import pytest
+
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository import columnar_repository
+from bookkeeper.repository.columnar_repository import ExpenseColumnRepository
+from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.query import Between, Ge, In, Like, Lt, Ne
+
+
+@pytest.fixture(params=["numpy", "python"])
+def repo(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(columnar_repository, "HAS_NUMPY", False)
+    elif not columnar_repository.HAS_NUMPY:
+        pytest.skip("numpy is not installed")
+    return ExpenseColumnRepository()
+
+
+def make_expenses(n):
+    return [Expense(i * 10, i % 3, datetime(2023, 1, 1 + i % 28, i % 24),
+                    datetime(2023, 2, 1), comment="abc"[i % 3] * (i % 2 + 1))
+            for i in range(n)]
+
+
+def test_crud(repo):
+    obj = Expense(100, 1, datetime(2023, 5, 1, 12, 30), comment="обед")
+    pk = repo.add(obj)
+    assert obj.pk == pk
+    assert repo.get(pk) == obj
+    new = Expense(200, 2, datetime(2023, 5, 2), comment="ужин", pk=pk)
+    repo.update(new)
+    assert repo.get(pk) == new
+    repo.delete(pk)
+    assert repo.get(pk) is None
+    assert len(repo) == 0
+    with pytest.raises(KeyError):
+        repo.delete(pk)
+    with pytest.raises(ValueError):
+        repo.update(new)
+
+
+def test_cannot_add_with_pk(repo):
+    with pytest.raises(ValueError):
+        repo.add(Expense(pk=1))
+
+
+def test_invalid_value_is_not_stored(repo):
+    with pytest.raises(TypeError):
+        repo.add(Expense(1.5))
+    assert len(repo) == 0
+
+
+def test_queries_match_memory_repository(repo):
+    expected = MemoryRepository()
+    expected.add_many(make_expenses(50))
+    repo.add_many(make_expenses(50))
+    conditions = [
+        None,
+        {"category": 1},
+        {"amount": Ge(200), "category": In([0, 2])},
+        {"expense_date": Between(datetime(2023, 1, 5), datetime(2023, 1, 10))},
+        {"expense_date": Lt(datetime(2023, 1, 3)), "comment": "aa"},
+        {"comment": Ne("b")},
+        {"comment": "нет такого"},
+        {"comment": Like("a%"), "category": 0},
+        {"pk": In([1, 2, 60])},
+    ]
+    for where in conditions:
+        assert repo.get_all(where) == expected.get_all(where), where
+        assert repo.get_all(where, order_by=["-category", "comment"], limit=7,
+                            offset=2) == expected.get_all(
+            where, order_by=["-category", "comment"], limit=7, offset=2), where
+        assert repo.get_values(["amount", "expense_date"], where) == (
+            expected.get_values(["amount", "expense_date"], where)), where
+        for func in ("sum", "count", "min", "max"):
+            assert repo.aggregate(func, "amount", where) == (
+                expected.aggregate(func, "amount", where)), (func, where)
+    assert repo.aggregate("max", "expense_date") == datetime(2023, 1, 28, 3)
+    assert repo.aggregate("sum", "amount", group_by="category") == (
+        expected.aggregate("sum", "amount", group_by="category"))
+
+
+def test_delete_and_compact(repo):
+    pks = repo.add_many(make_expenses(10))
+    repo.delete_many(pks[:6])
+    assert [obj.pk for obj in repo.get_all()] == pks[6:]
+    assert repo.get(pks[7]).amount == 70
+    new_pk = repo.add(Expense(5))
+    assert new_pk == pks[-1] + 1
+    assert repo.aggregate("sum", "amount") == 60 + 70 + 80 + 90 + 5
+    with pytest.raises(KeyError):
+        repo.delete_many([pks[7], pks[7]])
+
+
+def test_change_events(repo):
+    batches = []
+    repo.subscribe(batches.append)
+    objs = make_expenses(2)
+    repo.add_many(objs)
+    new = Expense(1, 1, objs[0].expense_date, objs[0].added_date, pk=objs[0].pk)
+    repo.update_many([new])
+    repo.delete(objs[1].pk)
+    assert [[(e.kind, e.old, e.new) for e in batch] for batch in batches] == [
+        [("added", None, objs[0]), ("added", None, objs[1])],
+        [("updated", objs[0], new)],
+        [("deleted", objs[1], None)],
+    ]
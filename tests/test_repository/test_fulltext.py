@@ -0,0 +1,37 @@
+from bookkeeper.repository.fulltext import TextTerm, parse_query, tokenize
+
+
+def test_tokenize():
+    assert tokenize("Кофе, молоко и 2 БУЛКИ_к чаю") == [
+        "кофе", "молоко", "и", "2", "булки", "к", "чаю"]
+    assert tokenize(None) == []
+    assert tokenize("") == []
+
+
+def test_parse_query():
+    query = parse_query('кофе "Черный чай" коф* "зеленый ча"* кофе-брейк')
+    assert query.terms == (
+        TextTerm(("кофе",)), TextTerm(("черный", "чай")), TextTerm(("коф",), True),
+        TextTerm(("зеленый", "ча"), True), TextTerm(("кофе", "брейк")))
+    assert query.to_fts5() == (
+        '"кофе" "черный чай" "коф"* "зеленый ча"* "кофе брейк"')
+
+
+def test_empty_query():
+    assert not parse_query("")
+    assert not parse_query('  ""  * -- ')
+
+
+def test_matches():
+    query = parse_query('"черный коф"* молоко')
+    assert query.matches("Черный кофе с молоком и молоко")
+    assert not query.matches("черный чай, кофе, молоко")
+    assert not query.matches("черный кофе")
+    assert not query.matches(None)
+    assert parse_query("кофе-брейк").matches("Кофе брейк в 11")
+
+
+def test_count_in():
+    assert TextTerm(("a", "b")).count_in(["a", "b", "a", "b", "b"]) == 2
+    assert TextTerm(("b",), True).count_in(["bb", "ab", "b"]) == 2
+    assert TextTerm(("a", "b")).count_in(["a"]) == 0
@@ -0,0 +1,105 @@
+import io
+import json
+from dataclasses import dataclass
+
+import pytest
+
+from bookkeeper.repository.instrumentation import (
+    InstrumentedRepository, LatencyHistogram, StatementLog, dump_stats
+)
+from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.sqlite_repository import SQliteDatabase, SQliteRepository
+
+
+@dataclass
+class Item:
+    name: str = ""
+    pk: int = 0
+
+
+def test_histogram():
+    hist = LatencyHistogram()
+    for seconds in [0.0000005, 0.000003, 0.000003, 0.002]:
+        hist.record(seconds)
+    assert hist.count == 4
+    assert hist.counts[0] == 1 and hist.counts[2] == 2 and hist.counts[11] == 1
+    assert hist.quantile(0.5) == 0.000004
+    assert hist.quantile(1) == 0.002
+    assert hist.as_dict()["buckets_us"] == {"1": 1, "4": 2, "2048": 1}
+
+
+def test_instrumented_repository():
+    repo = InstrumentedRepository(MemoryRepository[Item](), "items")
+    repo.add_many([Item("a"), Item("b"), Item("c")])
+    repo.get(1)
+    repo.get(10)
+    assert len(repo.get_all()) == 3
+    assert [obj.pk for obj in repo.iter_all()] == [1, 2, 3]
+    next(repo.iter_all())
+    with pytest.raises(KeyError):
+        repo.delete(10)
+    repo.delete_many([1, 2])
+
+    stats = repo.stats
+    assert (stats["add_many"].calls, stats["add_many"].rows) == (1, 3)
+    assert (stats["get"].calls, stats["get"].rows) == (2, 1)
+    assert stats["get_all"].rows == 3
+    assert (stats["iter_all"].calls, stats["iter_all"].rows) == (2, 4)
+    assert (stats["delete"].calls, stats["delete"].errors) == (1, 1)
+    assert stats["delete_many"].rows == 2
+    assert repo.as_dict()["get"]["latency"]["count"] == 2
+
+    repo.reset()
+    repo.enabled = False
+    repo.get(3)
+    assert list(repo.iter_all()) == [Item("c", 3)]
+    assert repo.stats == {}
+
+
+def test_statement_log(tmp_path):
+    log = StatementLog(slow_threshold=0)
+    with SQliteDatabase(tmp_path / "items.db", log) as db:
+        repo = SQliteRepository(db, Item)
+        log.reset()
+        repo.add_many(Item(str(i)) for i in range(5))
+        assert len(repo.get_all()) == 5
+        assert len(list(repo.iter_all(batch_size=2))) == 5
+        repo.get(1)
+        with pytest.raises(Exception):
+            db.connection.execute("SELECT nothing FROM Item")
+
+    select = "SELECT pk, name FROM Item"
+    assert (log.statements[select].calls, log.statements[select].rows) == (2, 10)
+    assert sum(stats.errors for stats in log.statements.values()) == 1
+    assert any(stats.rows == 5 and sql.startswith("INSERT")
+               for sql, stats in log.statements.items())
+    assert len(log.slow) == sum(stats.calls for stats in log.statements.values())
+    assert log.as_dict()["slow"][0]["sql"]
+
+
+def test_statement_log_limits(tmp_path):
+    log = StatementLog(slow_threshold=10, max_statements=2)
+    with SQliteDatabase(tmp_path / "items.db", log) as db:
+        db.connection
+        log.reset()
+        for i in range(4):
+            db.connection.execute(f"SELECT {i}").fetchall()
+        log.enabled = False
+        db.connection.execute("SELECT 5").fetchall()
+    assert list(log.statements) == ["SELECT 0", "SELECT 1", StatementLog.OTHER]
+    assert log.statements[StatementLog.OTHER].calls == 2
+    assert not log.slow
+
+
+def test_dump_stats(tmp_path):
+    log = StatementLog()
+    with SQliteDatabase(tmp_path / "items.db", log) as db:
+        repo = InstrumentedRepository(SQliteRepository(db, Item), "items")
+        repo.add(Item("a"))
+    stream = io.StringIO()
+    dump_stats(stream, {"items": repo}, log)
+    report = json.loads(stream.getvalue())
+    assert report["repositories"]["items"]["add"]["calls"] == 1
+    assert report["sql"]["statements"]
+    dump_stats(tmp_path / "stats.json", statement_log=log)
+    assert "repositories" not in json.loads((tmp_path / "stats.json").read_text())
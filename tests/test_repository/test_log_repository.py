@@ -0,0 +1,180 @@
+import os
+import threading
+from datetime import datetime
+
+import pytest
+
+from bookkeeper.models.expense import Expense
+from bookkeeper.repository.log_repository import ExpenseLogRepository
+from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.query import Between, Ge, In, Like
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "expenses.log"
+
+
+@pytest.fixture
+def repo(path):
+    with ExpenseLogRepository(path, compact_threshold=None) as repo:
+        yield repo
+
+
+def make_expenses(n):
+    return [Expense(i * 10, i % 3, datetime(2023, 1, 1 + i % 28, i % 24),
+                    datetime(2023, 2, 1), comment=["", "обед", "такси"][i % 3])
+            for i in range(n)]
+
+
+def test_crud(repo):
+    obj = Expense(100, 1, datetime(2023, 5, 1, 12, 30), comment="обед")
+    pk = repo.add(obj)
+    assert obj.pk == pk
+    assert repo.get(pk) == obj
+    new = Expense(200, 2, datetime(2023, 5, 2), comment="ужин", pk=pk)
+    repo.update(new)
+    assert repo.get(pk) == new
+    repo.delete(pk)
+    assert repo.get(pk) is None
+    assert len(repo) == 0
+    with pytest.raises(KeyError):
+        repo.delete(pk)
+    with pytest.raises(ValueError):
+        repo.update(new)
+    with pytest.raises(ValueError):
+        repo.add(Expense(pk=1))
+
+
+def test_reopen(path):
+    with ExpenseLogRepository(path) as repo:
+        objs = make_expenses(3000)
+        repo.add_many(objs)
+        repo.update(Expense(1, 1, objs[5].expense_date, objs[5].added_date,
+                            "новый", pk=objs[5].pk))
+        repo.delete(objs[7].pk)
+    with ExpenseLogRepository(path) as repo:
+        assert len(repo) == 2999
+        assert repo.get(objs[5].pk).comment == "новый"
+        assert repo.get(objs[7].pk) is None
+        assert repo.get(objs[2999].pk) == objs[2999]
+        assert repo.add(Expense()) == 3001
+
+
+@pytest.mark.parametrize("sync", [True, False])
+def test_appends_are_visible_without_close(path, sync):
+    repo = ExpenseLogRepository(path, compact_threshold=None, sync=sync)
+    first = Expense(1, 1, datetime(2023, 5, 1), comment="первый")
+    repo.add(first)
+    assert repo.get(first.pk) == first
+    # комментарий дописан после отображения файла комментариев
+    second = Expense(2, 1, datetime(2023, 5, 2), comment="второй")
+    repo.add(second)
+    assert repo.get(second.pk) == second
+    with ExpenseLogRepository(path, compact_threshold=None) as other:
+        assert other.get_all() == [first, second]
+    repo.close()
+
+
+def test_not_a_log(path):
+    path.write_bytes(b"garbage" * 10)
+    with pytest.raises(ValueError):
+        ExpenseLogRepository(path)
+
+
+def test_queries_match_memory_repository(repo):
+    expected = MemoryRepository()
+    expected.add_many(make_expenses(50))
+    repo.add_many(make_expenses(50))
+    new = Expense(5, 2, datetime(2023, 1, 1), datetime(2023, 2, 1), pk=10)
+    for target in (expected, repo):
+        target.update(new)
+        target.delete_many([3, 4])
+    conditions = [
+        None,
+        {"category": 1},
+        {"amount": Ge(200), "category": In([0, 2])},
+        {"expense_date": Between(datetime(2023, 1, 5), datetime(2023, 1, 10))},
+        {"comment": Like("%д")},
+        {"pk": In([1, 3, 10])},
+    ]
+    for where in conditions:
+        assert repo.get_all(where) == expected.get_all(where), where
+        assert repo.get_all(where, order_by="-amount", limit=5, offset=1) == (
+            expected.get_all(where, order_by="-amount", limit=5, offset=1)), where
+    assert repo.aggregate("sum", "amount") == expected.aggregate("sum", "amount")
+
+
+def test_iteration_survives_compaction(repo):
+    pks = repo.add_many(make_expenses(100))
+    repo.delete_many(pks[:60])
+    records = repo.iter_all(batch_size=10)
+    first = [next(records) for _ in range(15)]
+    repo.compact()
+    rest = list(records)
+    assert [obj.pk for obj in first + rest] == pks[60:]
+
+
+def test_compaction(path):
+    with ExpenseLogRepository(path, compact_threshold=10) as repo:
+        objs = make_expenses(30)
+        repo.add_many(objs)
+        repo.update_many([Expense(1, 1, comment="x", pk=obj.pk) for obj in objs[:5]])
+        repo.delete_many([obj.pk for obj in objs[5:20]])
+        repo.compact_in_background().join()
+        assert repo.get(objs[0].pk).comment == "x"
+        assert [obj.pk for obj in repo.get_all()] == (
+            [obj.pk for obj in objs[:5]] + [obj.pk for obj in objs[20:]])
+        assert repo.add(Expense()) == 31
+    assert sorted(os.listdir(path.parent)) == ["expenses.log", "expenses.log.comments.1"]
+    with ExpenseLogRepository(path) as repo:
+        assert len(repo) == 16
+        assert repo.get(objs[29].pk) == objs[29]
+
+
+def test_changes_during_compaction(path, monkeypatch):
+    with ExpenseLogRepository(path, compact_threshold=None) as repo:
+        objs = make_expenses(30)
+        repo.add_many(objs)
+        repo.delete_many([obj.pk for obj in objs[10:25]])
+        create = ExpenseLogRepository._create
+
+        def change(*args):
+            # изменения из другого потока не ждут окончания копирования
+            create(*args)
+            thread = threading.Thread(target=lambda: (
+                repo.update(Expense(1, 1, comment="новый", pk=objs[0].pk)),
+                repo.delete(objs[1].pk),
+                repo.add(Expense(2, 2, comment="после"))))
+            thread.start()
+            thread.join(5)
+            assert not thread.is_alive()
+
+        monkeypatch.setattr(ExpenseLogRepository, "_create", staticmethod(change))
+        repo.compact()
+        expected = [repo.get(objs[0].pk)] + objs[2:10] + objs[25:]
+        assert expected[0].comment == "новый"
+        assert repo.get_all() == expected + [repo.get(31)]
+    monkeypatch.undo()
+    assert sorted(os.listdir(path.parent)) == ["expenses.log", "expenses.log.comments.1"]
+    with ExpenseLogRepository(path) as repo:
+        assert len(repo) == 15
+        assert repo.get(31).comment == "после"
+        assert repo.get(objs[0].pk).comment == "новый"
+        assert repo.get(objs[1].pk) is None
+        assert repo.get_all(order_by="pk")[1:-1] == objs[2:10] + objs[25:]
+
+
+def test_change_events(repo):
+    batches = []
+    repo.subscribe(batches.append)
+    objs = make_expenses(2)
+    repo.add_many(objs)
+    new = Expense(1, 1, objs[0].expense_date, objs[0].added_date, pk=objs[0].pk)
+    repo.update(new)
+    repo.delete(objs[1].pk)
+    assert [[(e.kind, e.old, e.new) for e in batch] for batch in batches] == [
+        [("added", None, objs[0]), ("added", None, objs[1])],
+        [("updated", objs[0], new)],
+        [("deleted", objs[1], None)],
+    ]
@@ -1,4 +1,13 @@
+import io
+from datetime import date, datetime
+from inspect import isgenerator
+
+from bookkeeper.models.category import Category
+from bookkeeper.models.expense import Expense
 from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.query import (
+    Between, Ge, Gt, In, Le, Like, Lt, Ne, TimeBucket
+)
 
 import pytest
 
@@ -69,3 +78,268 @@ def test_get_all_with_condition(repo, custom_class):
         objects.append(o)
     assert repo.get_all({'name': '0'}) == [objects[0]]
     assert repo.get_all({'test': 'test'}) == objects
+
+
+def test_add_many(repo, custom_class):
+    objects = [custom_class() for i in range(5)]
+    pks = repo.add_many(objects)
+    assert pks == [o.pk for o in objects]
+    assert repo.get_all() == objects
+
+
+def test_cannot_add_many_with_pk(repo, custom_class):
+    objects = [custom_class() for i in range(2)]
+    objects[1].pk = 1
+    with pytest.raises(ValueError):
+        repo.add_many(objects)
+    assert repo.get_all() == []
+
+
+def test_update_many(repo, custom_class):
+    repo.add_many([custom_class() for i in range(3)])
+    new_objects = [custom_class() for i in range(3)]
+    for pk, o in enumerate(new_objects, 1):
+        o.pk = pk
+    repo.update_many(new_objects)
+    assert repo.get_all() == new_objects
+
+
+def test_delete_many(repo, custom_class):
+    objects = [custom_class() for i in range(3)]
+    repo.add_many(objects)
+    repo.delete_many([objects[0].pk, objects[2].pk])
+    assert repo.get_all() == [objects[1]]
+    with pytest.raises(KeyError):
+        repo.delete_many([objects[1].pk, 100])
+    assert repo.get_all() == [objects[1]]
+
+
+def test_iter_all(repo, custom_class):
+    objects = [custom_class() for i in range(5)]
+    for i, o in enumerate(objects):
+        o.name = str(i % 2)
+    repo.add_many(objects)
+    assert isgenerator(repo.iter_all())
+    assert list(repo.iter_all()) == objects
+    assert list(repo.iter_all({'name': '1'})) == [objects[1], objects[3]]
+
+
+def test_get_all_with_predicates(repo, custom_class):
+    objects = []
+    for i in range(5):
+        o = custom_class()
+        o.value = i
+        o.name = 'even' if i % 2 == 0 else 'odd'
+        objects.append(o)
+    repo.add_many(objects)
+    assert repo.get_all({'value': Ge(3)}) == objects[3:]
+    assert repo.get_all({'value': In([1, 4]), 'name': 'odd'}) == [objects[1]]
+    assert repo.get_all({'name': Like('ev%')}, order_by='-value') == objects[4::-2]
+    assert repo.get_all(order_by=['name', '-value'], limit=2, offset=1) == [
+        objects[2], objects[0]]
+    assert repo.get_values(['pk', 'value'], {'value': Lt(2)}) == [(1, 0), (2, 1)]
+
+
+@pytest.fixture
+def indexed_repo():
+    return MemoryRepository(indexes=['name'], sorted_indexes=['value'])
+
+
+def test_indexed_get_all(indexed_repo, custom_class):
+    objects = []
+    for i in range(10):
+        o = custom_class()
+        o.name = str(i % 3)
+        o.value = i if i != 5 else None
+        objects.append(o)
+    indexed_repo.add_many(objects)
+    plain_repo = MemoryRepository()
+    plain_repo._container = dict(indexed_repo._container)
+    conditions = [
+        {'name': '1'}, {'name': In(['0', '2'])}, {'name': 'x'},
+        {'value': 3}, {'value': None}, {'value': Ge(4)}, {'value': Gt(4)},
+        {'value': Lt(3)}, {'value': Le(3)}, {'value': Between(2, 6)},
+        {'value': In([1, 7, 100])}, {'name': '2', 'value': Ge(5)},
+        {'name': '0', 'value': Ne(0)},
+    ]
+    for where in conditions:
+        assert indexed_repo.get_all(where) == plain_repo.get_all(where), where
+
+
+def test_indexes_follow_updates(indexed_repo, custom_class):
+    objects = []
+    for i in range(3):
+        o = custom_class()
+        o.name = 'a'
+        o.value = i
+        objects.append(o)
+    indexed_repo.add_many(objects)
+    objects[1].name = 'b'
+    objects[1].value = 10
+    indexed_repo.update(objects[1])
+    assert indexed_repo.get_all({'name': 'a'}) == [objects[0], objects[2]]
+    assert indexed_repo.get_all({'name': 'b'}) == [objects[1]]
+    assert indexed_repo.get_all({'value': Ge(2)}) == [objects[1], objects[2]]
+    indexed_repo.delete(objects[2].pk)
+    assert indexed_repo.get_all({'name': 'a'}) == [objects[0]]
+    assert indexed_repo.get_all({'value': Ge(2)}) == [objects[1]]
+    indexed_repo.delete_many([objects[0].pk, objects[1].pk])
+    assert indexed_repo.get_all({'name': 'a'}) == []
+    assert indexed_repo.get_all({'value': Ge(0)}) == []
+
+
+def test_aggregate(repo, custom_class):
+    for i in range(5):
+        o = custom_class()
+        o.value = i
+        o.moment = datetime(2023, 1, 30 + i) if i < 2 else datetime(2023, 2, i)
+        repo.add(o)
+    assert repo.aggregate('sum', 'value') == 10
+    assert repo.aggregate('count', where={'value': Ge(3)}) == 2
+    assert repo.aggregate('max', 'moment') == datetime(2023, 2, 4)
+    assert repo.aggregate('sum', 'value', group_by=TimeBucket('moment', 'month')) == {
+        date(2023, 1, 1): 1, date(2023, 2, 1): 9}
+
+
+def test_change_events(repo, custom_class):
+    batches = []
+    unsubscribe = repo.subscribe(batches.append)
+    objects = [custom_class() for _ in range(3)]
+    repo.add(objects[0])
+    repo.add_many(objects[1:])
+    new = custom_class()
+    new.pk = objects[0].pk
+    repo.update(new)
+    repo.delete_many([objects[1].pk, objects[2].pk])
+    assert [[(e.kind, e.old, e.new) for e in batch] for batch in batches] == [
+        [('added', None, objects[0])],
+        [('added', None, objects[1]), ('added', None, objects[2])],
+        [('updated', objects[0], new)],
+        [('deleted', objects[1], None), ('deleted', objects[2], None)],
+    ]
+    assert batches[-1][0].pk == objects[1].pk
+    unsubscribe()
+    repo.delete(new.pk)
+    assert len(batches) == 4
+
+
+@pytest.mark.parametrize('key', ['value', '-value', 'pk', '-pk'])
+def test_page(indexed_repo, custom_class, key):
+    plain_repo = MemoryRepository()
+    for i in range(20):
+        o = custom_class()
+        o.name = 'ab'[i % 2]
+        o.value = None if i % 7 == 0 else i % 5
+        indexed_repo.add(o)
+    plain_repo._container = dict(indexed_repo._container)
+    field = key.lstrip('-')
+    expected = indexed_repo.get_all(order_by=[key, key.replace(field, 'pk')])
+    for repo in (indexed_repo, plain_repo):
+        pages = [repo.page(key, 3)]
+        while pages[-1]:
+            last = pages[-1][-1]
+            pages.append(repo.page(key, 3, after=(getattr(last, field), last.pk)))
+        assert [o for page in pages for o in page] == expected
+        first = pages[-2][0]
+        assert repo.page(key, 3, before=(getattr(first, field), first.pk)) == pages[-3]
+        assert repo.page(key, 100, before=(getattr(first, field), first.pk)) == (
+            expected[:expected.index(first)])
+        assert repo.page(key, 100, where={'name': 'a'}) == [
+            o for o in expected if o.name == 'a']
+
+
+class Record:
+    value: float | None
+    label: str
+    moment: datetime | None
+    pk: int = 0
+
+
+def test_snapshot(tmp_path):
+    repo = MemoryRepository(indexes=['category'], sorted_indexes=['expense_date'])
+    repo.add_many([Expense(i, i % 3, datetime(2023, 1, 1 + i % 5),
+                           datetime(2023, 2, 1, i), comment='abc'[i % 3])
+                   for i in range(20)])
+    repo.delete(3)
+    path = tmp_path / 'expenses.snapshot'
+    repo.dump(path)
+    restored = MemoryRepository.load(path, Expense)
+    assert restored.get_all() == repo.get_all()
+    assert restored.get_all({'category': 1}) == repo.get_all({'category': 1})
+    where = {'expense_date': Ge(datetime(2023, 1, 4))}
+    assert restored.get_all(where) == repo.get_all(where)
+    assert restored.page('expense_date', 5) == repo.page('expense_date', 5)
+    assert restored.add(Expense()) == repo.add(Expense()) == 21
+    with pytest.raises(ValueError):
+        MemoryRepository.load(path, Category)
+    with pytest.raises(ValueError):
+        MemoryRepository.load(io.BytesIO(b'garbage'), Expense)
+
+
+def test_snapshot_values():
+    repo = MemoryRepository()
+    values = [(1.5, 'a\0b', datetime(2023, 1, 1)), (None, '', None), (2, 'в', None)]
+    for value, label, moment in values:
+        record = Record()
+        record.value, record.label, record.moment = value, label, moment
+        repo.add(record)
+    stream = io.BytesIO()
+    repo.dump(stream)
+    stream.seek(0)
+    restored = MemoryRepository.load(stream, Record)
+    assert [(r.value, r.label, r.moment, r.pk) for r in restored.get_all()] == [
+        (1.5, 'a\0b', datetime(2023, 1, 1), 1), (None, '', None, 2), (2.0, 'в', None, 3)]
+
+
+def test_empty_snapshot():
+    stream = io.BytesIO()
+    MemoryRepository().dump(stream)
+    stream.seek(0)
+    restored = MemoryRepository.load(stream, Category)
+    assert restored.get_all() == []
+    assert restored.add(Category('a')) == 1
+
+
+def comment_repo(**kwargs):
+    repo = MemoryRepository(**kwargs)
+    repo.add_many([Expense(i, i % 2, comment=comment) for i, comment in enumerate([
+        'кофе с молоком', 'Черный кофе', 'чай', 'кофейник', 'кофе, кофе и кофе', None])])
+    return repo
+
+
+@pytest.mark.parametrize('text_indexes', [[], ['comment']])
+def test_search(text_indexes):
+    repo = comment_repo(text_indexes=text_indexes)
+    assert {o.pk for o in repo.search('кофе', 'comment')} == {1, 2, 5}
+    assert {o.pk for o in repo.search('коф*', 'comment')} == {1, 2, 4, 5}
+    assert [o.pk for o in repo.search('"черный кофе"', 'comment')] == [2]
+    assert [o.pk for o in repo.search('кофе молоко', 'comment')] == []
+    assert {o.pk for o in repo.search('коф*', 'comment', {'category': 0})} == {1, 5}
+    assert len(repo.search('коф*', 'comment', limit=2)) == 2
+    assert repo.search('', 'comment') == []
+
+
+def test_search_ranking():
+    repo = comment_repo(text_indexes=['comment'])
+    assert [o.pk for o in repo.search('кофе', 'comment')] == [5, 2, 1]
+    assert [o.pk for o in repo.search('кофе', 'comment', limit=1)] == [5]
+
+
+def test_text_index_follows_updates():
+    repo = comment_repo(text_indexes=['comment'])
+    obj = repo.get(3)
+    obj.comment = 'кофе'
+    repo.update(obj)
+    repo.delete(5)
+    repo.delete_many([1])
+    assert {o.pk for o in repo.search('кофе', 'comment')} == {2, 3}
+    assert repo.search('чай', 'comment') == []
+
+
+def test_snapshot_text_index():
+    repo = comment_repo(text_indexes=['comment'])
+    stream = io.BytesIO()
+    repo.dump(stream)
+    stream.seek(0)
+    restored = MemoryRepository.load(stream, Expense)
+    assert restored.search('коф*', 'comment') == repo.search('коф*', 'comment')
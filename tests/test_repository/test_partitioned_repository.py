@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+from bookkeeper.repository.instrumentation import StatementLog
+from bookkeeper.repository.partitioned_repository import PartitionedSQliteRepository
+from bookkeeper.repository.query import Between, Ge, In, Lt
+from bookkeeper.repository.sqlite_repository import SQliteDatabase, SQliteRepository
+import pytest
+
+
+@dataclass
+class Spending:
+    amount: int = 0
+    spent: datetime | None = None
+    comment: str = ""
+    pk: int = 0
+
+
+def spendings():
+    return [Spending(amount, datetime(year, month, 10), f"x{amount % 3}")
+            for amount, (year, month) in enumerate(
+                [(2021, 5), (2023, 1), (2022, 7), (2023, 6), (2021, 12), (2022, 7)])]
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = PartitionedSQliteRepository(tmp_path / "test.db", Spending, "spent")
+    yield repo
+    repo.close()
+
+
+def test_global_pk(repo):
+    objs = spendings()
+    pks = repo.add_many(objs)
+    assert pks == [1, 2, 3, 4, 5, 6]
+    assert repo.partitions == ["2021", "2022", "2023"]
+    for obj in objs:
+        assert repo.get(obj.pk) == obj
+    assert repo.get(100) is None
+    assert repo.add(Spending(10, datetime(2020, 1, 1))) == 7
+
+
+def test_cannot_add_without_date(repo):
+    obj = Spending(1)
+    with pytest.raises(ValueError):
+        repo.add(obj)
+    assert obj.pk == 0
+    assert repo.get_all() == []
+
+
+def test_get_all_matches_plain_repository(tmp_path, repo):
+    plain = SQliteRepository(tmp_path / "plain.db", Spending)
+    plain.add_many(spendings())
+    repo.add_many(spendings())
+    queries = [
+        {},
+        {"where": {"comment": "x1"}},
+        {"where": {"spent": Ge(datetime(2022, 7, 10))}},
+        {"order_by": "-amount"},
+        {"order_by": ("comment", "-spent"), "limit": 3, "offset": 1},
+        {"where": {"spent": Between(datetime(2022, 1, 1), datetime(2023, 3, 1))},
+         "limit": 2},
+    ]
+    for query in queries:
+        assert repo.get_all(**query) == plain.get_all(**query)
+        assert list(repo.iter_all(**query)) == plain.get_all(**query)
+    assert repo.aggregate("sum", "amount") == plain.aggregate("sum", "amount")
+    assert (repo.aggregate("count", where={"comment": "x0"}, group_by="comment")
+            == plain.aggregate("count", where={"comment": "x0"}, group_by="comment"))
+    assert repo.aggregate("max", "amount", {"comment": "none"}) is None
+    plain.close()
+
+
+@pytest.mark.parametrize("where, tables", [
+    ({"spent": datetime(2022, 7, 10)}, {"Spending_2022"}),
+    ({"spent": In((datetime(2021, 5, 10), datetime(2023, 1, 10)))},
+     {"Spending_2021", "Spending_2023"}),
+    ({"spent": Lt(datetime(2022, 1, 1))}, {"Spending_2021"}),
+    ({"spent": Between(datetime(2022, 1, 1), datetime(2023, 3, 1))},
+     {"Spending_2022", "Spending_2023"}),
+    ({"comment": "x0"}, {"Spending_2021", "Spending_2022", "Spending_2023"}),
+])
+def test_reads_only_selected_partitions(tmp_path, where, tables):
+    log = StatementLog()
+    with SQliteDatabase(tmp_path / "test.db", log) as db:
+        repo = PartitionedSQliteRepository(db, Spending, "spent")
+        repo.add_many(spendings())
+        log.reset()
+        repo.get_all(where)
+    read = {word for sql in log.statements for word in sql.split()
+            if word.startswith("Spending_")}
+    assert read == tables
+
+
+def test_update_moves_between_partitions(repo):
+    objs = spendings()
+    repo.add_many(objs)
+    events = []
+    repo.subscribe(events.extend)
+    obj = objs[0]
+    obj.spent = datetime(2024, 2, 1)
+    repo.update(obj)
+    assert repo.get(obj.pk) == obj
+    assert repo.partitions == ["2021", "2022", "2023", "2024"]
+    assert repo.get_all({"spent": Ge(datetime(2024, 1, 1))}) == [obj]
+    assert obj not in repo.get_all({"spent": Lt(datetime(2022, 1, 1))})
+    assert events[0].kind == "updated" and events[0].old.spent == datetime(2021, 5, 10)
+    repo.delete(obj.pk)
+    assert repo.get(obj.pk) is None
+    with pytest.raises(KeyError):
+        repo.delete(obj.pk)
+    with pytest.raises(ValueError):
+        repo.update(obj)
+
+
+def test_rolled_back_partition_is_forgotten(repo):
+    repo.add_many(spendings())
+    rolled_back = Spending(10, datetime(2024, 3, 1))
+    with pytest.raises(RuntimeError):
+        with repo.transaction():
+            repo.add(rolled_back)
+            assert repo.partitions == ["2021", "2022", "2023", "2024"]
+            raise RuntimeError
+    assert repo.partitions == ["2021", "2022", "2023"]
+    assert rolled_back.pk == 0
+    assert len(repo.get_all()) == 6
+    with repo.transaction():
+        with pytest.raises(RuntimeError):
+            with repo.transaction():
+                repo.add(Spending(10, datetime(2025, 3, 1)))
+                raise RuntimeError
+        repo.add(Spending(10, datetime(2020, 3, 1)))
+    assert repo.partitions == ["2020", "2021", "2022", "2023"]
+    obj = Spending(11, datetime(2024, 3, 1))
+    assert repo.add(obj) == 8
+    assert repo.get_all({"spent": Ge(datetime(2024, 1, 1))}) == [obj]
+
+
+def test_reopen_and_month_partitions(tmp_path):
+    repo = PartitionedSQliteRepository(tmp_path / "test.db", Spending, "spent", "month")
+    repo.add_many(spendings())
+    repo.close()
+    repo = PartitionedSQliteRepository(tmp_path / "test.db", Spending, "spent", "month")
+    assert repo.partitions == ["2021_05", "2021_12", "2022_07", "2023_01", "2023_06"]
+    found = repo.get_all({"spent": datetime(2022, 7, 10)})
+    assert [obj.amount for obj in found] == [2, 5]
+    assert repo.add(Spending(7, datetime(2023, 6, 1))) == 7
+    repo.close()
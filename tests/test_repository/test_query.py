@@ -0,0 +1,126 @@
+from dataclasses import dataclass
+from datetime import date, datetime
+
+import pytest
+
+from bookkeeper.repository.query import (
+    Eq, Ne, Lt, Le, Gt, Ge, Between, In, Keyset, Like, TimeBucket,
+    aggregate_objects, apply_query, matches, to_sql
+)
+
+
+@dataclass
+class Item:
+    name: str | None = None
+    value: int | None = None
+    pk: int = 0
+
+
+def test_comparisons():
+    assert Eq(1).match(1) and not Eq(1).match(2)
+    assert Ne(1).match(2) and not Ne(1).match(1)
+    assert Lt(2).match(1) and not Lt(2).match(2)
+    assert Le(2).match(2) and not Le(2).match(3)
+    assert Gt(2).match(3) and not Gt(2).match(2)
+    assert Ge(2).match(2) and not Ge(2).match(1)
+    assert Between(1, 3).match(1) and Between(1, 3).match(3)
+    assert not Between(1, 3).match(4)
+    assert In([1, 2]).match(2) and not In([1, 2]).match(3)
+
+
+def test_none_does_not_match_comparisons():
+    for pred in (Ne(1), Lt(1), Le(1), Gt(1), Ge(1), Between(1, 2), In([None])):
+        assert not pred.match(None)
+    assert Eq(None).match(None)
+    assert Ne(None).match(1) and not Ne(None).match(None)
+
+
+def test_like():
+    assert Like('бан%').match('Бананы')
+    assert Like('a_c').match('abc')
+    assert not Like('a_c').match('abbc')
+    assert Like('%.%').match('1.5')
+    assert not Like('%.%').match('15')
+    assert not Like('%').match(None)
+
+
+def test_predicates_are_hashable():
+    assert hash(In([1, 2])) == hash(In((1, 2)))
+    assert Like('a%') == Like('a%')
+
+
+def test_matches():
+    item = Item('a', 1)
+    assert matches(item, None)
+    assert matches(item, {'name': 'a', 'value': Ge(1)})
+    assert not matches(item, {'name': 'a', 'value': Gt(1)})
+
+
+def test_apply_query():
+    items = [Item('c', 2), Item('a', None), Item('b', 2), Item('d', 1)]
+    assert list(apply_query(items, {'value': Ge(2)})) == [items[0], items[2]]
+    assert list(apply_query(items, order_by='value')) == [
+        items[1], items[3], items[0], items[2]]
+    assert list(apply_query(items, order_by=['-value', 'name'])) == [
+        items[2], items[0], items[3], items[1]]
+    assert list(apply_query(items, order_by='name', limit=2, offset=1)) == [
+        items[2], items[0]]
+    assert list(apply_query(items, offset=3)) == [items[3]]
+
+
+def test_to_sql():
+    text, params = to_sql({'name': 'a', 'value': Between(1, 3)}, str,
+                          order_by=['-value', 'name'], limit=5)
+    assert text == (' WHERE name = ? AND value BETWEEN ? AND ?'
+                    ' ORDER BY value DESC, name LIMIT ?')
+    assert params == ['a', '1', '3', 5]
+    assert to_sql({'name': None, 'value': In([])}, str) == (
+        ' WHERE name IS NULL AND 0', [])
+    assert to_sql(None, str) == ('', [])
+
+
+def test_time_bucket():
+    moment = datetime(2023, 11, 15, 10, 30)  # среда
+    assert TimeBucket('x', 'day').key(moment) == date(2023, 11, 15)
+    assert TimeBucket('x', 'week').key(moment) == date(2023, 11, 13)
+    assert TimeBucket('x', 'week').key(date(2023, 11, 19)) == date(2023, 11, 13)
+    assert TimeBucket('x', 'month').key(moment) == date(2023, 11, 1)
+    assert TimeBucket('x').key(None) is None
+    with pytest.raises(ValueError):
+        TimeBucket('x', 'year')
+
+
+def test_aggregate_objects():
+    items = [Item('a', 1), Item('b', 2), Item('a', None), Item('a', 4)]
+    assert aggregate_objects(items, 'sum', 'value') == 7
+    assert aggregate_objects(items, 'count', 'value') == 3
+    assert aggregate_objects(items, 'count') == 4
+    assert aggregate_objects(items, 'min', 'value') == 1
+    assert aggregate_objects(items, 'max', 'value') == 4
+    assert aggregate_objects([], 'sum', 'value') is None
+    assert aggregate_objects([], 'count', 'value') == 0
+    assert aggregate_objects(items, 'sum', 'value', group_by='name') == {
+        'a': 5, 'b': 2}
+    with pytest.raises(ValueError):
+        aggregate_objects(items, 'avg', 'value')
+
+
+def test_keyset():
+    items = [Item('a', 1, 1), Item('b', 1, 2), Item('c', None, 3), Item('d', 2, 4)]
+    after = Keyset('value', (1, 1))
+    assert after.order_by() == ['value', 'pk']
+    assert [i.name for i in items if after.match(i)] == ['b', 'd']
+    before = Keyset('-value', (1, 2), forward=False)
+    assert before.order_by() == ['value', 'pk']
+    assert [i.name for i in items if before.match(i)] == ['d']
+    after_null = Keyset('value', (None, 3))
+    assert [i.name for i in items if after_null.match(i)] == ['a', 'b', 'd']
+    assert Keyset('-pk', (0, 3)).order_by() == ['-pk']
+    assert Keyset('-pk', (0, 3)).to_sql(str) == ('pk < ?', [3])
+    assert Keyset('value', (1, 1)).to_sql(str) == ('(value, pk) > (?, ?)', ['1', 1])
+    assert Keyset('-value', (1, 1)).to_sql(str) == (
+        '((value, pk) < (?, ?) OR value IS NULL)', ['1', 1])
+    assert before.arrange([1, 2]) == [2, 1]
+    assert Keyset.from_cursors('value', None, (1, 1)) == Keyset('value', (1, 1), False)
+    with pytest.raises(ValueError):
+        Keyset.from_cursors('value', (1, 1), (1, 2))
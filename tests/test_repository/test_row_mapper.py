@@ -0,0 +1,59 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import pytest
+
+from bookkeeper.repository.row_mapper import compile_mapper
+
+
+def fail():
+    raise AssertionError("default factory should not be called")
+
+
+@dataclass
+class Record:
+    amount: int = 0
+    moment: datetime = field(default_factory=fail)
+    comment: str = ""
+    pk: int = 0
+
+
+FIELDS = (("amount", int), ("moment", datetime), ("comment", str))
+
+
+class Plain:
+    pk = 0
+    name = ""
+
+
+@pytest.mark.parametrize("epoch", [False, True])
+def test_roundtrip(epoch):
+    mapper = compile_mapper(Record, FIELDS, epoch)
+    obj = Record(10, datetime(2023, 5, 6, 7, 8, 9), "test", pk=3)
+    row = mapper.encode(obj)
+    assert mapper.decode(None, (3, *row)) == obj
+
+
+def test_encode_datetime():
+    obj = Record(10, datetime(1970, 1, 1, 0, 0, 1, 5), "test")
+    assert compile_mapper(Record, FIELDS, False).encode(obj) == (
+        10, "1970-01-01 00:00:01", "test")
+    assert compile_mapper(Record, FIELDS, True).encode(obj) == (10, 1000005, "test")
+
+
+def test_none_datetime():
+    mapper = compile_mapper(Record, FIELDS, True)
+    assert mapper.decode(None, (1, 0, None, "")).moment is None
+    assert mapper.encode(Record(0, None)) == (0, None, "")
+
+
+def test_plain_class():
+    mapper = compile_mapper(Plain, (("name", str),), False)
+    obj = mapper.decode(None, (2, "test"))
+    assert isinstance(obj, Plain)
+    assert (obj.pk, obj.name) == (2, "test")
+    assert mapper.encode(obj) == ("test",)
+
+
+def test_mapper_is_cached():
+    assert compile_mapper(Record, FIELDS, True) is compile_mapper(Record, FIELDS, True)
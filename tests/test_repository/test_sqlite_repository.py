@@ -1,7 +1,17 @@
-from bookkeeper.repository.sqlite_repository import SQliteRepository
+import sqlite3
+import threading
+from datetime import date, datetime
+from inspect import isgenerator
+
+from bookkeeper.repository.abstract_repository import Index
+from bookkeeper.repository.instrumentation import StatementLog
+from bookkeeper.repository.memory_repository import MemoryRepository
+from bookkeeper.repository.query import Between, Ge, Gt, In, Like, Lt, Ne, TimeBucket
+from bookkeeper.repository.sqlite_repository import SQliteDatabase, SQliteRepository
 import pytest
 
 from dataclasses import dataclass
+from typing import ClassVar
 
 
 @pytest.fixture
@@ -74,3 +84,557 @@ def test_get_all_with_condition(repo, custom_class):
         objects.append(o)
     assert repo.get_all({"shop": "test"}) == objects
     assert repo.get_all({"it": 42}) == [objects[-1]]
+
+
+def test_shared_database(tmp_path, custom_class):
+    with SQliteDatabase(tmp_path / "shared.db") as db:
+        repo1 = SQliteRepository(db, custom_class)
+        repo2 = SQliteRepository(db, custom_class)
+        obj = custom_class(shop="test")
+        pk = repo1.add(obj)
+        assert repo2.get(pk) == obj
+        assert repo1.get_all() == repo2.get_all() == [obj]
+    with pytest.raises(sqlite3.ProgrammingError):
+        repo1.get(pk)
+
+
+def test_connection_per_thread(tmp_path, custom_class):
+    with SQliteRepository(tmp_path / "test_data.db", custom_class) as repo:
+        pk = repo.add(custom_class(it=1))
+        result = []
+        thread = threading.Thread(target=lambda: result.append(repo.get(pk)))
+        thread.start()
+        thread.join()
+        assert result == [repo.get(pk)]
+        assert len(repo._db._connections) == 2
+
+
+def test_foreign_keys_enabled(repo):
+    con = repo._db.connection
+    assert con.execute("PRAGMA foreign_keys").fetchone() == (1,)
+
+
+def test_add_many(repo, custom_class):
+    repo.add(custom_class())
+    objects = [custom_class(it=i) for i in range(5)]
+    pks = repo.add_many(objects)
+    assert pks == [2, 3, 4, 5, 6]
+    assert pks == [o.pk for o in objects]
+    assert repo.get_all()[1:] == objects
+
+
+def test_cannot_add_many_with_pk(repo, custom_class):
+    objects = [custom_class(), custom_class(pk=1)]
+    with pytest.raises(ValueError):
+        repo.add_many(objects)
+    assert repo.get_all() == []
+
+
+def test_update_many(repo, custom_class):
+    objects = [custom_class(it=i) for i in range(3)]
+    repo.add_many(objects)
+    for o in objects:
+        o.shop = "updated"
+    repo.update_many(objects)
+    assert repo.get_all() == objects
+
+
+def test_update_many_unexistent_rolls_back(repo, custom_class):
+    obj = custom_class()
+    repo.add(obj)
+    with pytest.raises(ValueError):
+        repo.update_many([custom_class(shop="new", pk=obj.pk), custom_class(pk=100)])
+    assert repo.get(obj.pk) == obj
+
+
+def test_delete_many(repo, custom_class):
+    objects = [custom_class(it=i) for i in range(3)]
+    repo.add_many(objects)
+    repo.delete_many([objects[0].pk, objects[2].pk])
+    assert repo.get_all() == [objects[1]]
+    with pytest.raises(KeyError):
+        repo.delete_many([objects[1].pk, 100])
+    assert repo.get_all() == [objects[1]]
+
+
+def test_iter_all(repo, custom_class):
+    objects = [custom_class(it=i, shop=str(i % 2)) for i in range(7)]
+    repo.add_many(objects)
+    gen = repo.iter_all(batch_size=2)
+    assert isgenerator(gen)
+    assert list(gen) == objects
+    assert list(repo.iter_all({"shop": "1"}, batch_size=2)) == objects[1::2]
+
+
+def test_get_all_with_predicates(repo, custom_class):
+    objects = [custom_class(expen=i / 2, shop="even" if i % 2 == 0 else "odd", it=i)
+               for i in range(5)]
+    repo.add_many(objects)
+    assert repo.get_all({"it": Ge(3)}) == objects[3:]
+    assert repo.get_all({"it": In([1, 4]), "shop": "odd"}) == [objects[1]]
+    assert repo.get_all({"shop": Like("EV%")}, order_by="-it") == objects[4::-2]
+    assert repo.get_all({"expen": Between(0.5, 1.5)}) == objects[1:4]
+    assert repo.get_all(order_by=["shop", "-it"], limit=2, offset=1) == [
+        objects[2], objects[0]]
+    assert repo.get_all(offset=4) == [objects[4]]
+    assert list(repo.iter_all({"it": Ne(0)}, batch_size=2, limit=2)) == objects[1:3]
+    assert repo.get_values(["pk", "it"], {"it": Lt(2)}) == [(1, 0), (2, 1)]
+
+
+@pytest.mark.parametrize("pattern", ["мол%", "%МОЛОКО%", "Хлеб_", "%ё%", "%", "m%",
+                                     "M_LK", "_лка", "%Ы"])
+def test_like_matches_memory_repository(repo, custom_class, pattern):
+    memory = MemoryRepository()
+    for shop in ["Молоко", "молоко и хлеб", "ХЛЕБЫ", "Ёлка", "milk", "MÏLK", ""]:
+        repo.add(custom_class(shop=shop))
+        memory.add(custom_class(shop=shop))
+    where = {"shop": Like(pattern)}
+    assert repo.get_all(where) == memory.get_all(where)
+
+
+def test_like_uses_builtin_operator_for_ascii():
+    assert Like("m%").to_sql("shop", str) == ("shop LIKE ?", ["m%"])
+    assert Like("Мол%").to_sql("shop", str) == ("unicode_lower(shop) LIKE ?", ["мол%"])
+
+
+def test_datetime_predicates(tmp_path):
+    @dataclass
+    class Dated:
+        moment: datetime = datetime(2023, 1, 1)
+        pk: int = 0
+
+    repo = SQliteRepository(tmp_path / "dated.db", Dated)
+    objects = [Dated(datetime(2023, 1, d)) for d in range(1, 6)]
+    repo.add_many(objects)
+    assert repo.get_all({"moment": Ge(datetime(2023, 1, 4))}) == objects[3:]
+    assert repo.get_values(["moment"], limit=1) == [(datetime(2023, 1, 1),)]
+
+
+def test_unknown_field(repo):
+    with pytest.raises(ValueError):
+        repo.get_all({"unknown": 1})
+    with pytest.raises(ValueError):
+        repo.get_all(order_by="-unknown")
+
+
+def test_none_condition(tmp_path):
+    @dataclass
+    class Node:
+        parent: int | None = None
+        pk: int = 0
+
+    repo = SQliteRepository(tmp_path / "nodes.db", Node)
+    root = Node()
+    repo.add(root)
+    child = Node(root.pk)
+    repo.add(child)
+    assert repo.get_all({"parent": None}) == [root]
+
+
+@pytest.fixture
+def indexed_class():
+    @dataclass
+    class Indexed:
+        name: str = ""
+        value: int = 0
+        pk: int = 0
+
+        indexes: ClassVar[tuple[Index, ...]] = (
+            Index("name", unique=True), Index("value", "name"))
+
+    return Indexed
+
+
+def index_names(db, table):
+    return {row[0] for row in db.connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?",
+        [table])}
+
+
+def test_declared_indexes(tmp_path, indexed_class):
+    with SQliteDatabase(tmp_path / "indexed.db") as db:
+        repo = SQliteRepository(db, indexed_class)
+        assert index_names(db, "Indexed") == {
+            "ux_Indexed_name", "ix_Indexed_value_name"}
+        repo.add(indexed_class("a"))
+        with pytest.raises(sqlite3.IntegrityError):
+            repo.add(indexed_class("a"))
+        plan = db.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM Indexed WHERE value = 1").fetchall()
+        assert "ix_Indexed_value_name" in str(plan)
+
+
+def test_schema_is_not_rebuilt(tmp_path, indexed_class):
+    with SQliteDatabase(tmp_path / "indexed.db") as db:
+        SQliteRepository(db, indexed_class)
+        statements = []
+        db.connection.set_trace_callback(statements.append)
+        SQliteRepository(db, indexed_class)
+        assert len(statements) == 1
+        assert statements[0].startswith("SELECT signature FROM _schema")
+
+
+def test_schema_migration(tmp_path, indexed_class):
+    @dataclass
+    class Indexed:
+        name: str = ""
+        pk: int = 0
+
+    with SQliteDatabase(tmp_path / "indexed.db") as db:
+        old_repo = SQliteRepository(db, Indexed)
+        old_repo.add(Indexed("a"))
+        assert index_names(db, "Indexed") == set()
+
+        repo = SQliteRepository(db, indexed_class)
+        assert repo.get_all() == [indexed_class("a", None, 1)]
+        repo.add(indexed_class("b", 2))
+        assert repo.get_all({"value": 2}) == [indexed_class("b", 2, 2)]
+        assert index_names(db, "Indexed") == {
+            "ux_Indexed_name", "ix_Indexed_value_name"}
+        assert db.connection.execute(
+            "SELECT version FROM _schema WHERE table_name = 'Indexed'"
+        ).fetchone() == (2,)
+
+        SQliteRepository(db, Indexed)
+        assert index_names(db, "Indexed") == set()
+
+
+@pytest.fixture
+def dated_class():
+    @dataclass
+    class Dated:
+        moment: datetime | None = None
+        note: str = ""
+        pk: int = 0
+
+        indexes: ClassVar[tuple[Index, ...]] = (Index("moment"),)
+
+    return Dated
+
+
+def test_epoch_datetime_storage(tmp_path, dated_class):
+    with SQliteDatabase(tmp_path / "dated.db") as db:
+        repo = SQliteRepository(db, dated_class, datetime_storage="epoch")
+        objects = [dated_class(datetime(2023, 1, d, 12, 30, 15, 123456)) for d in (1, 2)]
+        objects.append(dated_class(datetime(1960, 5, 4)))
+        objects.append(dated_class(None))
+        repo.add_many(objects)
+        assert repo.get_all() == objects
+        assert repo.get_all({"moment": Ge(datetime(2023, 1, 2))}) == [objects[1]]
+        stored = db.connection.execute("SELECT moment FROM Dated ORDER BY pk").fetchall()
+        assert [type(value) for value, in stored] == [int, int, int, type(None)]
+        plan = db.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM Dated WHERE moment >= 0").fetchall()
+        assert "ix_Dated_moment" in str(plan)
+
+
+def test_unknown_datetime_storage(tmp_path, dated_class):
+    with pytest.raises(ValueError):
+        SQliteRepository(tmp_path / "dated.db", dated_class, datetime_storage="iso")
+
+
+def test_datetime_storage_migration(tmp_path, dated_class):
+    with SQliteDatabase(tmp_path / "dated.db") as db:
+        text_repo = SQliteRepository(db, dated_class)
+        objects = [dated_class(datetime(2023, 1, d, 10, 0, 5), str(d)) for d in (1, 2)]
+        objects.append(dated_class(None, "none"))
+        text_repo.add_many(objects)
+
+        epoch_repo = SQliteRepository(db, dated_class, datetime_storage="epoch")
+        assert epoch_repo.get_all() == objects
+        assert epoch_repo.get_all({"moment": Ge(datetime(2023, 1, 2))}) == [objects[1]]
+        assert "ix_Dated_moment" in index_names(db, "Dated")
+        assert db.connection.execute(
+            "SELECT typeof(moment) FROM Dated WHERE pk = 1").fetchone() == ("integer",)
+
+        text_repo = SQliteRepository(db, dated_class)
+        assert text_repo.get_all() == objects
+        assert db.connection.execute(
+            "SELECT moment FROM Dated WHERE pk = 1"
+        ).fetchone() == ("2023-01-01 10:00:05",)
+
+
+@pytest.mark.parametrize("storage", ["text", "epoch"])
+def test_aggregate(tmp_path, dated_class, storage):
+    repo = SQliteRepository(tmp_path / "dated.db", dated_class, datetime_storage=storage)
+    moments = [datetime(2023, 11, d, 12) for d in (5, 13, 15, 19, 20)]
+    repo.add_many([dated_class(m, str(m.day % 2)) for m in moments])
+    repo.add(dated_class(None, "1"))
+    assert repo.aggregate("count") == 6
+    assert repo.aggregate("count", "moment") == 5
+    assert repo.aggregate("min", "moment") == moments[0]
+    assert repo.aggregate("max", "moment", {"note": "0"}) == moments[-1]
+    assert repo.aggregate("sum", "pk", {"pk": Gt(10)}) is None
+    assert repo.aggregate("count", group_by="note") == {"0": 1, "1": 5}
+    assert repo.aggregate("count", group_by=TimeBucket("moment", "week")) == {
+        date(2023, 10, 30): 1, date(2023, 11, 13): 3, date(2023, 11, 20): 1, None: 1}
+    assert repo.aggregate("max", "pk", {"moment": Ne(None)},
+                          group_by=TimeBucket("moment", "month")) == {
+        date(2023, 11, 1): 5}
+    assert repo.aggregate("count", group_by=TimeBucket("moment", "day"))[
+        date(2023, 11, 15)] == 1
+    with pytest.raises(ValueError):
+        repo.aggregate("avg", "pk")
+
+
+@pytest.fixture
+def db(tmp_path):
+    with SQliteDatabase(tmp_path / "shared.db") as db:
+        yield db
+
+
+def test_transaction_spans_repositories(db, custom_class, indexed_class):
+    repo1 = SQliteRepository(db, custom_class)
+    repo2 = SQliteRepository(db, indexed_class)
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    with repo1.transaction():
+        repo1.add(custom_class(it=1))
+        repo2.add_many([indexed_class("a"), indexed_class("b")])
+        repo1.update_many(repo1.get_all())
+    assert statements.count("COMMIT") == 1
+    assert len(repo1.get_all()) == 1
+    assert len(repo2.get_all()) == 2
+
+
+def test_transaction_rollback(db, custom_class, indexed_class):
+    repo1 = SQliteRepository(db, custom_class)
+    repo2 = SQliteRepository(db, indexed_class)
+    obj = custom_class(it=1)
+    repo1.add(obj)
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction():
+            repo1.delete(obj.pk)
+            repo2.add(indexed_class("a"))
+            repo2.add(indexed_class("a"))
+    assert repo1.get_all() == [obj]
+    assert repo2.get_all() == []
+
+
+def test_nested_transaction_rollback(db, custom_class):
+    repo = SQliteRepository(db, custom_class)
+    with repo.transaction():
+        repo.add(custom_class(it=1))
+        with pytest.raises(KeyError):
+            with repo.transaction():
+                repo.add(custom_class(it=2))
+                repo.delete(100)
+        repo.add(custom_class(it=3))
+    assert [o.it for o in repo.get_all()] == [1, 3]
+    assert not db.connection.in_transaction
+
+
+def test_change_events(repo, custom_class):
+    batches = []
+    unsubscribe = repo.subscribe(batches.append)
+    obj = custom_class(it=1)
+    repo.add(obj)
+    new = custom_class(pk=obj.pk, it=2)
+    repo.update(new)
+    others = [custom_class(it=3), custom_class(it=4)]
+    repo.add_many(others)
+    repo.delete_many([o.pk for o in others])
+    repo.delete(obj.pk)
+    assert [[(e.kind, e.old, e.new) for e in batch] for batch in batches] == [
+        [("added", None, obj)],
+        [("updated", obj, new)],
+        [("added", None, others[0]), ("added", None, others[1])],
+        [("deleted", others[0], None), ("deleted", others[1], None)],
+        [("deleted", new, None)],
+    ]
+    unsubscribe()
+    repo.add(custom_class())
+    assert len(batches) == 5
+
+
+def test_change_events_after_commit(db, custom_class):
+    repo = SQliteRepository(db, custom_class)
+    batches = []
+    repo.subscribe(batches.append)
+    with repo.transaction():
+        repo.add(custom_class(it=1))
+        with pytest.raises(KeyError):
+            with repo.transaction():
+                repo.add(custom_class(it=2))
+                repo.delete(100)
+        assert batches == []
+    assert [batch[0].new.it for batch in batches] == [1]
+    with pytest.raises(RuntimeError):
+        with repo.transaction():
+            repo.add(custom_class(it=3))
+            raise RuntimeError
+    assert len(batches) == 1
+
+
+def test_add_many_failure_keeps_pk(db, indexed_class):
+    repo = SQliteRepository(db, indexed_class)
+    objs = [indexed_class("a"), indexed_class("a")]
+    with pytest.raises(sqlite3.IntegrityError):
+        repo.add_many(objs)
+    assert [o.pk for o in objs] == [0, 0]
+    objs = [indexed_class("b"), indexed_class("c")]
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            repo.add_many(objs)
+            assert [o.pk for o in objs] != [0, 0]
+            raise RuntimeError
+    assert [o.pk for o in objs] == [0, 0]
+
+
+@pytest.mark.parametrize("key", ["value", "-value", "-pk"])
+def test_page(db, key):
+    @dataclass
+    class Paged:
+        name: str = ""
+        value: int | None = None
+        pk: int = 0
+
+        indexes: ClassVar[tuple[Index, ...]] = (Index("value"),)
+
+    repo = SQliteRepository(db, Paged)
+    repo.add_many(Paged("ab"[i % 2], None if i % 7 == 0 else i % 5) for i in range(20))
+    field = key.lstrip("-")
+    expected = repo.get_all(order_by=[key, key.replace(field, "pk")])
+    pages = [repo.page(key, 3)]
+    while pages[-1]:
+        last = pages[-1][-1]
+        pages.append(repo.page(key, 3, after=(getattr(last, field), last.pk)))
+    assert [o for page in pages for o in page] == expected
+    first = pages[-2][0]
+    assert repo.page(key, 3, before=(getattr(first, field), first.pk)) == pages[-3]
+    assert repo.page(key, 3, where={"name": "a"}) == [
+        o for o in expected if o.name == "a"][:3]
+
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    repo.page("value", 3, after=(2, 5))
+    plan = db.connection.execute("EXPLAIN QUERY PLAN " + statements[-1]).fetchall()
+    assert "OFFSET" not in statements[-1]
+    assert any("USING INDEX ix_Paged_value" in row[-1] for row in plan)
+    assert not any("TEMP B-TREE" in row[-1] for row in plan)
+
+
+@pytest.fixture
+def noted_class():
+    @dataclass
+    class Noted:
+        category: int = 0
+        comment: str | None = ""
+        pk: int = 0
+
+        indexes: ClassVar[tuple[Index, ...]] = (Index("comment", fulltext=True),)
+
+    return Noted
+
+
+COMMENTS = ["кофе с молоком", "Черный кофе", "чай", "кофейник", "кофе, кофе и кофе", None]
+
+
+def test_search(db, noted_class):
+    repo = SQliteRepository(db, noted_class)
+    repo.add_many(noted_class(i % 2, comment) for i, comment in enumerate(COMMENTS))
+    assert [o.pk for o in repo.search("кофе", "comment")] == [5, 2, 1]
+    assert {o.pk for o in repo.search("коф*", "comment")} == {1, 2, 4, 5}
+    assert [o.pk for o in repo.search('"черный кофе"', "comment")] == [2]
+    assert repo.search("кофе молоко", "comment") == []
+    assert {o.pk for o in repo.search("коф*", "comment", {"category": 0})} == {1, 5}
+    assert [o.pk for o in repo.search("кофе", "comment", limit=1)] == [5]
+    assert repo.search("", "comment") == []
+
+
+def test_search_follows_changes(db, noted_class):
+    repo = SQliteRepository(db, noted_class)
+    repo.add_many(noted_class(i % 2, comment) for i, comment in enumerate(COMMENTS))
+    obj = repo.get(3)
+    obj.comment = "кофе"
+    repo.update(obj)
+    obj = repo.get(4)
+    obj.category = 5
+    repo.update(obj)
+    repo.delete(5)
+    repo.delete_many([1])
+    assert {o.pk for o in repo.search("кофе", "comment")} == {2, 3}
+    assert repo.search("чай", "comment") == []
+    assert [o.pk for o in repo.search("кофейник", "comment")] == [4]
+
+
+def test_fulltext_migration(db, noted_class):
+    @dataclass
+    class Noted:
+        category: int = 0
+        comment: str | None = ""
+        pk: int = 0
+
+    old_repo = SQliteRepository(db, Noted)
+    old_repo.add_many(Noted(0, comment) for comment in COMMENTS)
+    repo = SQliteRepository(db, noted_class)
+    assert [o.pk for o in repo.search("кофе", "comment")] == [5, 2, 1]
+
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    repo.search("кофе", "comment")
+    assert any("MATCH" in sql for sql in statements)
+
+    SQliteRepository(db, Noted)
+    assert db.connection.execute(
+        "SELECT name FROM sqlite_master WHERE name LIKE 'fts%'").fetchall() == []
+    old_repo.add(Noted(0, "кофе"))
+    assert [o.pk for o in old_repo.search("кофе", "comment")] == [1, 2, 5, 7]
+
+
+def test_text_indexes_argument(db):
+    @dataclass
+    class Noted:
+        category: int = 0
+        comment: str | None = ""
+        pk: int = 0
+
+    def fts_tables():
+        return db.connection.execute(
+            "SELECT name FROM sqlite_master WHERE name LIKE 'fts%'").fetchall()
+
+    SQliteRepository(db, Noted).add_many(Noted(0, comment) for comment in COMMENTS)
+    assert fts_tables() == []
+    repo = SQliteRepository(db, Noted, text_indexes=["comment"])
+    assert ("fts_Noted_comment",) in fts_tables()
+    assert [o.pk for o in repo.search("кофе", "comment")] == [5, 2, 1]
+    with pytest.raises(ValueError):
+        SQliteRepository(db, Noted, text_indexes=["category"])
+
+
+def test_fulltext_index_requires_text(db):
+    @dataclass
+    class Numbered:
+        value: int = 0
+        pk: int = 0
+
+        indexes: ClassVar[tuple[Index, ...]] = (Index("value", fulltext=True),)
+
+    with pytest.raises(ValueError):
+        SQliteRepository(db, Numbered)
+    with pytest.raises(ValueError):
+        Index("value", unique=True, fulltext=True)
+
+
+def test_statements_are_parameterized(tmp_path, custom_class):
+    log = StatementLog()
+    with SQliteDatabase(tmp_path / "custom.db", log, cached_statements=16) as db:
+        repo = SQliteRepository(db, custom_class)
+        objs = [custom_class() for _ in range(3)]
+        repo.add_many(objs)
+        log.reset()
+        for obj in objs:
+            assert repo.get(obj.pk) == obj
+            obj.it = 5
+            repo.update(obj)
+        repo.delete(objs[0].pk)
+        repo.delete(objs[1].pk)
+        assert repo.get_all() == [objs[2]]
+    calls = {sql: stats.calls for sql, stats in log.statements.items()
+             if sql.startswith(("SELECT", "UPDATE", "DELETE"))}
+    assert calls == {
+        "SELECT pk, expen, shop, it FROM Custom WHERE pk = ?": 3,
+        "UPDATE Custom SET (expen, shop, it) = (?, ?, ?) WHERE pk = ?": 3,
+        "DELETE FROM Custom WHERE pk = ?": 2,
+        "SELECT pk, expen, shop, it FROM Custom": 1,
+    }